@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Verbs that page through the repository, the other verbs are short lookups
+BULK_VERBS = {'ListRecords', 'ListIdentifiers'}
+# The client that pages built in the background (prefetched and warmed pages) are admitted as
+BACKGROUND_CLIENT = 'background'
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f'Too many requests, retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A waiting request, compared by identity"""
+    def __init__(self, client: str):
+        self.client = client
+
+
+class Lane:
+    """Requests running and waiting in one lane, guarded by the lock of the controller"""
+    def __init__(self, limit: int, per_client: int, queue_size: int):
+        self.limit = limit
+        self.per_client = per_client
+        self.queue_size = queue_size
+        self.active = 0
+        self.active_by_client = Counter()
+        self.waiting = []
+
+    def eligible(self, client: str) -> bool:
+        if self.active >= self.limit:
+            return False
+        return self.per_client is None or self.active_by_client[client] < self.per_client
+
+    def may_start(self, ticket: Ticket) -> bool:
+        # First come, first served, but a client at its limit does not hold up the others
+        for waiting in self.waiting:
+            if self.eligible(waiting.client):
+                return waiting is ticket
+        return False
+
+
+class AdmissionController:
+    """
+    Admission control in front of the repository. Bulk verbs (ListRecords, ListIdentifiers) run in
+    a lane of `limit` requests where each client may run `per_client` requests at a time, the other
+    verbs in a separate priority lane, so that harvesters cannot starve lookups. Requests that
+    cannot start wait in a bounded queue per lane; a request is rejected when the queue (or the
+    client's share of it) is full, or when it has waited `timeout` seconds.
+
+    Behind proxies, clients are told apart by `client_header` (such as X-Forwarded-For), where each
+    of the `trusted_hops` proxies in front of the server appends the address it was reached from.
+    Addresses before those were sent by the client, and are not trusted.
+    """
+    def __init__(self, limit: int, priority_limit: int, per_client: int, queue_size: int,
+                 timeout: float, retry_after: int, client_header: str = None, trusted_hops: int = 1):
+        self.condition = threading.Condition()
+        self.lanes = {
+            'bulk': Lane(limit, per_client, queue_size),
+            'priority': Lane(priority_limit, None, queue_size),
+        }
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.client_header = client_header
+        self.trusted_hops = trusted_hops
+
+    @classmethod
+    def from_env(cls):
+        # Admission control is off unless ADMISSION_LIMIT is set
+        if not os.environ.get('ADMISSION_LIMIT'):
+            return None
+        limit = int(os.environ['ADMISSION_LIMIT'])
+        return cls(
+            limit=limit,
+            priority_limit=int(os.environ.get('ADMISSION_PRIORITY_LIMIT', str(limit))),
+            per_client=int(os.environ.get('ADMISSION_PER_CLIENT', '2')),
+            queue_size=int(os.environ.get('ADMISSION_QUEUE', str(2 * limit))),
+            timeout=float(os.environ.get('ADMISSION_TIMEOUT', '30')),
+            retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', '5')),
+            client_header=os.environ.get('ADMISSION_CLIENT_HEADER'),
+            trusted_hops=max(1, int(os.environ.get('ADMISSION_TRUSTED_HOPS', '1'))),
+        )
+
+    def client(self, headers, remote_addr: str) -> str:
+        # The address the outermost trusted proxy was reached from when behind proxies, else the peer address
+        if self.client_header and headers.get(self.client_header):
+            addresses = [address.strip() for address in headers[self.client_header].split(',')]
+            return addresses[max(0, len(addresses) - self.trusted_hops)]
+        return remote_addr or 'unknown'
+
+    @contextmanager
+    def admit(self, client: str, verb: str):
+        lane = self.lanes['bulk' if verb in BULK_VERBS else 'priority']
+        ticket = Ticket(client)
+        with self.condition:
+            if not (lane.eligible(client) and not lane.waiting):
+                queued_by_client = sum(1 for waiting in lane.waiting if waiting.client == client)
+                if len(lane.waiting) >= lane.queue_size or \
+                        (lane.per_client is not None and queued_by_client >= lane.per_client):
+                    raise Rejected(self.retry_after)
+            lane.waiting.append(ticket)
+            deadline = time.monotonic() + self.timeout
+            try:
+                while not lane.may_start(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected(self.retry_after)
+                    self.condition.wait(remaining)
+            finally:
+                lane.waiting.remove(ticket)
+                # A request leaving the queue can make way for the ones behind it
+                self.condition.notify_all()
+            lane.active += 1
+            lane.active_by_client[client] += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                lane.active -= 1
+                lane.active_by_client[client] -= 1
+                if not lane.active_by_client[client]:
+                    del lane.active_by_client[client]
+                self.condition.notify_all()
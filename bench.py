@@ -0,0 +1,105 @@
+"""
+Time the serialization of ListRecords pages with and without pretty printing (see COMPACT_XML),
+against an in-memory stand-in for Elasticsearch (see standin.py).
+
+    python bench.py                                     # 5000 records in pages of 100, MODS
+    python bench.py --records 20000 --count 500 --format oai_dc --repeat 5
+
+The metadata of every record is rendered into the fragment cache first, as the warmer does in a
+running repository. Every page of a full harvest is then built and serialized --repeat times in
+each mode, timing the building of the body (where cached metadata is parsed back, or collected to
+be spliced in) apart from document(). The best time of each page is kept. The times over the
+harvest are printed per KB of the pretty printed pages, so that both modes are measured against the
+same content. Fails unless both modes give the same documents, apart from whitespace between
+elements.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+os.environ.setdefault('ES_HOST_NAME', 'localhost')
+os.environ.setdefault('REPOSITORY_NAME', 'GUP')
+os.environ.setdefault('BASE_URL', 'https://example.org/oai/api')
+os.environ.setdefault('ADMIN_EMAIL', 'admin@example.org')
+os.environ.setdefault('IDENTIFIER_PREFIX', 'oai:gup.ub.gu.se')
+os.environ.setdefault('URI_PREFIX', 'https://gup.ub.gu.se/publication')
+
+from lxml import etree
+
+RESPONSE_DATE = re.compile(rb'<responseDate>[^<]*</responseDate>')
+MODES = ('pretty', 'compact')
+
+
+def harvest(repo, metadata_prefix: str) -> list:
+    # The parameters of every page of a full harvest
+    from prefetch import next_token
+    pages = [{'verb': 'ListRecords', 'metadataPrefix': metadata_prefix}]
+    while token := next_token(repo.process(dict(pages[-1])).document()):
+        pages.append({'verb': 'ListRecords', 'resumptionToken': token})
+    return pages
+
+
+def serve(repo, parameters: dict) -> tuple:
+    # Seconds spent building and serializing a page, and the document
+    started = time.perf_counter()
+    response = repo.process(dict(parameters))
+    built = time.perf_counter()
+    document = response.document()
+    return built - started, time.perf_counter() - built, document
+
+
+def canonical(document: bytes) -> bytes:
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(RESPONSE_DATE.sub(b'', document), parser))
+
+
+def main(args):
+    os.environ['COUNT'] = str(args.count)
+    os.environ['FRAGMENT_CACHE_SIZE'] = str(args.records)
+    from gupprovider import GUPProvider
+    from oai_repo.repository import OAIRepository
+    from standin import StandInES, synthetic_publications
+
+    provider = GUPProvider()
+    provider.es = StandInES(synthetic_publications(args.records))
+    repo = OAIRepository(provider)
+    started = time.monotonic()
+    for batch in provider.scan_publications():
+        for publication in batch:
+            provider.cache_metadata(publication, args.format)
+    print(f'Rendered {args.records} records in {time.monotonic() - started:.1f} s', file=sys.stderr)
+
+    pages = harvest(repo, args.format)
+    best = {mode: [(float('inf'), float('inf'))] * len(pages) for mode in MODES}
+    documents = {}
+    for _ in range(args.repeat):
+        for mode in MODES:
+            provider.compact_xml = mode == 'compact'
+            for number, parameters in enumerate(pages):
+                build, serialize, document = serve(repo, parameters)
+                best[mode][number] = tuple(map(min, best[mode][number], (build, serialize)))
+                documents[mode, number] = document
+
+    different = sum(
+        canonical(documents['pretty', number]) != canonical(documents['compact', number])
+        for number in range(len(pages))
+    )
+    kb = {mode: sum(len(documents[mode, number]) for number in range(len(pages))) / 1024 for mode in MODES}
+    print(f'{len(pages)} pages of {args.count} {args.format} records, {kb["pretty"]:.0f} KB pretty printed')
+    print(f'{"mode":8} {"KB":>8} {"build ms/KB":>12} {"serialize ms/KB":>16} {"total ms/KB":>12}')
+    for mode in MODES:
+        build, serialize = (sum(times) * 1000 / kb['pretty'] for times in zip(*best[mode]))
+        print(f'{mode:8} {kb[mode]:8.0f} {build:12.4f} {serialize:16.4f} {build + serialize:12.4f}')
+    if different:
+        raise SystemExit(f'{different} of {len(pages)} pages differ between the modes')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time pretty printed and compact ListRecords pages.')
+    parser.add_argument('--records', type=int, default=5000, help='synthetic publications to harvest')
+    parser.add_argument('--count', type=int, default=100, help='records per page')
+    parser.add_argument('--format', default='mods', help='metadataPrefix to harvest')
+    parser.add_argument('--repeat', type=int, default=3, help='times every page is served in each mode')
+    main(parser.parse_args())
@@ -0,0 +1,348 @@
+"""
+Caches of serialized metadata and responses, as bytes by string key with an optional time to live
+in seconds. CACHE_URL selects where they are kept:
+
+    memory:                         in each worker process (the default)
+    disk:///var/cache/gup-oai       files in a directory, shared by the workers of a host; use a
+                                    directory on /dev/shm to keep them in shared memory
+    resp://cache.local:6379/0       a Redis compatible key-value server, shared by all nodes
+
+A cache that fails is a cache that misses: errors are logged, and never fail a request.
+"""
+import hashlib
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+from coalesce import request_key
+from normalized import viewable_after
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """
+    A least recently used cache holding at most `max_entries` values in the memory of this process.
+
+    Repositories sharing the cache (see Namespaced) each have a namespace, the part of their keys
+    before the first ":". The bytes held by a namespace are counted, and kept within its quota by
+    dropping its own least recently used values.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # key -> (value, expiry time or None, namespace or None)
+        self.values = OrderedDict()
+        # Keys of each namespace, least recently used first, their size in bytes and their quota
+        self.namespaces = {}
+        self.sizes = {}
+        self.quotas = {}
+        self.lock = threading.Lock()
+
+    def add_namespace(self, namespace: str, max_bytes: int = None):
+        with self.lock:
+            self.namespaces.setdefault(namespace, OrderedDict())
+            self.sizes.setdefault(namespace, 0)
+            self.quotas[namespace] = max_bytes
+
+    def usage(self, namespace: str) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.namespaces.get(namespace, ())),
+                'bytes': self.sizes.get(namespace, 0),
+                'quota': self.quotas.get(namespace),
+            }
+
+    def get(self, key: str) -> bytes:
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.monotonic():
+                self.remove(key)
+                return None
+            self.values.move_to_end(key)
+            if entry[2] is not None:
+                self.namespaces[entry[2]].move_to_end(key)
+            return entry[0]
+
+    def get_many(self, keys: list) -> dict:
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        if self.max_entries < 1:
+            return
+        namespace = key.partition(':')[0] if self.namespaces else None
+        if namespace not in self.namespaces:
+            namespace = None
+        with self.lock:
+            self.remove(key)
+            self.values[key] = (value, time.monotonic() + ttl if ttl else None, namespace)
+            if namespace is not None:
+                self.namespaces[namespace][key] = None
+                self.sizes[namespace] += len(value)
+                quota = self.quotas[namespace]
+                while quota is not None and self.sizes[namespace] > quota:
+                    self.remove(next(iter(self.namespaces[namespace])))
+            while len(self.values) > self.max_entries:
+                self.remove(next(iter(self.values)))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.remove(key)
+
+    def remove(self, key: str):
+        # Called with the lock held
+        entry = self.values.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            del self.namespaces[entry[2]][key]
+            self.sizes[entry[2]] -= len(entry[0])
+
+
+class DiskCache:
+    """
+    One file per key in `directory`, each starting with its expiry time. Files are replaced
+    atomically, so processes sharing the directory never read a partly written value. When the
+    files written by this process add up to a tenth of `max_bytes`, the least recently written
+    files are removed until the directory holds at most `max_bytes`.
+    """
+    EXPIRY = struct.Struct('!d')
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key: str) -> bytes:
+        try:
+            with open(self.path(key), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning('Reading %s from the disk cache failed: %s', key, e)
+            return None
+        if len(data) < self.EXPIRY.size:
+            return None
+        expiry, = self.EXPIRY.unpack_from(data)
+        if expiry and expiry < time.time():
+            self.delete(key)
+            return None
+        return data[self.EXPIRY.size:]
+
+    def get_many(self, keys: list) -> dict:
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        path = self.path(key)
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(self.EXPIRY.pack(time.time() + ttl if ttl else 0))
+                file.write(value)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning('Writing %s to the disk cache failed: %s', key, e)
+            return
+        with self.lock:
+            self.written += len(value)
+            prune = self.written >= self.max_bytes // 10
+            if prune:
+                self.written = 0
+        if prune:
+            self.prune()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(file[1] for file in files)
+        for mtime, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+
+class RespError(Exception):
+    pass
+
+
+class RespCache:
+    """
+    Keys under `prefix` on a server speaking RESP, the Redis protocol (GET, MGET, SET with EX, DEL),
+    over one connection per thread. Eviction is left to the server (e.g. maxmemory-policy allkeys-lru).
+    """
+    def __init__(self, host: str, port: int, database: int, prefix: str, timeout: float):
+        self.address = (host, port)
+        self.database = database
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection = socket.create_connection(self.address, self.timeout)
+            self.local.connection = connection, connection.makefile('rb')
+            if self.database:
+                self.command(b'SELECT', str(self.database).encode())
+        return self.local.connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def command(self, *args: bytes):
+        connection, reader = self.connection()
+        request = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            request.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        connection.sendall(b''.join(request))
+        return self.reply(reader)
+
+    def reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection to the cache server closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RespError(rest.decode(errors='replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError('Connection to the cache server closed')
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self.reply(reader) for _ in range(count)]
+        raise RespError(f'Unexpected reply {line!r}')
+
+    def call(self, *args: bytes):
+        try:
+            return self.command(*args)
+        except RespError as e:
+            logger.warning('Cache server error: %s', e)
+        except OSError as e:
+            # Reconnect on the next call
+            logger.warning('Cache server unavailable: %s', e)
+            self.close()
+        return None
+
+    def key(self, key: str) -> bytes:
+        return (self.prefix + key).encode()
+
+    def get(self, key: str) -> bytes:
+        return self.call(b'GET', self.key(key))
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        values = self.call(b'MGET', *[self.key(key) for key in keys]) or []
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        if ttl:
+            self.call(b'SET', self.key(key), value, b'EX', str(max(1, math.ceil(ttl))).encode())
+        else:
+            self.call(b'SET', self.key(key), value)
+
+    def delete(self, key: str):
+        self.call(b'DEL', self.key(key))
+
+
+class Namespaced:
+    """
+    The keys of one repository in a cache tier shared by several, prefixed with `namespace` and ":".
+    """
+    def __init__(self, cache, namespace: str):
+        self.cache = cache
+        self.namespace = namespace
+        self.prefix = namespace + ':'
+
+    def get(self, key: str) -> bytes:
+        return self.cache.get(self.prefix + key)
+
+    def get_many(self, keys: list) -> dict:
+        values = self.cache.get_many([self.prefix + key for key in keys])
+        return {key[len(self.prefix):]: value for key, value in values.items()}
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        self.cache.set(self.prefix + key, value, ttl)
+
+    def delete(self, key: str):
+        self.cache.delete(self.prefix + key)
+
+    def usage(self) -> dict:
+        # Entries and bytes held in an in-memory tier, unknown for the shared backends
+        return self.cache.usage(self.namespace) if isinstance(self.cache, MemoryCache) else {}
+
+
+def open_cache(name: str, max_entries: int):
+    """
+    The cache tier `name` in the backend of CACHE_URL. `max_entries` bounds a memory cache, the
+    shared backends are bounded by CACHE_MAX_BYTES (disk) or by the server (resp).
+    """
+    url = urlsplit(os.environ.get('CACHE_URL', 'memory:'))
+    if url.scheme == 'memory':
+        return MemoryCache(max_entries)
+    if url.scheme == 'disk':
+        return DiskCache(
+            os.path.join(url.path, name), int(os.environ.get('CACHE_MAX_BYTES', str(1024 ** 3)))
+        )
+    if url.scheme == 'resp':
+        return RespCache(
+            url.hostname or 'localhost',
+            url.port or 6379,
+            int(url.path.strip('/') or '0'),
+            f'gup-oai:{name}:',
+            float(os.environ.get('CACHE_TIMEOUT', '0.5')),
+        )
+    raise ValueError(f'Unknown CACHE_URL scheme {url.scheme}')
+
+
+def fragment_key(publication, metadata_prefix: str) -> str:
+    # Metadata of a publication (_source) is rendered again whenever it is updated, and when the
+    # embargo of a full text file ends, which shows the file without an update (see normalized.py)
+    after = viewable_after(publication.get('files'))
+    viewable = 'v' if after is not None and after <= datetime.now() else 'n'
+    return f'{metadata_prefix}:{publication["id"]}:{publication["updated_at"]}:{viewable}'
+
+
+def response_key(parameters: dict) -> str:
+    return 'response:' + urlencode(request_key(parameters))
@@ -0,0 +1,45 @@
+import threading
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function once for concurrent calls with the same key: the first caller computes, callers
+    arriving while it is running wait and get the same result (or exception). Nothing is kept after
+    the computation has finished, so a later call computes again.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, function, *args):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if leader:
+            try:
+                flight.result = function(*args)
+            except BaseException as error:
+                flight.error = error
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+def request_key(parameters: dict) -> tuple:
+    # Requests with the same arguments, in any order and by GET or POST, get the same response
+    return tuple(sorted(parameters.items()))
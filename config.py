@@ -0,0 +1,180 @@
+"""
+Configuration of the repository and its data provider, read from the environment and validated
+once when a worker starts. Optional features (admission, caches, tracing and so on) keep reading
+their own settings in their from_env classmethods.
+
+One process can serve several repositories (see repository_configs). The default repository is
+configured by the variables read in Config.from_env and served under /oai. Each repository named
+in REPOSITORIES is served under /oai/<name>, and configured by the same variables prefixed with
+its name in upper case. Only the variables in INHERITED fall back to those of the default
+repository; those choosing what a repository serves and where (its index, deletion log, harvest
+order, BASE_URL and so on) take their defaults unless they are given with the prefix:
+
+    REPOSITORIES=test
+    TEST_ES_INDEX=publications_test
+    TEST_REPOSITORY_NAME=GUP (test)
+    TEST_BASE_URL=https://gup.ub.gu.se/oai/test/api
+"""
+import os
+import re
+from typing import NamedTuple
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _number(environ, name: str, convert, default):
+    value = environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        raise ConfigError(f'{name} must be a number, not {value!r}') from None
+
+
+class Config(NamedTuple):
+    es_host: str
+    count: int
+    repository_name: str
+    base_url: str
+    admin_email: str
+    identifier_prefix: str
+    uri_prefix: str
+    # The index, the source of the publications in it (their internal identifiers are the source,
+    # "_" and the publication_id), and the set of publications affiliated with the institution
+    index: str = 'publications'
+    source: str = 'gup'
+    root_set: str = 'gu'
+    root_set_name: str = 'Göteborgs universitet'
+    # Bytes this repository may hold in each in-memory cache tier shared with other repositories
+    cache_quota: int = None
+    harvest_order: str = 'publication_id'
+    deleted_record: str = 'transient'
+    deletion_index: str = None
+    deletion_sync_interval: float = 300
+    # Budgets that close a ListRecords page before the limit, in seconds and bytes
+    page_time_budget: float = None
+    page_byte_budget: int = None
+    # Responses without pretty printing, with the serialized metadata of records spliced in
+    compact_xml: bool = False
+    render_workers: int = 0
+    # Concurrent slices to fetch pages of at least fetch_slice_min hits and scans in, 0 for none
+    fetch_slices: int = 0
+    fetch_slice_min: int = 1000
+    render_pool_min: int = 100
+    fragment_cache_size: int = 20000
+    normalized_cache_size: int = 10000
+    set_refresh_interval: float = 3600
+    datestamp_refresh_interval: float = 600
+    datestamp_margin: float = 300
+    identifier_refresh_interval: float = 60
+    # Secret the resumptionTokens are signed with, and the seconds they stay valid. One process signs
+    # the tokens of all its repositories with those of the default repository. Without a secret a
+    # random one is used, so workers and nodes serving the same repository must share TOKEN_SECRET.
+    token_secret: str = None
+    token_ttl: float = 86400
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> 'Config':
+        missing = [
+            name for name in ('ES_HOST_NAME', 'COUNT', 'REPOSITORY_NAME', 'BASE_URL', 'ADMIN_EMAIL',
+                              'IDENTIFIER_PREFIX', 'URI_PREFIX')
+            if not environ.get(name)
+        ]
+        if missing:
+            raise ConfigError(f'Missing configuration: {", ".join(missing)}')
+        return cls(
+            es_host=environ['ES_HOST_NAME'],
+            count=_number(environ, 'COUNT', int, None),
+            repository_name=environ['REPOSITORY_NAME'],
+            base_url=environ['BASE_URL'],
+            admin_email=environ['ADMIN_EMAIL'],
+            identifier_prefix=environ['IDENTIFIER_PREFIX'],
+            uri_prefix=environ['URI_PREFIX'],
+            index=environ.get('ES_INDEX') or 'publications',
+            source=environ.get('PUBLICATION_SOURCE') or 'gup',
+            root_set=environ.get('ROOT_SET') or 'gu',
+            root_set_name=environ.get('ROOT_SET_NAME') or 'Göteborgs universitet',
+            cache_quota=int(_number(environ, 'CACHE_QUOTA_MB', float, 0) * 1024 * 1024) or None,
+            harvest_order=environ.get('HARVEST_ORDER', 'publication_id'),
+            deleted_record=environ.get('DELETED_RECORD', 'transient'),
+            deletion_index=environ.get('DELETION_INDEX') or None,
+            deletion_sync_interval=_number(environ, 'DELETION_SYNC_INTERVAL', float, 300),
+            page_time_budget=_number(environ, 'PAGE_TIME_BUDGET_MS', float, 0) / 1000 or None,
+            page_byte_budget=_number(environ, 'PAGE_BYTE_BUDGET', int, 0) or None,
+            compact_xml=environ.get('COMPACT_XML', 'false').lower() == 'true',
+            render_workers=_number(environ, 'RENDER_WORKERS', int, 0),
+            fetch_slices=_number(environ, 'FETCH_SLICES', int, 0),
+            fetch_slice_min=_number(environ, 'FETCH_SLICE_MIN', int, 1000),
+            render_pool_min=_number(environ, 'RENDER_POOL_MIN', int, 100),
+            fragment_cache_size=_number(environ, 'FRAGMENT_CACHE_SIZE', int, 20000),
+            normalized_cache_size=_number(environ, 'NORMALIZED_CACHE_SIZE', int, 10000),
+            set_refresh_interval=_number(environ, 'SET_REFRESH_INTERVAL', float, 3600),
+            datestamp_refresh_interval=_number(environ, 'DATESTAMP_REFRESH_INTERVAL', float, 600),
+            datestamp_margin=_number(environ, 'DATESTAMP_MARGIN', float, 300),
+            identifier_refresh_interval=_number(environ, 'IDENTIFIER_REFRESH_INTERVAL', float, 60),
+            token_secret=environ.get('TOKEN_SECRET') or None,
+            token_ttl=_number(environ, 'TOKEN_TTL', float, 86400),
+        ).validated()
+
+    def validated(self) -> 'Config':
+        if self.count < 1:
+            raise ConfigError('COUNT must be at least 1')
+        # Harvest order: 'publication_id', or 'updated_at' for date ordered pages on an index sorted
+        # by (updated_at, publication_id) (see reindex.py)
+        if self.fetch_slices < 0:
+            raise ConfigError('FETCH_SLICES must not be negative')
+        if self.harvest_order not in ('publication_id', 'updated_at'):
+            raise ConfigError(f'Unknown HARVEST_ORDER {self.harvest_order}')
+        if self.deleted_record not in ('no', 'transient', 'persistent'):
+            raise ConfigError(f'Unknown DELETED_RECORD {self.deleted_record}')
+        # Deleted records are only kept for good when they are logged
+        if self.deleted_record == 'persistent' and self.deletion_index is None:
+            raise ConfigError('DELETED_RECORD=persistent requires a deletion log (DELETION_INDEX)')
+        # Publications marked as deleted are only harvested once they are logged (see deletions.py)
+        if self.deletion_index is not None and self.deletion_sync_interval <= 0:
+            raise ConfigError('DELETION_INDEX requires a DELETION_SYNC_INTERVAL')
+        return self
+
+    @property
+    def internal_prefix(self) -> str:
+        return f'{self.source}_'
+
+
+# Variables of the default repository that a named repository falls back to
+INHERITED = {
+    'ES_HOST_NAME', 'COUNT', 'REPOSITORY_NAME', 'ADMIN_EMAIL', 'IDENTIFIER_PREFIX', 'URI_PREFIX',
+    'ROOT_SET', 'ROOT_SET_NAME', 'CACHE_QUOTA_MB', 'PAGE_TIME_BUDGET_MS', 'PAGE_BYTE_BUDGET',
+    'COMPACT_XML', 'RENDER_WORKERS', 'FETCH_SLICES', 'FETCH_SLICE_MIN', 'RENDER_POOL_MIN',
+    'FRAGMENT_CACHE_SIZE', 'NORMALIZED_CACHE_SIZE', 'SET_REFRESH_INTERVAL', 'DATESTAMP_REFRESH_INTERVAL',
+    'DATESTAMP_MARGIN', 'IDENTIFIER_REFRESH_INTERVAL', 'DELETION_SYNC_INTERVAL',
+}
+
+# Names taken by the endpoints of the default repository
+RESERVED_NAMES = {'api', 'static', 'dump', 'health', 'ready', 'metrics', 'default'}
+
+
+def repository_configs(environ=os.environ) -> dict:
+    """
+    Config of the default repository ("default") and of each repository named in REPOSITORIES.
+    """
+    configs = {'default': Config.from_env(environ)}
+    for name in (name.strip() for name in environ.get('REPOSITORIES', '').split(',')):
+        if not name:
+            continue
+        if not re.fullmatch(r'[a-z0-9][a-z0-9_-]*', name) or name in RESERVED_NAMES:
+            raise ConfigError(f'Invalid repository name {name!r}')
+        prefix = name.upper().replace('-', '_') + '_'
+        inherited = {key: value for key, value in environ.items() if key in INHERITED}
+        overrides = {key[len(prefix):]: value for key, value in environ.items() if key.startswith(prefix)}
+        try:
+            config = Config.from_env({**inherited, **overrides})
+        except ConfigError as e:
+            raise ConfigError(f'Repository {name} (variables prefixed with {prefix}): {e}') from None
+        # Identify of a mounted repository must not point harvesters at another one
+        if config.base_url == configs['default'].base_url:
+            raise ConfigError(f'Repository {name} needs a BASE_URL of its own ({prefix}BASE_URL)')
+        configs[name] = config
+    return configs
@@ -0,0 +1,138 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+import harvestquery
+from refresher import PeriodicRefresher
+from sets import SET_FIELDS
+
+
+def parse_datestamp(value: str) -> datetime:
+    # An ES value_as_string (or key_as_string) truncated to the second
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def as_datetime(date, until: bool = False) -> datetime:
+    return None if date is None else parse_datestamp(harvestquery.normalize_date(date, until))
+
+
+class DatestampStats:
+    """
+    The first and last updated_at, and the days with updates, of the whole repository and of each
+    set, taken from one aggregation that is refreshed in the background every `interval` seconds.
+    Per day counts are kept for the repository, its root set and the top level sets, the sets below
+    them only have first and last datestamps.
+
+    Updates made after a snapshot are not in it. Updates with an updated_at older than `margin`
+    seconds before the snapshot are assumed to be searchable when it was taken (this covers the
+    refresh interval of the index and GUP setting updated_at before saving), so a window ending
+    before that can be decided from the snapshot alone.
+
+    Lookups never wait for the aggregation. Until it is first loaded (see warm), the earliest
+    datestamp is unknown and every window is searched for.
+    """
+    def __init__(self, search, interval: float, margin: float, source: str = 'gup', root_set: str = 'gu'):
+        self.search = search
+        self.source = source
+        self.root_set = root_set
+        self.margin = timedelta(seconds=margin)
+        self.refresher = PeriodicRefresher('datestamps', self.load, interval)
+
+    def load(self) -> dict:
+        datestamps = {
+            'first': {'min': {'field': 'updated_at'}},
+            'last': {'max': {'field': 'updated_at'}},
+        }
+        days = {
+            'days': {
+                'date_histogram': {
+                    'field': 'updated_at',
+                    'calendar_interval': 'day',
+                    'format': 'yyyy-MM-dd',
+                    'min_doc_count': 1,
+                }
+            }
+        }
+        top_sets = {self.root_set: harvestquery.set_filter(self.root_set, self.root_set)[0]}
+        top_sets.update({top: harvestquery.set_filter(top)[0] for top in SET_FIELDS})
+        aggregations = {
+            **datestamps,
+            **days,
+            'sets': {'filters': {'filters': top_sets}, 'aggs': {**datestamps, **days}},
+        }
+        for top, path in SET_FIELDS.items():
+            aggregations[f'{top}_values'] = {'terms': {'field': path, 'size': 10000}, 'aggs': datestamps}
+        # Publications marked as deleted are counted too, so that the snapshot covers everything
+        # that can be harvested, with or without a deletion log
+        query = {
+            'size': 0,
+            'query': harvestquery.harvest_query(source=self.source, root_set=self.root_set),
+            'aggs': aggregations,
+        }
+        results = self.search(query)['aggregations']
+
+        stats = {None: self.entry(results)}
+        for set_spec, bucket in results['sets']['buckets'].items():
+            stats[set_spec] = self.entry(bucket)
+        for top in SET_FIELDS:
+            for bucket in results[f'{top}_values']['buckets']:
+                stats[f"{top}:{bucket['key']}"] = self.entry(bucket)
+        # Sets without publications are left out
+        return {set_spec: entry for set_spec, entry in stats.items() if entry is not None}
+
+    def entry(self, aggregation: dict) -> tuple:
+        # (first, last, sorted days with updates or None) of a bucket, or None if it is empty
+        if aggregation['first'].get('value') is None:
+            return None
+        days = None
+        if 'days' in aggregation:
+            days = [bucket['key_as_string'][:10] for bucket in aggregation['days']['buckets'] if bucket['doc_count']]
+        return (
+            parse_datestamp(aggregation['first']['value_as_string']),
+            parse_datestamp(aggregation['last']['value_as_string']),
+            days
+        )
+
+    def warm(self):
+        # Load the aggregation in the calling thread, unless it is loaded
+        self.refresher.get()
+
+    def earliest(self) -> str:
+        # The earliest datestamp in the repository, or None if it is empty or not loaded yet
+        entry = (self.refresher.peek() or {}).get(None)
+        return entry[0].strftime(harvestquery.DATE_FORMAT) if entry else None
+
+    def covered_until(self, loaded_at: float) -> datetime:
+        return datetime.fromtimestamp(loaded_at, timezone.utc) - self.margin
+
+    def window_is_empty(self, set, from_date, until_date, probe) -> bool:
+        """
+        True if no publication in the set can have a datestamp within from_date and until_date.
+        The part of the window after the snapshot is checked with `probe(from_date, until_date)`,
+        a query that only needs to find out whether there is any matching publication at all.
+        """
+        # The time of the snapshot is read first, a refresh in between then only makes it look older
+        loaded_at = self.refresher.loaded_at
+        stats = self.refresher.peek()
+        if stats is None or loaded_at is None:
+            return False
+        covered_until = self.covered_until(loaded_at)
+        from_date, until_date = as_datetime(from_date), as_datetime(until_date, until=True)
+        end = covered_until if until_date is None else min(until_date, covered_until)
+        if self.overlaps(stats.get(set), from_date, end):
+            return False
+        if until_date is not None and until_date < covered_until:
+            return True
+        start = covered_until if from_date is None else max(from_date, covered_until)
+        return not probe(start, until_date)
+
+    def overlaps(self, entry: tuple, start: datetime, end: datetime) -> bool:
+        if entry is None:
+            return False
+        first, last, days = entry
+        if (start is not None and last < start) or first > end:
+            return False
+        if days is None:
+            return True
+        # Is there a day with updates from the day of start to the day of end?
+        index = bisect_left(days, (start or first).strftime('%Y-%m-%d'))
+        return index < len(days) and days[index] <= end.strftime('%Y-%m-%d')
@@ -0,0 +1,193 @@
+"""
+Append-only log of deleted publications, kept in its own ES index.
+
+Each deleted publication is kept as a tombstone document: the fields a record header and the
+harvest filters need (id, publication_id, source, affiliated and the set fields), deleted: true,
+and updated_at set to the time the deletion was logged. Harvest queries search the publications
+index and the deletion log together, so a from= harvest finds deletions through the same indexed
+range query as updates, also when the publication is gone from the publications index.
+Publications still marked as deleted in the publications index are harvested from the log only,
+so deletions must be logged: by GUP calling record(), and by the server running sync every
+DELETION_SYNC_INTERVAL seconds. A deletion is not harvested until it is logged, and its datestamp
+is the time it was logged. A harvester that ran in between then still gets it on its next from=
+harvest.
+
+The first sync of a process goes through all deleted publications and the whole log. Later syncs
+only look at publications with an updated_at since the previous sync (less `margin` seconds, for
+updates that were not searchable yet), as GUP sets updated_at when it deletes or restores one.
+
+    python deletions.py create              # create the deletion log index
+    python deletions.py sync                # log all publications marked as deleted
+    python deletions.py record <id>...      # log the given publication ids as deleted now
+    python deletions.py sync --repository theses
+
+The log, its publications index and source are those configured for the repository (the default
+one, or one named in REPOSITORIES, see config.py).
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from elasticsearch import Elasticsearch, helpers
+
+import harvestquery
+from config import repository_configs
+from sets import SET_FIELDS, field_values
+
+MAPPING = {
+    'dynamic': 'strict',
+    'properties': {
+        'id': {'type': 'keyword'},
+        'publication_id': {'type': 'long'},
+        'source': {'type': 'keyword'},
+        'deleted': {'type': 'boolean'},
+        'affiliated': {'type': 'boolean'},
+        'deleted_at': {'type': 'date'},
+        'updated_at': {'type': 'date'},
+        'created_at': {'type': 'date'},
+        'affiliations': {'properties': {'department_id': {'type': 'long'}}},
+        'categories': {'properties': {'svep_id': {'type': 'long'}}},
+        'publication_type_code': {'type': 'keyword'},
+    }
+}
+
+# Sorted like the publications index (see reindex.py), for date ordered harvests
+SETTINGS = {
+    'index': {
+        'sort.field': ['updated_at', 'publication_id'],
+        'sort.order': ['asc', 'asc'],
+    }
+}
+
+
+class DeletionLog:
+    def __init__(self, es: Elasticsearch, index: str, publications_index: str = 'publications',
+                 source: str = 'gup', margin: float = 300):
+        self.es = es
+        self.index = index
+        self.publications_index = publications_index
+        self.source = source
+        self.margin = timedelta(seconds=margin)
+        # When the last sync started, None before the first one
+        self.synced_at = None
+
+    def create(self):
+        if not self.es.indices.exists(index=self.index):
+            self.es.indices.create(index=self.index, mappings=MAPPING, settings=SETTINGS)
+
+    def tombstone(self, publication: dict, deleted_at: str = None) -> dict:
+        # The parts of a publication (_source) that are kept after it has been deleted
+        deleted_at = deleted_at or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        tombstone = {
+            'id': publication['id'],
+            'publication_id': publication['publication_id'],
+            'source': publication.get('source'),
+            'deleted': True,
+            'affiliated': publication.get('affiliated'),
+            'deleted_at': deleted_at,
+            'updated_at': deleted_at,
+            'created_at': publication.get('created_at') or deleted_at,
+        }
+        # Keep the set memberships, so that selective harvests see the deletion
+        for top, path in SET_FIELDS.items():
+            values = field_values(publication, path)
+            if '.' in path:
+                parent, key = path.split('.', 1)
+                tombstone[parent] = [{key: value} for value in values]
+            elif values:
+                tombstone[path] = values[0]
+        return tombstone
+
+    def record(self, publication: dict, deleted_at: str = None):
+        self.es.index(index=self.index, id=publication['id'], document=self.tombstone(publication, deleted_at))
+
+    def exists(self, internal_identifier: str) -> bool:
+        return self.es.exists(index=self.index, id=internal_identifier)
+
+    def get(self, internal_identifier: str) -> dict:
+        # The tombstone as an ES hit, or None if the publication is not in the log
+        if self.es.exists(index=self.index, id=internal_identifier):
+            return self.es.get(index=self.index, id=internal_identifier)
+        return None
+
+    def forget(self, internal_identifier: str):
+        self.es.delete(index=self.index, id=internal_identifier)
+
+    def sync(self) -> int:
+        # Log every publication marked as deleted in the publications index, as deleted now: it was
+        # left out of harvests until now, so an earlier datestamp could be before a harvest that
+        # missed it. Already logged publications keep their original entry.
+        started_at = datetime.now(timezone.utc)
+        since = self.synced_at - self.margin if self.synced_at is not None else None
+        self.forget_restored(since)
+        deleted = helpers.scan(self.es, index=self.publications_index, query={
+            'query': {'bool': {'filter': [
+                {'term': {'source': self.source}}, {'term': {'deleted': True}}
+            ] + harvestquery.datestamp_filter(since)}}
+        })
+        actions = (
+            {
+                '_op_type': 'create',
+                '_index': self.index,
+                '_id': hit['_source']['id'],
+                '_source': self.tombstone(hit['_source']),
+            }
+            for hit in deleted
+        )
+        created, errors = helpers.bulk(self.es, actions, raise_on_error=False)
+        # Conflicts are publications that were already logged
+        failures = [error for error in errors if error.get('create', {}).get('status') != 409]
+        if failures:
+            raise RuntimeError(f'Failed to log {len(failures)} deletions: {failures[:3]}')
+        self.synced_at = started_at
+        return created
+
+    def forget_restored(self, since: datetime = None):
+        # Remove the entries of publications that are back in the index without being deleted, of
+        # those updated since `since` if given
+        if since is not None:
+            restored = [hit['_id'] for hit in helpers.scan(self.es, index=self.publications_index, query={
+                '_source': False,
+                'query': {'bool': {
+                    'filter': [{'term': {'source': self.source}}] + harvestquery.datestamp_filter(since),
+                    'must_not': [{'term': {'deleted': True}}],
+                }}
+            })]
+            for start in range(0, len(restored), 1000):
+                docs = self.es.mget(index=self.index, ids=restored[start:start + 1000], _source=False)
+                for doc in docs['docs']:
+                    if doc.get('found'):
+                        self.forget(doc['_id'])
+            return
+        logged = [hit['_id'] for hit in helpers.scan(self.es, index=self.index, query={'_source': False})]
+        for start in range(0, len(logged), 1000):
+            docs = self.es.mget(index=self.publications_index, ids=logged[start:start + 1000], _source=['deleted'])
+            for doc in docs['docs']:
+                if doc.get('found') and not doc['_source'].get('deleted'):
+                    self.forget(doc['_id'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the log of deleted publications.')
+    parser.add_argument('command', choices=['create', 'sync', 'record'])
+    parser.add_argument('publication_ids', nargs='*', help='publication ids to log as deleted (record)')
+    parser.add_argument('--repository', default='default',
+                        help='repository of the log, "default" or one of REPOSITORIES')
+    args = parser.parse_args()
+
+    configs = repository_configs()
+    if args.repository not in configs:
+        raise SystemExit(f'Unknown repository {args.repository}')
+    config = configs[args.repository]
+    if config.deletion_index is None:
+        raise SystemExit(f'Repository {args.repository} has no deletion log (DELETION_INDEX)')
+    es = Elasticsearch(hosts=[{'host': config.es_host, 'port': 9200, 'scheme': 'http'}])
+    log = DeletionLog(es, config.deletion_index, config.index, config.source, config.datestamp_margin)
+    if args.command == 'create':
+        log.create()
+    elif args.command == 'sync':
+        log.create()
+        print(f'{log.sync()} deletions logged')
+    else:
+        for publication_id in args.publication_ids:
+            publication = es.get(index=log.publications_index, id=f'{config.internal_prefix}{publication_id}')['_source']
+            log.record(publication)
@@ -0,0 +1,187 @@
+"""
+Dump the whole corpus (or the publications changed since the last dump) to static files.
+
+    python dump.py --output /data/dump                 # full dump as ListRecords pages
+    python dump.py --output /data/dump --incremental   # only records updated since the last dump
+    python dump.py --output /data/dump --format mods   # a single modsCollection file
+    python dump.py --output /data/dump --metadata-prefix oai_dc --repository theses
+
+ListRecords pages are written as gzipped OAI-PMH responses where the resumptionToken of each page
+is the file name of the next page. A manifest.json in the output directory lists the runs and
+their files, and is what incremental dumps use to find the time of the last run. The directory can
+be served as static files or by the /oai/dump endpoint of oaiserver (see DUMP_DIR).
+
+Records are rendered with the config of the repository being dumped (the default one, or one named
+in REPOSITORIES), so that they are the same as /oai/api serves them.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import lxml.etree as ET
+
+import rendering
+from config import repository_configs
+from gupprovider import GUPProvider
+
+MANIFEST = 'manifest.json'
+MODS_NAMESPACE = 'http://www.loc.gov/mods/v3'
+
+
+def write_gzip(path: str, chunks):
+    # Write to a temporary file first so that a served file is never incomplete
+    with gzip.open(path + '.tmp', 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'last_dump': None, 'runs': []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(directory: str, manifest: dict):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class ListRecordsWriter:
+    def __init__(self, directory: str, run: str, started_at: datetime, total: int, base_url: str,
+                 metadata_prefix: str):
+        self.directory = directory
+        self.run = run
+        self.total = total
+        self.cursor = 0
+        self.files = []
+        self.prefix, self.suffix = rendering.envelope(
+            base_url, started_at, {'verb': 'ListRecords', 'metadataPrefix': metadata_prefix}
+        )
+
+    def page_name(self, number: int) -> str:
+        return f'{self.run}-{number:05d}.xml.gz'
+
+    def write(self, fragments: list, last: bool):
+        name = self.page_name(len(self.files) + 1)
+        token = ET.Element('resumptionToken')
+        token.set('cursor', str(self.cursor))
+        token.set('completeListSize', str(self.total))
+        if not last:
+            token.text = self.page_name(len(self.files) + 2)
+        write_gzip(os.path.join(self.directory, name), [
+            self.prefix, b'<ListRecords>', *fragments, ET.tostring(token), b'</ListRecords>', self.suffix
+        ])
+        self.files.append(name)
+        self.cursor += len(fragments)
+
+
+def dump(provider: GUPProvider, directory: str, format: str, incremental: bool, set: str,
+         batch_size: int, workers: int, metadata_prefix: str = 'mods') -> dict:
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    started_at = datetime.now(timezone.utc)
+    from_date = None
+    if incremental:
+        if not manifest['last_dump']:
+            raise SystemExit('No previous dump found, run a full dump first.')
+        from_date = manifest['last_dump']
+
+    run = ('incremental-' if incremental else 'full-') + started_at.strftime('%Y%m%dT%H%M%SZ')
+    total = provider.count_publications(set, from_date)
+    entry = {
+        'name': run,
+        'type': 'incremental' if incremental else 'full',
+        'format': format,
+        'metadata_prefix': 'mods' if format == 'mods' else metadata_prefix,
+        'set': set,
+        'from': from_date,
+        'started_at': started_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'records': 0,
+        'files': [],
+    }
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=rendering.init_worker,
+                             initargs=(provider.config,)) as pool:
+        batches = provider.scan_publications(set, from_date, batch_size)
+        if format == 'mods':
+            entry['deleted'] = []
+
+            def collection():
+                yield b"<?xml version='1.0' encoding='UTF-8'?>\n"
+                yield b'<modsCollection xmlns="' + MODS_NAMESPACE.encode() + b'">'
+                for batch in batches:
+                    chunksize = max(1, len(batch) // (workers * 4))
+                    for publication, mods in zip(batch, pool.map(rendering.render_mods, batch, chunksize=chunksize)):
+                        if mods is None:
+                            entry['deleted'].append(publication['publication_id'])
+                        else:
+                            entry['records'] += 1
+                            yield mods
+                yield b'</modsCollection>'
+
+            name = f'{run}.mods.xml.gz'
+            write_gzip(os.path.join(directory, name), collection())
+            entry['files'] = [name]
+        else:
+            writer = ListRecordsWriter(directory, run, started_at, total, provider.config.base_url, metadata_prefix)
+            pending = None
+            for batch in batches:
+                chunksize = max(1, len(batch) // (workers * 4))
+                fragments = list(pool.map(
+                    rendering.render_record, batch, [metadata_prefix] * len(batch), chunksize=chunksize
+                ))
+                # A page is written when the next one is known to exist, so the last page gets no token
+                if pending:
+                    writer.write(pending, last=False)
+                pending = fragments
+                entry['records'] += len(fragments)
+            if pending:
+                writer.write(pending, last=True)
+            entry['files'] = writer.files
+
+    # A full dump replaces all earlier runs, incremental runs are appended
+    if incremental:
+        manifest['runs'].append(entry)
+    else:
+        obsolete = [name for old in manifest['runs'] for name in old['files']]
+        manifest['runs'] = [entry]
+    manifest['last_dump'] = entry['started_at']
+    write_manifest(directory, manifest)
+    if not incremental:
+        for name in obsolete:
+            if name not in entry['files'] and os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+    return entry
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dump publications to static OAI-PMH or MODS files.')
+    parser.add_argument('--output', required=True, help='directory to write the dump to')
+    parser.add_argument('--format', choices=['listrecords', 'mods'], default='listrecords')
+    parser.add_argument('--metadata-prefix', choices=['mods', 'oai_dc'], default='mods',
+                        help='metadata format of the records on ListRecords pages')
+    parser.add_argument('--repository', default='default',
+                        help='repository to dump, "default" or one of REPOSITORIES')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only dump publications updated since the last dump')
+    parser.add_argument('--set', default=None, help='only dump publications in this set')
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('DUMP_BATCH_SIZE', '1000')),
+                        help='publications per ES request and per ListRecords page')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='rendering processes')
+    args = parser.parse_args()
+
+    configs = repository_configs()
+    if args.repository not in configs:
+        raise SystemExit(f'Unknown repository {args.repository}')
+    entry = dump(GUPProvider(configs[args.repository]), args.output, args.format, args.incremental, args.set,
+                 args.batch_size, args.workers, args.metadata_prefix)
+    print(f"{entry['name']}: {entry['records']} records in {len(entry['files'])} files", file=sys.stderr)
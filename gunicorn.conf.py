@@ -0,0 +1,26 @@
+"""
+Settings of gunicorn, as the image runs the server (see Dockerfile):
+
+    gunicorn 'oaiserver:app()'
+
+Each worker is a process of its own with a pool of threads, warming up on its own (see
+readiness.py). A worker recycled by the memory guard (see memguard.py) finishes its requests
+within graceful_timeout and is replaced, while the other workers keep serving.
+
+Without a TOKEN_SECRET, one random secret is chosen here, before the workers are started, so that
+all workers of the container accept each other's resumptionTokens. Several containers serving one
+BASE_URL still need a TOKEN_SECRET of their own to share.
+"""
+import os
+import secrets
+
+if not os.environ.get('TOKEN_SECRET'):
+    os.environ['TOKEN_SECRET'] = secrets.token_hex(32)
+
+bind = '0.0.0.0:5000'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKER_THREADS', '8'))
+# Large ListRecords pages can take a while to build
+timeout = int(os.environ.get('WORKER_TIMEOUT', '120'))
+graceful_timeout = int(float(os.environ.get('MEMORY_RECYCLE_GRACE', '30')))
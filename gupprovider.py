@@ -1,68 +1,233 @@
 from oai_repo import DataInterface, Identify, MetadataFormat, RecordHeader, Set
-from elasticsearch import Elasticsearch
-import os
+from oai_repo.exceptions import OAIErrorIdDoesNotExist, OAIErrorNoSetHierarchy
+import threading
 from datetime import datetime,timezone
+import harvestquery
+from datestamps import DatestampStats
+from idset import IdentifierSet
 import oai
+import rendering
+import tracing
+from cache import fragment_key
+from config import Config
+from records import PUBLICATION_FIELDS, compact_hit
+from refresher import PeriodicRefresher
+from resources import SharedResources
+from sets import SetHierarchy
+from slices import SlicedFetch
 import lxml
 import lxml.etree as ET
 class GUPProvider(DataInterface):
-    def __init__(self):
-        self.index = 'publications'
-        self.es = Elasticsearch(hosts=[{'host': os.environ['ES_HOST_NAME'], 'port': 9200, 'scheme': 'http'}])
-        self.limit = int(os.environ['COUNT'])
-        self.provider = oai.OAIProvider()
+    def __init__(self, config: Config = None, shared: SharedResources = None, namespace: str = None):
+        # Configuration is read and validated once (see config.py)
+        self.config = config = config or Config.from_env()
+        # ES clients, the render pool and cache tiers, shared with the other repositories of the
+        # process, where this one keeps its cached values under `namespace`
+        self.shared = shared = shared or SharedResources()
+        self.namespace = namespace
+        self.index = config.index
+        self.es = shared.es(config.es_host)
+        self.limit = config.count
+        # Optional budgets that close a ListRecords page before the limit, in seconds and bytes
+        self.page_time_budget = config.page_time_budget
+        self.page_byte_budget = config.page_byte_budget
+        self.compact_xml = config.compact_xml
+        self.provider = oai.OAIProvider(config)
+        # Publications (and pre-rendered metadata) of the page being served by the current thread
+        self.page = threading.local()
+        # Optional process pool for rendering the metadata of large ListRecords pages
+        self.render_workers = config.render_workers
+        self.render_pool_min = config.render_pool_min
+        self.render_pool = shared.renderer(config.render_workers)
+        # Optional concurrent fetching of large pages and of scans, in slices (see slices.py)
+        self.sliced = None
+        if config.fetch_slices > 1:
+            self.sliced = SlicedFetch(config.fetch_slices, config.fetch_slice_min)
+        # Serialized metadata by format, publication and updated_at, filled by the render pool and
+        # the change warmer (see warmer.py), in the cache tier of CACHE_URL (see cache.py)
+        self.fragments = shared.cache('fragments', config.fragment_cache_size, namespace, config.cache_quota)
+        # Department, category and publication type sets, enumerated from the index in the background
+        self.sets = SetHierarchy(
+            lambda query: self.es.search(index=self.index, body=query),
+            config.set_refresh_interval,
+            lambda code: self.provider.get_publication_type_info(code)['output_type'],
+            config.source,
+            config.root_set_name
+        )
+        # Optional log of deleted publications (see deletions.py), searched together with the index
+        self.deletions = None
+        self.harvest_index = self.index
+        if config.deletion_index:
+            from deletions import DeletionLog
+            self.deletions = DeletionLog(
+                self.es, config.deletion_index, self.index, config.source, config.datestamp_margin
+            )
+            self.harvest_index = f'{self.index},{self.deletions.index}'
+            PeriodicRefresher('deletions', self.deletions.sync, config.deletion_sync_interval).start()
+        # First and last datestamps of the repository and its sets, refreshed in the background
+        self.datestamps = DatestampStats(
+            lambda query: self.es.search(index=self.harvest_index, body=query, request_cache=True),
+            config.datestamp_refresh_interval,
+            config.datestamp_margin,
+            config.source,
+            config.root_set
+        )
+        # Publication ids in the index, for answering lookups of known and malformed identifiers without ES
+        self.identifiers = IdentifierSet(
+            self.scan_publication_ids, config.identifier_refresh_interval, config.internal_prefix,
+            config.datestamp_margin
+        )
+        self.harvest_order = config.harvest_order
+        self.deleted_record = config.deleted_record
+        self.identifier_prefix = config.identifier_prefix + '/'
+        self.internal_prefix = config.internal_prefix
+        self.root_set = config.root_set
 
     def get_identify(self) -> Identify:
         ident = Identify()
-        ident.repository_name = os.environ['REPOSITORY_NAME']
-        ident.base_url = os.environ['BASE_URL']
+        ident.repository_name = self.config.repository_name
+        ident.base_url = self.config.base_url
         ident.granularity = 'YYYY-MM-DDThh:mm:ssZ'
-        ident.admin_email = [os.environ['ADMIN_EMAIL']]
-        ident.deleted_record = 'transient'
-        ident.earliest_datestamp = '1950-10-01T00:00:00Z'
+        ident.admin_email = [self.config.admin_email]
+        ident.deleted_record = self.deleted_record
+        ident.earliest_datestamp = self.datestamps.earliest() or '1950-10-01T00:00:00Z'
         return ident
 
     def get_record_metadata(self, identifier: str, metadata_prefix: str) -> lxml.etree._Element:
         internal_identifier = self.get_internal_identifier(identifier)
-        if self.es.exists(index="publications", id=internal_identifier):
-            publication = self.es.get(index="publications", id=internal_identifier)
-            metadata = self.provider.get_oai_data(publication)
-            return metadata
-        else:
-            raise OAIErrorIdDoesNotExist("The given identifier does not exist.")
+        # Metadata of a ListRecords page, from the fragment cache or the render pool (see prepare_records)
+        fragments = getattr(self.page, 'metadata', None)
+        if fragments and internal_identifier in fragments:
+            with tracing.timed('render'):
+                return ET.fromstring(fragments[internal_identifier])
+        publication = self.get_publication(internal_identifier)
+        # Outside of a page the fragment cache is asked for the record alone
+        if fragments is None:
+            fragment = self.fragments.get(fragment_key(publication['_source'], metadata_prefix))
+            if fragment is not None:
+                return ET.fromstring(fragment)
+        with tracing.timed('render'):
+            metadata = self.provider.get_oai_data(publication, metadata_prefix)
+        return metadata
+
+    def get_record_fragment(self, identifier: str, metadata_prefix: str) -> bytes:
+        # Serialized metadata of a record, for a compact response to splice in (see oai_repo/response.py).
+        # Outside of the fragments of a page it is rendered here, and kept for the next response.
+        internal_identifier = self.get_internal_identifier(identifier)
+        fragments = getattr(self.page, 'metadata', None)
+        if fragments and internal_identifier in fragments:
+            return rendering.inline_fragment(fragments[internal_identifier])
+        publication = self.get_publication(internal_identifier)
+        key = fragment_key(publication['_source'], metadata_prefix)
+        # The fragments of a page were looked up in the cache by prepare_records
+        fragment = self.fragments.get(key) if fragments is None else None
+        if fragment is None:
+            with tracing.timed('render'):
+                fragment = rendering.metadata_fragment(self.provider, publication['_source'], metadata_prefix)
+            self.fragments.set(key, fragment)
+        return rendering.inline_fragment(fragment)
+
+    def get_record_size(self, identifier: str, metadata_prefix: str) -> int:
+        # Bytes of the serialized metadata of a record on the page being served, or None if it was
+        # not rendered ahead (see prepare_records)
+        fragments = getattr(self.page, 'metadata', None)
+        fragment = fragments.get(self.get_internal_identifier(identifier)) if fragments else None
+        return len(fragment) if fragment is not None else None
+
+    def get_compact_xml(self) -> bool:
+        # Whether responses are serialized without pretty printing, with cached metadata spliced in
+        return self.compact_xml
+
+    def cache_metadata(self, publication, metadata_prefix: str):
+        # Render the metadata of a publication (_source) into the fragment cache, unless it is there
+        # or the publication is deleted
+        key = fragment_key(publication, metadata_prefix)
+        if not self.provider.get_deleted_status(publication) and self.fragments.get(key) is None:
+            self.fragments.set(key, rendering.metadata_fragment(self.provider, publication, metadata_prefix))
 
     def get_record_header(self, identifier: str) -> RecordHeader:
         internal_identifier = self.get_internal_identifier(identifier)
-        if self.es.exists(index="publications", id=internal_identifier):
-            publication = self.es.get(index="publications", id=internal_identifier)
-            header = self.provider.build_recordheader(publication['_source'])
-            return header
-        else:
-            raise OAIErrorIdDoesNotExist("The given identifier does not exist.")
+        publication = self.get_publication(internal_identifier)
+        header = self.provider.build_recordheader(publication['_source'])
+        return header
+
+    def get_publication(self, internal_identifier: str) -> dict:
+        # Publications on the current page were already fetched by list_identifiers
+        publications = getattr(self.page, 'publications', None)
+        if publications and internal_identifier in publications:
+            return publications[internal_identifier]
+        with tracing.timed('es'):
+            if self.es.exists(index=self.index, id=internal_identifier):
+                return compact_hit(self.es.get(index=self.index, id=internal_identifier, _source_includes=PUBLICATION_FIELDS))
+        # Publications removed from the index are still served as deleted records
+        if self.deletions and (tombstone := self.deletions.get(internal_identifier)):
+            return compact_hit(tombstone)
+        raise OAIErrorIdDoesNotExist("The given identifier does not exist.")
+
+    def prepare_records(self, identifiers: list, metadata_prefix: str):
+        # Look up the metadata of a ListRecords page in the fragment cache, all at once, and render
+        # the rest of a large page in the render pool. The fragments are kept per identifier and
+        # picked up by get_record_metadata, so the page keeps its original order.
+        publications = getattr(self.page, 'publications', {})
+        sources = [publications[identifier]['_source'] for identifier in identifiers if identifier in publications]
+        sources = [source for source in sources if not self.provider.get_deleted_status(source)]
+        keys = {source['id']: fragment_key(source, metadata_prefix) for source in sources}
+        cached = self.fragments.get_many(list(keys.values()))
+        self.page.metadata = {id: cached[key] for id, key in keys.items() if key in cached}
+        sources = [source for source in sources if source['id'] not in self.page.metadata]
+        if self.render_workers < 1 or len(sources) < self.render_pool_min:
+            return
+        chunksize = max(1, len(sources) // (self.render_pool.workers * 4))
+        with tracing.timed('render'):
+            fragments = list(self.render_pool.map(
+                rendering.render_metadata, sources, [metadata_prefix] * len(sources),
+                [self.config] * len(sources), chunksize=chunksize
+            ))
+        for source, fragment in zip(sources, fragments):
+            self.page.metadata[source['id']] = fragment
+            self.fragments.set(keys[source['id']], fragment)
+
+    def release_page(self):
+        # Forget the publications of the current page when its response has been built
+        self.page.__dict__.clear()
 
     def get_record_abouts(self, identifier: str) -> list:
         return []
 
     def is_valid_identifier(self, identifier: str) -> bool:
         internal_identifier = self.get_internal_identifier(identifier)
+        if (known := self.identifiers.contains(internal_identifier)) is not None:
+            return known
         # Check if the record exists in the index
         res = self.es.exists(index=self.index, id=internal_identifier)
+        if not res and self.deletions:
+            res = self.deletions.exists(internal_identifier)
         return res
 
     def get_internal_identifier(self, identifier: str) -> str:
         # Transform an OAI identifier to a valid internal identifier (gup_*)
-        return identifier.replace(os.environ.get("IDENTIFIER_PREFIX") + "/", "gup_")
+        return identifier.replace(self.identifier_prefix, self.internal_prefix)
+
+    def get_oai_identifier(self, internal_identifier: str) -> str:
+        # Transform an internal identifier (gup_*) to an OAI identifier
+        return internal_identifier.replace(self.internal_prefix, self.identifier_prefix, 1)
 
     def list_set_specs(self, identifier: str=None, cursor: int=0) -> tuple:
-        return ['gu'], None, None
+        return [self.root_set] + self.sets.specs(), None, None
 
     def get_set(self, setspec: str) -> Set:
         set = Set()
-        if setspec == 'gu':
-            set.spec = 'gu'
-            set.name = 'Göteborgs universitet'
+        if setspec == self.root_set:
+            set.spec = self.root_set
+            set.name = self.config.root_set_name
             description = ET.Element("description")
-            description.text = "Publications affiliated with Göteborgs universitet"
+            description.text = f"Publications affiliated with {self.config.root_set_name}"
+            set.description = [description]
+        elif (names := self.sets.get(setspec)) is not None:
+            set.spec = setspec
+            set.name = names[0]
+            description = ET.Element("description")
+            description.text = str(names[1])
             set.description = [description]
         else:
             raise OAIErrorNoSetHierarchy("Unknown set")
@@ -70,108 +235,132 @@ class GUPProvider(DataInterface):
 
 
     def get_metadata_formats(self, identifier = None) -> list:
-#        formats = ['oai_dc', 'mods']
-        formats = ['mods']
+        formats = ['oai_dc', 'mods']
         # Build metadata format object for each element
         return [self.build_metadata_format_object(format) for format in formats]
 
-    def list_identifiers(self, metadata_prefix: str, from_date: str, until_date: str, set=None, cursor = 0) -> tuple:
-        # filter datestamp by from_date and until_date if provided
-        # Create a base query
-        # Filter source by 'gup'
+    def list_identifiers(self, metadata_prefix: str, from_date: str, until_date: str, set=None, cursor = 0,
+                         after: str = None) -> tuple:
+        # Windows without updates are answered from the datestamp statistics
+        if self.datestamps.window_is_empty(set, from_date, until_date, lambda start, end: self.any_updated(set, start, end)):
+            return ([], 0, None)
+
         query = {
-            'query': {
-                'bool': {
-                    'must': [
-                        {
-                            'term': {
-                                'source': 'gup'
-                            }
-                        }
-                    ]
-                }
-            },
-            'sort': [
-                {
-                    'publication_id': {
-                        'order': 'asc'
-                    }
-                }
-            ],
+            'query': self.harvest_query(set, from_date, until_date),
+            'sort': self.harvest_sort(),
+            '_source': {'includes': PUBLICATION_FIELDS},
             'from': cursor,
             'size': self.limit,
             'track_total_hits': True
         }
-
-        query = self.add_set_to_query(query, set)
-
-        if from_date is None and until_date is None:
-            query = query
-        elif from_date is None:
-            query = self.set_datestamp_until_open(query, until_date)
-        elif until_date is None:
-            query = self.set_datestamp_from_open(query, from_date)
-        else:
-            query = self.set_datestamp_closed(query, from_date, until_date)
-
+        if self.harvest_order == 'updated_at' and after is not None:
+            # Continue after the last record of the previous page. The list size is already known,
+            # and without counting all hits ES can stop reading the sorted index after one page.
+            query['search_after'] = [int(value) if value.isdigit() else value for value in after.split(',')]
+            query['from'] = 0
+            query['track_total_hits'] = False
 
         results = self.get_records_from_index(query)
 
         list_of_identifiers = []
         for result in results[0]:
             list_of_identifiers.append(result['_source']['id'])
+        # Keep the hits for the headers and metadata of this page
+        self.page.publications = {result['_source']['id']: result for result in results[0]}
+        if self.harvest_order == 'updated_at':
+            self.page.search_after = {
+                result['_source']['id']: ','.join(str(value) for value in result['sort']) for result in results[0]
+            }
 
-        total_size = results[1]
+        total_size = results[1] if query['track_total_hits'] else None
         return (list_of_identifiers, total_size, None)
 
-    def add_set_to_query(self, query, set):
-        # Filter by set if provided (only 'gu' is supported so far)
-        if set is not None and set == 'gu':
-            query['query']['bool']['must'].append({
-                'term': {
-                    'affiliated': True
-                }
-            })
-        return query
+    def any_updated(self, set, from_date, until_date) -> bool:
+        # Is there any publication in the set updated within the window? ES stops at the first one.
+        query = {'query': harvestquery.harvest_query(
+            set, from_date, until_date, source=self.config.source, root_set=self.root_set
+        )}
+        with tracing.timed('es'):
+            return self.es.count(index=self.harvest_index, body=query, terminate_after=1)['count'] > 0
+
+    def harvest_session(self, session: str) -> str:
+        # Session id for the next resumptionToken: the one of the token the page was asked for. Sessions
+        # start outside of the (shared) first page, when harvests are traced (see tracing.py).
+        return session
+
+    def get_search_after(self, identifier: str) -> str:
+        # Where the page after the given record starts, for the resumptionToken of a date ordered harvest
+        return getattr(self.page, 'search_after', {}).get(identifier)
+
+    def get_page_budget(self) -> tuple:
+        # (seconds, bytes) after which a ListRecords page is closed, None for no limit
+        return self.page_time_budget, self.page_byte_budget
+
+    def harvest_sort(self) -> list:
+        if self.harvest_order == 'updated_at':
+            return [{'updated_at': {'order': 'asc'}}, {'publication_id': {'order': 'asc'}}]
+        return [{'publication_id': {'order': 'asc'}}]
+
+    def harvest_query(self, set=None, from_date=None, until_date=None) -> dict:
+        # Filter context query for publications in a set, updated within from_date and until_date
+        return harvestquery.harvest_query(
+            set, from_date, until_date, self.index, self.deletions.index if self.deletions else None,
+            self.config.source, self.root_set
+        )
 
     def get_records_from_index(self, query) -> tuple:
-        results = self.es.search(index=self.index, body=query)
-        return (results['hits']['hits'], results['hits']['total']['value'])
+        # Harvest pages are requested again by every harvester, so let ES cache them per shard
+        with tracing.timed('es'):
+            if self.sliced and query.get('size', 0) >= self.sliced.min_size:
+                results = self.sliced.search(self.es, self.harvest_index, query, request_cache=True)
+            else:
+                results = self.es.search(index=self.harvest_index, body=query, request_cache=True)
+        hits = [compact_hit(hit) for hit in results['hits']['hits']]
+        total = results['hits']['total']['value'] if 'total' in results['hits'] else None
+        return (hits, total)
 
+    def count_publications(self, set=None, from_date=None) -> int:
+        query = {'query': self.harvest_query(set, from_date)}
+        return self.es.count(index=self.harvest_index, body=query)['count']
 
-    def set_datestamp_from_open(self, query, from_date: str) -> tuple:
-        # Filter datestamp by from_date
-        query['query']['bool']['must'].append({
-            'range': {
-                'updated_at': {
-                    'gte': from_date
-                }
-            }
-        })
-        return query
-
-    def set_datestamp_until_open(self, query, until_date: str) -> tuple:
-        # Filter datestamp by until_date
-        query['query']['bool']['must'].append({
-            'range': {
-                'updated_at': {
-                    'lte': until_date
-                }
-            }
-        })
-        return query
-
-    def set_datestamp_closed(self, query, from_date: str, until_date: str) -> tuple:
-        # Filter datestamp by from_date and until_date if provided
-        query['query']['bool']['must'].append({
-            'range': {
-                'updated_at': {
-                    'gte': from_date,
-                    'lte': until_date
-                }
-            }
-        })
-        return query
+    def scan_publications(self, set=None, from_date=None, batch_size=1000, keep_alive='5m'):
+        # Iterate over all matching publications in batches of _source dicts, in harvest order
+        query = {
+            'query': self.harvest_query(set, from_date),
+            'sort': self.harvest_sort(),
+            '_source': {'includes': PUBLICATION_FIELDS}
+        }
+        for hits in self.scan(query, batch_size, keep_alive):
+            yield [hit['_source'] for hit in hits]
+
+    def scan_publication_ids(self, since=None, batch_size=10000, keep_alive='1m'):
+        # Iterate over the publication_ids of all documents, or of those updated since `since`, in batches
+        query = {'_source': ['publication_id'], 'sort': [{'publication_id': {'order': 'asc'}}]}
+        if since is not None:
+            query['query'] = {'bool': {'filter': harvestquery.datestamp_filter(since)}}
+        for hits in self.scan(query, batch_size, keep_alive):
+            yield [hit['_source']['publication_id'] for hit in hits]
+
+    def scan(self, query: dict, batch_size: int, keep_alive: str):
+        # Iterate over all hits of a sorted query in batches. A point in time keeps the result
+        # consistent while GUP keeps updating the index.
+        if self.sliced:
+            yield from self.sliced.scan(self.es, self.harvest_index, query, batch_size, keep_alive)
+            return
+        query = {**query, 'size': batch_size}
+        pit_id = self.es.open_point_in_time(index=self.harvest_index, keep_alive=keep_alive)['id']
+        try:
+            while True:
+                query['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+                results = self.es.search(body=query)
+                pit_id = results.get('pit_id', pit_id)
+                hits = results['hits']['hits']
+                if not hits:
+                    break
+                yield hits
+                query['search_after'] = hits[-1]['sort']
+        finally:
+            self.es.close_point_in_time(id=pit_id)
 
     def build_metadata_format_object(self, metadata_prefix: str) -> str:
         if metadata_prefix == 'oai_dc':
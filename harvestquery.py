@@ -0,0 +1,82 @@
+"""
+Elasticsearch queries for harvests (ListIdentifiers, ListRecords and dumps).
+
+All clauses are in filter context: harvests are sorted and never ranked, so there is nothing to
+score, and filter clauses are what the ES node query cache keeps. Dates are normalized to the
+second, the granularity of the repository, so that requests for the same window serialize to the
+same query and can be answered from the shard request cache.
+"""
+from datetime import datetime, timedelta, timezone
+
+from oai_repo.exceptions import OAIErrorNoRecordsMatch
+
+from sets import SET_FIELDS, split_set_spec
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def normalize_date(date, until: bool = False) -> str:
+    # A datetime (from oai_repo) or an ISO 8601 string (from a dump manifest) as YYYY-MM-DDThh:mm:ssZ.
+    # A day (YYYY-MM-DD, an until argument of oai_repo) is its last second as an until date.
+    if isinstance(date, str):
+        day = len(date.strip()) == len('YYYY-MM-DD')
+        date = datetime.fromisoformat(date.strip())
+        if until and day:
+            date += timedelta(days=1, seconds=-1)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).strftime(DATE_FORMAT)
+
+
+def source_filter(source: str = 'gup') -> list:
+    return [{'term': {'source': source}}]
+
+
+def set_filter(set: str, root_set: str = 'gu') -> list:
+    if set is None:
+        return []
+    # The root set holds the publications affiliated with the institution
+    if set == root_set:
+        return [{'term': {'affiliated': True}}]
+    # Department, category and publication type sets (see sets.py)
+    top, value = split_set_spec(set)
+    if top not in SET_FIELDS:
+        raise OAIErrorNoRecordsMatch("The given set does not exist.")
+    if value is None:
+        return [{'exists': {'field': SET_FIELDS[top]}}]
+    return [{'term': {SET_FIELDS[top]: value}}]
+
+
+def datestamp_filter(from_date=None, until_date=None) -> list:
+    if from_date is None and until_date is None:
+        return []
+    bounds = {}
+    if from_date is not None:
+        bounds['gte'] = normalize_date(from_date)
+    if until_date is not None:
+        bounds['lte'] = normalize_date(until_date, until=True)
+    return [{'range': {'updated_at': bounds}}]
+
+
+def harvest_query(set: str = None, from_date=None, until_date=None, index: str = None,
+                  deletion_index: str = None, source: str = 'gup', root_set: str = 'gu') -> dict:
+    """
+    The query part of a harvest request for publications from `source` in a set, updated within an
+    optional from/until window. With a deletion log (see deletions.py) the search covers both
+    `index` and `deletion_index`, and publications marked as deleted in `index` are left to the log.
+    """
+    query = {
+        'bool': {
+            'filter': source_filter(source) + set_filter(set, root_set) + datestamp_filter(from_date, until_date)
+        }
+    }
+    if deletion_index is not None:
+        query['bool']['must_not'] = [{
+            'bool': {
+                'filter': [
+                    {'term': {'_index': index}},
+                    {'term': {'deleted': True}}
+                ]
+            }
+        }]
+    return query
@@ -0,0 +1,71 @@
+import re
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from heapq import merge
+
+from refresher import PeriodicRefresher
+
+
+class IdentifierSet:
+    """
+    The publication_ids in the index (and the deletion log) as a sorted array of 64 bit integers,
+    about 8 bytes per publication, kept up to date in the background every `interval` seconds.
+    `scan(since)` yields batches of the publication_ids of the documents with an updated_at since
+    `since`, or of all documents for None.
+
+    Publications are only indexed once they are published, with a new updated_at, so after a full
+    load the array is kept current by adding the publications updated since the previous refresh
+    (less `margin` seconds, for updates that were not searchable yet). It is loaded in full again
+    every `full_interval` seconds, which drops the ids of publications removed from the index.
+    Identifiers are answered without ES while the array is current; an id published since the last
+    refresh is then missed for up to `interval` seconds. Until the array is loaded, or when it has
+    not been refreshed for two intervals, only identifiers that cannot be those of publications are.
+    """
+    def __init__(self, scan, interval: float, prefix: str = 'gup_', margin: float = 300,
+                 full_interval: float = 3600):
+        self.scan = scan
+        self.interval = interval
+        self.margin = timedelta(seconds=margin)
+        self.full_interval = full_interval
+        self.full_loaded_at = None
+        # Internal identifiers are the prefix and the publication_id
+        self.internal_identifier = re.compile(re.escape(prefix) + r'([1-9][0-9]{0,17})')
+        # Without an interval the array is not kept at all, and ES is asked about every identifier
+        self.refresher = PeriodicRefresher('identifiers', self.load, interval) if interval > 0 else None
+
+    def load(self) -> array:
+        started_at = time.time()
+        ids, loaded_at = self.refresher.value, self.refresher.loaded_at
+        if ids is None or started_at - self.full_loaded_at >= self.full_interval:
+            ids = array('q', sorted(publication_id for batch in self.scan(None) for publication_id in batch))
+            self.full_loaded_at = started_at
+            return ids
+        since = datetime.fromtimestamp(loaded_at, timezone.utc) - self.margin
+        updated = sorted({publication_id for batch in self.scan(since) for publication_id in batch})
+        added = [publication_id for publication_id in updated if not self.found(ids, publication_id)]
+        # The array in use is never changed, a new one is swapped in
+        return array('q', merge(ids, added)) if added else ids
+
+    @staticmethod
+    def found(ids: array, publication_id: int) -> bool:
+        index = bisect_left(ids, publication_id)
+        return index < len(ids) and ids[index] == publication_id
+
+    def contains(self, internal_identifier: str) -> bool:
+        """
+        False if the identifier is not one of a publication or is missing from a current array,
+        True if it is in the array, and None if that cannot be told without asking ES.
+        """
+        match = self.internal_identifier.fullmatch(internal_identifier)
+        if match is None:
+            return False
+        # The time of the array is read first, a refresh in between then only makes it look older
+        loaded_at = self.refresher.loaded_at if self.refresher else None
+        ids = self.refresher.peek() if self.refresher else None
+        if ids is None or loaded_at is None:
+            return None
+        if self.found(ids, int(match.group(1))):
+            return True
+        return False if time.time() - loaded_at < 2 * self.interval else None
@@ -0,0 +1,86 @@
+import logging
+import os
+import resource
+import signal
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def resident_bytes() -> int:
+    # Current resident set size of this process, or the peak where the current size is not available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def under_worker_manager() -> bool:
+    # The workers of gunicorn are forked from its arbiter, uWSGI provides its module to its workers
+    return 'gunicorn.arbiter' in sys.modules or 'uwsgi' in sys.modules
+
+
+class MemoryGuard:
+    """
+    Recycles the worker when its resident memory has grown past `limit` bytes. The memory is
+    checked when a response has been sent. Once it is over the limit, the process sends itself
+    SIGTERM when no other request is in progress, or after `grace` seconds, and the worker manager
+    (gunicorn or uWSGI) starts a fresh worker while the others keep serving.
+
+    The guard is only enabled in a worker of such a manager, as the image runs the server (see
+    gunicorn.conf.py): the Flask development server (python oaiserver.py) is the whole service in
+    one process, which SIGTERM would take down.
+    """
+    def __init__(self, limit: int, grace: float):
+        self.limit = limit
+        self.grace = grace
+        self.active = 0
+        self.recycling = False
+        self.terminated = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        # The guard is off unless MEMORY_LIMIT_MB is set
+        if not os.environ.get('MEMORY_LIMIT_MB'):
+            return None
+        if not under_worker_manager():
+            logger.warning('MEMORY_LIMIT_MB is ignored, the process is not a worker of gunicorn or uWSGI')
+            return None
+        return cls(
+            limit=int(float(os.environ['MEMORY_LIMIT_MB']) * 1024 * 1024),
+            grace=float(os.environ.get('MEMORY_RECYCLE_GRACE', '30')),
+        )
+
+    def started(self):
+        with self.lock:
+            self.active += 1
+
+    def finished(self):
+        with self.lock:
+            self.active -= 1
+            if not self.recycling:
+                resident = resident_bytes()
+                if resident < self.limit:
+                    return
+                self.recycling = True
+                logger.warning('Resident memory %d MB is over the limit of %d MB, recycling the worker',
+                               resident // 2 ** 20, self.limit // 2 ** 20)
+                if self.active:
+                    # Requests keep arriving on a busy worker, do not wait for a quiet moment forever
+                    timer = threading.Timer(self.grace, self.terminate)
+                    timer.daemon = True
+                    timer.start()
+            if self.active:
+                return
+        self.terminate()
+
+    def terminate(self):
+        with self.lock:
+            if self.terminated:
+                return
+            self.terminated = True
+        os.kill(os.getpid(), signal.SIGTERM)
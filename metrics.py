@@ -0,0 +1,31 @@
+import threading
+import time
+from http import HTTPStatus
+
+VERBS = {'GetRecord', 'Identify', 'ListIdentifiers', 'ListMetadataFormats', 'ListRecords', 'ListSets'}
+
+
+class RepositoryMetrics:
+    """
+    Requests answered by one repository since the worker started, per verb: how many, how many
+    with an error status, the bytes sent and the seconds spent. Requests with an unknown or
+    missing verb are counted as "other".
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.verbs = {}
+        self.lock = threading.Lock()
+
+    def record(self, verb: str, status: int, size: int, seconds: float):
+        verb = verb if verb in VERBS else 'other'
+        with self.lock:
+            entry = self.verbs.setdefault(verb, {'requests': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0})
+            entry['requests'] += 1
+            entry['errors'] += status != HTTPStatus.OK
+            entry['bytes'] += size
+            entry['seconds'] += seconds
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            verbs = {verb: {**entry, 'seconds': round(entry['seconds'], 3)} for verb, entry in self.verbs.items()}
+        return {'uptime_s': round(time.time() - self.started_at), 'verbs': verbs}
@@ -0,0 +1,161 @@
+"""
+The publication as the metadata formats see it: sanitized texts, mapped codes and the decisions
+(monograph or not, affiliated authors, page ranges, ...) taken once, so that the MODS builder in
+oai.py and the Dublin Core builder in oaidc.py only emit XML.
+"""
+from datetime import datetime
+
+
+class Normalized:
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+
+class NormalizedAuthor(Normalized):
+    # affiliations is a list of (department_id, name_sv, name_en), or None if the author is not
+    # affiliated with the university
+    __slots__ = ('given', 'family', 'birth_year', 'xkonto', 'orcid', 'affiliations')
+
+
+class NormalizedHost(Normalized):
+    # The journal, book or event a publication was published in. pages is (start, end) when the
+    # source pages are a page range, else citation holds them as they are.
+    __slots__ = ('titles', 'identifiers', 'has_part', 'volume', 'issue', 'article_number', 'pages', 'citation')
+
+
+class NormalizedPublication(Normalized):
+    # identifiers is a list of (type, value) after the URI, categories (svep_id, name_sv, name_en),
+    # series (title, part, issn). viewable_after is the earliest time a full text file is visible.
+    __slots__ = (
+        'publication_id', 'uri', 'title', 'subtitle', 'abstract', 'identifiers', 'categories',
+        'keywords', 'language', 'output_type', 'artistic_basis', 'content_type', 'role',
+        'type_of_resource', 'authors', 'creator_count', 'epub_ahead_of_print', 'pubyear', 'publisher',
+        'place', 'host', 'series', 'viewable_after', 'open_access',
+    )
+
+    def has_viewable_file(self) -> bool:
+        return self.viewable_after is not None and self.viewable_after <= datetime.now()
+
+
+def normalize(provider, publication) -> NormalizedPublication:
+    """
+    Normalize a publication (_source) with the mappings of an oai.OAIProvider.
+    """
+    sanitize = provider.sanitize
+    publication_type_code = publication["publication_type_code"]
+    publication_type_info = provider.get_publication_type_info(publication_type_code, publication["ref_value"])
+    monograph = provider.is_monograph(publication)
+
+    identifiers = []
+    if monograph and publication["isbn"]:
+        identifiers.append(("isbn", publication["isbn"]))
+    for identifier in publication["publication_identifiers"]:
+        identifier_code = provider.get_identifier_code(identifier["identifier_code"])
+        if identifier_code is not None:
+            identifiers.append((identifier_code, identifier["identifier_value"]))
+
+    keywords = []
+    if publication["keywords"]:
+        keywords = [keyword.strip() for keyword in sanitize(publication["keywords"]).split(",")]
+
+    authors = publication["authors"]
+    if authors is not None:
+        authors = [
+            normalize_author(provider, author)
+            for author in sorted(authors, key=lambda x: x["position"][0]["position"])
+        ]
+
+    host = None
+    if not monograph and (publication["sourcetitle"] or publication["made_public_in"]):
+        host = normalize_host(provider, publication)
+
+    series = [
+        (serie["title"], serie["part"] or None, serie["issn"] or None)
+        for serie in (publication["series"] or []) if serie["title"]
+    ]
+
+    return NormalizedPublication(
+        publication_id=publication["publication_id"],
+        uri=provider.get_uri(publication["publication_id"]),
+        title=sanitize(publication["title"]),
+        subtitle=sanitize(publication["alt_title"]) if publication["alt_title"] else None,
+        abstract=sanitize(publication["abstract"]) if publication["abstract"] else None,
+        identifiers=identifiers,
+        categories=[(category["svep_id"], category["name_sv"], category["name_en"]) for category in publication["categories"]],
+        keywords=keywords,
+        language=provider.get_language_code(publication["publanguage"]) if "publanguage" in publication else None,
+        output_type=publication_type_info["output_type"],
+        artistic_basis=bool(publication["artistic_basis"]),
+        content_type=publication_type_info["content_type"],
+        role=provider.get_role_code(publication_type_code),
+        type_of_resource=provider.get_type_of_resource_code(publication_type_code),
+        authors=authors or [],
+        creator_count=len(authors) if authors is not None else 0,
+        epub_ahead_of_print=bool(publication["epub_ahead_of_print"]),
+        pubyear=str(publication["pubyear"]) if publication["pubyear"] else None,
+        publisher=sanitize(publication["publisher"]) if publication["publisher"] else None,
+        place=sanitize(publication["place"]) if publication["place"] else None,
+        host=host,
+        series=series,
+        viewable_after=viewable_after(publication.get("files")),
+        open_access=bool(publication.get("is_open_access")),
+    )
+
+
+def normalize_author(provider, author) -> NormalizedAuthor:
+    person = author['person'][0]
+    affiliations = author['affiliations']
+    if affiliations is not None and provider.is_author_affiliated(affiliations):
+        affiliations = [
+            (affiliation['department_id'], provider.sanitize(affiliation["name_sv"]), provider.sanitize(affiliation["name_en"]))
+            for affiliation in affiliations
+        ]
+    else:
+        affiliations = None
+    return NormalizedAuthor(
+        given=provider.sanitize(person["first_name"]),
+        family=provider.sanitize(person["last_name"]),
+        birth_year=str(person["year_of_birth"]) if "year_of_birth" in person and person["year_of_birth"] is not None else None,
+        xkonto=provider.get_person_identifier_value(person["identifiers"], "xkonto"),
+        orcid=provider.get_person_identifier_value(person["identifiers"], "orcid"),
+        affiliations=affiliations,
+    )
+
+
+def normalize_host(provider, publication) -> NormalizedHost:
+    sanitize = provider.sanitize
+    titles = [sanitize(publication[field]) for field in ("sourcetitle", "made_public_in") if publication[field]]
+    identifiers = [
+        (identifier_type, sanitize(publication[field]))
+        for identifier_type, field in (("issn", "issn"), ("issn", "eissn"), ("isbn", "isbn")) if publication[field]
+    ]
+    sourcepages = publication["sourcepages"]
+    pages = provider.get_start_and_end_page(sourcepages) if sourcepages else None
+    return NormalizedHost(
+        titles=titles,
+        identifiers=identifiers,
+        has_part=any(publication[field] for field in ("sourcevolume", "sourceissue", "article_number", "sourcepages")),
+        volume=sanitize(publication["sourcevolume"]) if publication["sourcevolume"] else None,
+        issue=sanitize(publication["sourceissue"]) if publication["sourceissue"] else None,
+        article_number=sanitize(publication["article_number"]) if publication["article_number"] else None,
+        pages=pages,
+        citation=sanitize(sourcepages) if sourcepages and not pages else None,
+    )
+
+
+def viewable_after(files) -> datetime:
+    # The earliest time any accepted file is visible, None if there is no accepted file
+    times = []
+    for file in files or []:
+        if not file["accepted"]:
+            continue
+        if file["visible_after"] is None:
+            return datetime.min
+        try:
+            times.append(datetime.strptime(file["visible_after"], "%Y-%m-%d"))
+        except ValueError:
+            continue
+    return min(times) if times else None
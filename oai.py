@@ -1,26 +1,52 @@
 from oai_repo import RecordHeader
 
-import os
 import sys
+import threading
+from collections import OrderedDict
 import lxml.etree as ET
+import normalized
+import oaidc
+import sets
+from config import Config
 
 from datetime import datetime
 class OAIProvider:
-    def __init__(self):
-        # Initialize the OAI provider
-        self.publication_json = {}
-
-    def get_oai_data(self, publication):
-        self.publication_json = publication["_source"]
-        return self.generate_xml_document()
-
-    def generate_xml_document(self):
-        return self.get_metadata()
+    def __init__(self, config: Config = None):
+        config = config or Config.from_env()
+        self.identifier_prefix = config.identifier_prefix + "/"
+        self.uri_prefix = config.uri_prefix + "/"
+        self.root_set = config.root_set
+        # Normalized publications by (id, updated_at), most recently used last
+        self.normalized = OrderedDict()
+        self.normalized_lock = threading.Lock()
+        self.normalized_cache_size = config.normalized_cache_size
+
+    def get_oai_data(self, publication, metadata_prefix="mods"):
+        record = self.get_normalized(publication["_source"])
+        if metadata_prefix == "oai_dc":
+            return oaidc.dublin_core(record)
+        return self.get_metadata(record)
+
+    def get_normalized(self, publication):
+        # Normalize a publication once, whichever formats it is served in
+        key = (publication["id"], publication["updated_at"]) if "id" in publication else None
+        with self.normalized_lock:
+            record = self.normalized.get(key) if key else None
+            if record is not None:
+                self.normalized.move_to_end(key)
+                return record
+        record = normalized.normalize(self, publication)
+        if key and self.normalized_cache_size > 0:
+            with self.normalized_lock:
+                self.normalized[key] = record
+                while len(self.normalized) > self.normalized_cache_size:
+                    self.normalized.popitem(last=False)
+        return record
 
     def build_recordheader(self, publication):
         # Build a recordheader object
         header = RecordHeader()
-        header.identifier = os.environ.get("IDENTIFIER_PREFIX") + "/" + str(publication['publication_id'])
+        header.identifier = self.identifier_prefix + str(publication['publication_id'])
         header.datestamp = self.format_timestamp(publication['updated_at'], publication['created_at'])
         header.setspecs = self.get_set_specs(publication)
         # set status to "deleted" if the publication is marked as deleted in the index
@@ -40,35 +66,36 @@ class OAIProvider:
 
     def get_set_specs(self, publication):
         set_specs = []
-        # Add GU to the set_specs if the affiliated attribute is true
+        # Add the root set (GU) to the set_specs if the affiliated attribute is true
         if publication.get("affiliated") and publication['affiliated'] == True:
-            set_specs.append("gu")
-        # TBD: Add other set_specs based on the categories, departments, etc.
+            set_specs.append(self.root_set)
+        # Add the department, category and publication type sets (see sets.py)
+        set_specs.extend(sets.record_set_specs(publication))
         return set_specs
 
     def get_deleted_status(self, publication):
         # Check if the publication is marked as deleted in the index
         return publication['deleted'] == True
 
-    def get_metadata(self):
+    def get_metadata(self, record):
         mods = self.set_mods()
         self.get_record_info(mods)
-        self.get_identifiers(mods)
-        self.get_title(mods)
-        self.get_abstract(mods)
-        self.get_categories(mods)
-        self.get_subjects(mods)
-        self.get_language(mods)
-        self.get_genre(mods)
-        self.get_authors(mods)
-        self.get_notes(mods)
-        self.get_origin_info(mods)
-        self.get_related_item(mods)
-        self.get_series(mods)
-        self.get_location(mods)
-        self.get_access_condition(mods)
-        self.get_physical_description(mods)
-        self.get_type_of_resource(mods)
+        self.get_identifiers(mods, record)
+        self.get_title(mods, record)
+        self.get_abstract(mods, record)
+        self.get_categories(mods, record)
+        self.get_subjects(mods, record)
+        self.get_language(mods, record)
+        self.get_genre(mods, record)
+        self.get_authors(mods, record)
+        self.get_notes(mods, record)
+        self.get_origin_info(mods, record)
+        self.get_related_item(mods, record)
+        self.get_series(mods, record)
+        self.get_location(mods, record)
+        self.get_access_condition(mods, record)
+        self.get_physical_description(mods, record)
+        self.get_type_of_resource(mods, record)
         return mods
 
     def set_mods(self):
@@ -96,8 +123,8 @@ class OAIProvider:
         record_info_element.text = "gu"
 
 
-    def is_monograph(self):
-        publication_type_code = self.publication_json["publication_type_code"]
+    def is_monograph(self, publication):
+        publication_type_code = publication["publication_type_code"]
         # Publication is a monograph if the publication type is one of the following
         # publication_book
         # publication_edited-book
@@ -106,57 +133,46 @@ class OAIProvider:
         # publication_licenciate-thesis
         return publication_type_code in ['publication_book', 'publication_edited-book', 'publication_report', 'publication_doctoral-thesis', 'publication_licentiate-thesis']
 
-    def get_abstract(self, mods):
-        abstract = self.publication_json["abstract"]
-        if abstract and abstract is not None:
-            ET.SubElement(mods, "abstract").text = self.sanitize(abstract)
+    def get_abstract(self, mods, record):
+        if record.abstract:
+            ET.SubElement(mods, "abstract").text = record.abstract
 
-    def get_categories(self, mods):
-        categories = self.publication_json["categories"]
-        [self.add_category_as_classification(mods, category) for category in categories]
+    def get_categories(self, mods, record):
+        [self.add_category_as_classification(mods, category) for category in record.categories]
         # Get the categories as subjects for each language in ["eng", "swe"]
-        [self.add_category_as_subject(mods, category, lang) for category in categories for lang in ["eng", "swe"]]
+        [self.add_category_as_subject(mods, category, lang) for category in record.categories for lang in ["eng", "swe"]]
 
     def add_category_as_classification(self, mods, category):
+        svep_id, name_sv, name_en = category
         classification = ET.SubElement(mods, "classification")
         classification.set("authority", "ssif")
-        classification.text = str(category["svep_id"])
-
-    def get_category_field_name(self, lang):
-        return "name_sv" if lang == "swe" else "name_en"
+        classification.text = str(svep_id)
 
     def add_category_as_subject(self, mods, category, lang):
+        svep_id, name_sv, name_en = category
         subject = ET.SubElement(mods, "subject")
         subject.set("lang", lang)
         subject.set("authority", "uka.se")
-        subject.set("{http://www.w3.org/1999/xlink}href", str(category["svep_id"]))  # Fix: Replace 'xlink:href' with 'href'
+        subject.set("{http://www.w3.org/1999/xlink}href", str(svep_id))  # Fix: Replace 'xlink:href' with 'href'
         topic = ET.SubElement(subject, "topic")
-        topic.text = category[self.get_category_field_name(lang)]  # Fix: Add 'self.' before 'get_category_field_name'
-
-    def get_identifiers(self, mods):
-        identifiers = self.publication_json["publication_identifiers"]
-        self.add_uri(mods, self.publication_json["publication_id"])
-        if self.is_monograph():
-            self.add_isbn(mods, self.publication_json["isbn"])
-        [self.add_identifier(mods, identifier) for identifier in identifiers]
-
-    def add_uri(self, mods, publication_id):
-        uri = ET.SubElement(mods, "identifier")
-        uri.set("type", "uri")
-        uri.text = os.environ.get("URI_PREFIX") + "/" + str(publication_id)
-
-    def add_isbn(self, mods, isbn):
-        if isbn and isbn is not None:
-            identifier = ET.SubElement(mods, "identifier")
-            identifier.set("type", "isbn")
-            identifier.text = isbn
-
-    def add_identifier(self, mods, identifier_source):
-        identifier_code = self.get_identifier_code(identifier_source["identifier_code"])
-        if identifier_code is not None:
-            identifier = ET.SubElement(mods, "identifier")
-            identifier.set("type", identifier_code)
-            identifier.text = identifier_source["identifier_value"]
+        topic.text = name_sv if lang == "swe" else name_en
+
+    def get_identifiers(self, mods, record):
+        self.add_uri(mods, record.uri)
+        [self.add_identifier(mods, identifier_type, value) for identifier_type, value in record.identifiers]
+
+    def add_uri(self, mods, uri):
+        identifier = ET.SubElement(mods, "identifier")
+        identifier.set("type", "uri")
+        identifier.text = uri
+
+    def get_uri(self, publication_id):
+        return self.uri_prefix + str(publication_id)
+
+    def add_identifier(self, mods, identifier_type, value):
+        identifier = ET.SubElement(mods, "identifier")
+        identifier.set("type", identifier_type)
+        identifier.text = value
 
     def get_identifier_code(self, identifier):
         identifier_mapping = {
@@ -169,45 +185,34 @@ class OAIProvider:
         }
         return identifier_mapping.get(identifier, identifier)
 
-    def get_title(self, mods):
+    def get_title(self, mods, record):
         titleInfo = ET.SubElement(mods, "titleInfo")
-        ET.SubElement(titleInfo, "title").text = self.sanitize(self.publication_json["title"])
+        ET.SubElement(titleInfo, "title").text = record.title
         # Add the subtitle if it exists
-        subtitle = self.publication_json["alt_title"]
-        if subtitle and subtitle is not None:
-            ET.SubElement(titleInfo, "subTitle").text = self.sanitize(subtitle)
+        if record.subtitle:
+            ET.SubElement(titleInfo, "subTitle").text = record.subtitle
 
+    def get_authors(self, mods, record):
+        [self.add_author(mods, author, record.role) for author in record.authors]
 
-    def get_authors(self, mods):
-        authors = self.publication_json["authors"]
-        if authors is not None:
-            authors.sort(key=lambda x: x["position"][0]["position"])
-            [self.add_author(mods, author) for author in authors]
-        else:
-            []
-
-    def add_author(self, mods, author):
-        #print(author)
-        person = author['person'][0]
-        xkonto = self.get_person_identifier_value(person["identifiers"], "xkonto")
+    def add_author(self, mods, author, role_code):
+        xkonto = author.xkonto
         name = ET.SubElement(mods, "name")
         name.set("type", "personal")
         if xkonto:
             name.set("authority", "gu")
         fname = ET.SubElement(name, "namePart")
         fname.set("type", "given")
-        fname.text = self.sanitize(person["first_name"])
+        fname.text = author.given
         lname = ET.SubElement(name, "namePart")
         lname.set("type", "family")
-        lname.text = self.sanitize(person["last_name"])
+        lname.text = author.family
 
-        if "year_of_birth" in person and person["year_of_birth"] is not None:
+        if author.birth_year is not None:
             bdate = ET.SubElement(name, "namePart")
             bdate.set("type", "date")
-            bdate.text = str(person["year_of_birth"])
+            bdate.text = author.birth_year
 
-        # Get the role code based on the publication type
-        role_code = self.get_role_code(self.publication_json["publication_type_code"])
         role = ET.SubElement(name, "role")
         roleTerm = ET.SubElement(role, "roleTerm")
         roleTerm.set("type", "code")
@@ -218,17 +223,18 @@ class OAIProvider:
             nameIdentifier = ET.SubElement(name, "nameIdentifier")
             nameIdentifier.set("type", "gu")
             nameIdentifier.text = xkonto
-        orcid = self.get_person_identifier_value(person["identifiers"], "orcid")
+        orcid = author.orcid
         if orcid:
             nameIdentifier = ET.SubElement(name, "nameIdentifier")
             nameIdentifier.set("type", "orcid")
             nameIdentifier.text = orcid
 
         # Add the affiliation if it exists
-        self.add_affiliation(author['affiliations'], name)
+        self.add_affiliation(author.affiliations, name)
 
     def add_affiliation(self, affiliations, mods):
-        if affiliations is not None and self.is_author_affiliated(affiliations):
+        # affiliations is None unless the author is affiliated (see normalized.py)
+        if affiliations is not None:
         # create affiliations as following:
 
         # each entry in the affiliation list will be added as an affiliation element as in following example:
@@ -268,22 +274,20 @@ class OAIProvider:
             affiliation_element.set("valueURI", "gu.se")
             affiliation_element.text = "Gothenburg University"
 
-            for affiliation in affiliations:
+            for department_id, name_sv, name_en in affiliations:
                 affiliation_element = ET.SubElement(mods, "affiliation")
                 affiliation_element.set("lang", "swe")
                 affiliation_element.set("authority", "gu.se")
                 affiliation_element.set("{http://www.w3.org/2001/XMLSchema-instance}type", "mods:stringPlusLanguagePlusAuthority")
-                affiliation_element.set("valueURI", f"gu.se/{affiliation['department_id']}")
-                affiliation_element.text = self.sanitize(affiliation["name_sv"])
+                affiliation_element.set("valueURI", f"gu.se/{department_id}")
+                affiliation_element.text = name_sv
 
                 affiliation_element = ET.SubElement(mods, "affiliation")
                 affiliation_element.set("lang", "eng")
                 affiliation_element.set("authority", "gu.se")
                 affiliation_element.set("{http://www.w3.org/2001/XMLSchema-instance}type", "mods:stringPlusLanguagePlusAuthority")
-                affiliation_element.set("valueURI", f"gu.se/{affiliation['department_id']}")
-                affiliation_element.text = self.sanitize(affiliation["name_en"])
-
-
+                affiliation_element.set("valueURI", f"gu.se/{department_id}")
+                affiliation_element.text = name_en
 
     def is_author_affiliated(self, affiliations):
         # an author is affiliated if there is at least one affiliation with a department_id other than 666 and 667
@@ -299,21 +303,17 @@ class OAIProvider:
                 return identifier["value"]
         return None
 
-    def get_genre(self, mods):
-        publication_type_code = self.publication_json["publication_type_code"]
-        ref_value = self.publication_json["ref_value"]
-        publication_type_info = self.get_publication_type_info(publication_type_code, ref_value)
-
+    def get_genre(self, mods, record):
         # return content_type genre and output_type genre that will generete xml in this form:
         #<genre authority="kb.se" type="outputType">publication/doctoral-thesis</genre>
         #<genre authority="svep" type="contentType">vet</genre>
         output_type = ET.SubElement(mods, "genre")
         output_type.set("authority", "kb.se")
         output_type.set("type", "outputType")
-        output_type.text = publication_type_info["output_type"]
+        output_type.text = record.output_type
 
         # Special handling for publication on artistic basis, set an extra outputType genre if artistic_basis is not None and is True
-        if self.publication_json["artistic_basis"]:
+        if record.artistic_basis:
             artistic_basis = ET.SubElement(mods, "genre")
             artistic_basis.set("authority", "kb.se")
             artistic_basis.set("type", "outputType")
@@ -322,7 +322,7 @@ class OAIProvider:
         content_type = ET.SubElement(mods, "genre")
         content_type.set("authority", "svep")
         content_type.set("type", "contentType")
-        content_type.text = publication_type_info["content_type"]
+        content_type.text = record.content_type
 
     # Get the role code based on the specified mapping rules. If not found return defaule value "aut"
     def get_role_code(self, publication_type_code):
@@ -371,9 +371,9 @@ class OAIProvider:
         return publication_type_mapping.get(publication_type_code, {'content_type': 'vet', 'output_type': 'publication/other'})
 
 
-    def get_language(self, mods):
-        if "publanguage" in self.publication_json:
-            language_code = self.get_language_code(self.publication_json["publanguage"])
+    def get_language(self, mods, record):
+        if record.language is not None:
+            language_code = record.language
             # return language in this form:
             #<language>
             #<languageTerm type="code" authority="iso639-2b">language_code</languageTerm>
@@ -457,146 +457,93 @@ class OAIProvider:
         }
         return language_mapping.get(language, "und")
 
-    def get_subjects(self, mods):
-        subjects = self.publication_json["keywords"]
-        # Split the string and add each subject to the xml, if None return empty list
-        # trim each subject
-        []
-        if subjects and subjects is not None:
-           subjects = self.sanitize(subjects)
-           [self.add_subject(mods, subject.strip()) for subject in subjects.split(",")]
+    def get_subjects(self, mods, record):
+        [self.add_subject(mods, subject) for subject in record.keywords]
 
     def add_subject(self, mods, subject):
         subject_element = ET.SubElement(mods, "subject")
         topic = ET.SubElement(subject_element, "topic")
         topic.text = subject
 
-    def get_notes(self, mods):
+    def get_notes(self, mods, record):
         published_status = ET.SubElement(mods, "note")
         published_status.set("type", "publicationStatus")
-        epub_ahead_of_print = self.publication_json["epub_ahead_of_print"]
         #if epub_ahead_of_print exists and is not empty then set text to "Epub ahead of print", otherwise set text to "Published"
-        if epub_ahead_of_print and epub_ahead_of_print is not None:
+        if record.epub_ahead_of_print:
             published_status.text = "Epub ahead of print"
         else:
             published_status.text = "Published"
 
         creator_count = ET.SubElement(mods, "note")
         creator_count.set("type", "creatorCount")
-        # set the text to the number of authors, set to 0 if authors is None
-        creator_count.text = str(len(self.publication_json.get("authors", [])) if self.publication_json.get("authors") is not None else 0)
+        creator_count.text = str(record.creator_count)
 
-    def get_origin_info(self, mods):
-        # check that each element exists and is not None before adding it to the xml
+    def get_origin_info(self, mods, record):
         origin_info = ET.SubElement(mods, "originInfo")
-        pubyear = self.publication_json["pubyear"]
-        if pubyear and pubyear is not None:
+        if record.pubyear:
             date_issued = ET.SubElement(origin_info, "dateIssued")
-            date_issued.text = str(pubyear)
-        publisher = self.publication_json["publisher"]
-        if publisher and publisher is not None:
+            date_issued.text = record.pubyear
+        if record.publisher:
             publisher_element = ET.SubElement(origin_info, "publisher")
-            publisher_element.text = self.sanitize(publisher)
-        place = self.publication_json["place"]
-        if place and place is not None:
+            publisher_element.text = record.publisher
+        if record.place:
             place_element = ET.SubElement(origin_info, "place")
             place_term = ET.SubElement(place_element, "placeTerm")
-            place_term.text = self.sanitize(place)
-
-    def get_related_item(self, mods):
-        # this is only for non-monographs and the publication must have either a sourcetitle or a made_public_in field
-        if not self.is_monograph():
-            sourcetitle = self.publication_json["sourcetitle"]
-            made_public_in = self.publication_json["made_public_in"]
-
-            if sourcetitle and sourcetitle is not None or made_public_in and made_public_in is not None:
-                related_item = ET.SubElement(mods, "relatedItem")
-                related_item.set("type", "host")
-                if sourcetitle and sourcetitle is not None:
-                    title_info = ET.SubElement(related_item, "titleInfo")
-                    title = ET.SubElement(title_info, "title")
-                    title.text = self.sanitize(sourcetitle)
-                if made_public_in and made_public_in is not None:
-                    title_info = ET.SubElement(related_item, "titleInfo")
-                    title = ET.SubElement(title_info, "title")
-                    title.text = self.sanitize(made_public_in)
-                # get issn, eissn and isbn if not None and set as identifiers
-                issn = self.publication_json["issn"]
-                eissn = self.publication_json["eissn"]
-                isbn = self.publication_json["isbn"]
-                if issn and issn is not None:
-                    identifier = ET.SubElement(related_item, "identifier")
-                    identifier.set("type", "issn")
-                    identifier.text = self.sanitize(issn)
-                if eissn and eissn is not None:
-                    identifier = ET.SubElement(related_item, "identifier")
-                    identifier.set("type", "issn")
-                    identifier.text = self.sanitize(eissn)
-                if isbn and isbn is not None:
-                    identifier = ET.SubElement(related_item, "identifier")
-                    identifier.set("type", "isbn")
-                    identifier.text = self.sanitize(isbn)
-                # if any of sourcevolume, sourceissue, article_number and sourcepages is not None, create a part element an set the values
-                sourcevolume = self.publication_json["sourcevolume"]
-                sourceissue = self.publication_json["sourceissue"]
-                article_number = self.publication_json["article_number"]
-                sourcepages = self.publication_json["sourcepages"]
-                if sourcevolume and sourcevolume is not None or sourceissue and sourceissue is not None or article_number and article_number is not None or sourcepages and sourcepages is not None:
-                    part = ET.SubElement(related_item, "part")
-                    if sourcevolume and sourcevolume is not None:
-                        detail = ET.SubElement(part, "detail")
-                        detail.set("type", "volume")
-                        number = ET.SubElement(detail, "number")
-                        number.text = self.sanitize(sourcevolume)
-                    if sourceissue and sourceissue is not None:
-                        detail = ET.SubElement(part, "detail")
-                        detail.set("type", "issue")
-                        number = ET.SubElement(detail, "number")
-                        number.text = self.sanitize(sourceissue)
-                    if article_number and article_number is not None:
-                        detail = ET.SubElement(part, "detail")
-                        detail.set("type", "artNo")
-                        number = ET.SubElement(detail, "number")
-                        number.text = self.sanitize(article_number)
-                    if sourcepages and sourcepages is not None:
-                        # if it is possible to split the sourcepages into start and end pages, set the values in the extent element, othervise set the value in the detail (citation attribute) caption element 
-                        start_end_pages = self.get_start_and_end_page(sourcepages)
-                        if start_end_pages:
-                            extent = ET.SubElement(part, "extent")
-                            start = ET.SubElement(extent, "start")
-                            start.text = start_end_pages[0]
-                            end = ET.SubElement(extent, "end")
-                            end.text = start_end_pages[1]
-                        else:
-                            detail = ET.SubElement(part, "detail")
-                            detail.set("type", "citation")
-                            number = ET.SubElement(detail, "caption")
-                            number.text = self.sanitize(sourcepages)
-
-    def get_series(self, mods):
-        series = self.publication_json["series"]
-        if series and series is not None:
-            [self.add_series(mods, serie) for serie in series]
-        else:
-            []
+            place_term.text = record.place
+
+    def get_related_item(self, mods, record):
+        # only for non-monographs with either a sourcetitle or a made_public_in field (see normalized.py)
+        host = record.host
+        if host is None:
+            return
+        related_item = ET.SubElement(mods, "relatedItem")
+        related_item.set("type", "host")
+        for host_title in host.titles:
+            title_info = ET.SubElement(related_item, "titleInfo")
+            title = ET.SubElement(title_info, "title")
+            title.text = host_title
+        for identifier_type, value in host.identifiers:
+            identifier = ET.SubElement(related_item, "identifier")
+            identifier.set("type", identifier_type)
+            identifier.text = value
+        if host.has_part:
+            part = ET.SubElement(related_item, "part")
+            for detail_type, value in (("volume", host.volume), ("issue", host.issue), ("artNo", host.article_number)):
+                if value:
+                    detail = ET.SubElement(part, "detail")
+                    detail.set("type", detail_type)
+                    number = ET.SubElement(detail, "number")
+                    number.text = value
+            # page ranges are set in the extent element, other source pages in the detail (citation attribute) caption element
+            if host.pages:
+                extent = ET.SubElement(part, "extent")
+                start = ET.SubElement(extent, "start")
+                start.text = host.pages[0]
+                end = ET.SubElement(extent, "end")
+                end.text = host.pages[1]
+            elif host.citation:
+                detail = ET.SubElement(part, "detail")
+                detail.set("type", "citation")
+                number = ET.SubElement(detail, "caption")
+                number.text = host.citation
+
+    def get_series(self, mods, record):
+        [self.add_series(mods, serie) for serie in record.series]
 
     def add_series(self, mods, serie):
-        title = serie["title"]
-        if title and title is not None:
-            related_item = ET.SubElement(mods, "relatedItem")
-            related_item.set("type", "series")
-            title_info = ET.SubElement(related_item, "titleInfo")
-            title_element = ET.SubElement(title_info, "title")
-            title_element.text = title
-            part_number = serie["part"]
-            if part_number and part_number is not None:
-                part_number_element = ET.SubElement(title_info, "partNumber")
-                part_number_element.text = part_number
-            issn = serie["issn"]
-            if issn and issn is not None:
-                identifier = ET.SubElement(related_item, "identifier")
-                identifier.set("type", "issn")
-                identifier.text = issn
+        title, part_number, issn = serie
+        related_item = ET.SubElement(mods, "relatedItem")
+        related_item.set("type", "series")
+        title_info = ET.SubElement(related_item, "titleInfo")
+        title_element = ET.SubElement(title_info, "title")
+        title_element.text = title
+        if part_number:
+            part_number_element = ET.SubElement(title_info, "partNumber")
+            part_number_element.text = part_number
+        if issn:
+            identifier = ET.SubElement(related_item, "identifier")
+            identifier.set("type", "issn")
+            identifier.text = issn
 
     def get_start_and_end_page(self, sourcepages):
         # if sourcepage contains other than digits, hyphen ("–" or "-") and space, return None
@@ -609,43 +556,32 @@ class OAIProvider:
             return [page.strip() for page in pages]
         return None
 
-    def get_location(self, mods):
-        files = self.publication_json.get("files")  # Add a check to ensure the "files" key exists
-        if files and self.has_viewable_file(files):
+    def get_location(self, mods, record):
+        if record.has_viewable_file():
             location = ET.SubElement(mods, "location")
             url = ET.SubElement(location, "url")
             url.set("note", "free")
             url.set("usage", "primary")
             url.set("displayLabel", "FULLTEXT")
-            url.text = os.environ.get("URI_PREFIX") + "/" + str(self.publication_json["publication_id"])
+            url.text = record.uri
 
-    def get_access_condition(self, mods):
-        is_open_access = self.publication_json.get("is_open_access")  # Add a check to ensure the "is_open_access" key exists
-        if is_open_access:
+    def get_access_condition(self, mods, record):
+        if record.open_access:
             access_condition = ET.SubElement(mods, "accessCondition")
             access_condition.set("authority", "kb.se")
             access_condition.set("valueURI", "https://id.kb.se/policy/oa/gratis")
             access_condition.text = "gratis"
 
-    def get_physical_description(self, mods):
-        files = self.publication_json.get("files")  # Add a check to ensure the "files" key exists
-        if files and self.has_viewable_file(files):
+    def get_physical_description(self, mods, record):
+        if record.has_viewable_file():
             physical_description = ET.SubElement(mods, "physicalDescription")
             form = ET.SubElement(physical_description, "form")
             form.set("authority", "marcform")
             form.text = "electronic"
 
-    def has_viewable_file(self, files):
-        # if there is at least one file with following conditions, return True, otherwise return False
-        # accepted is not None
-        #visible_after is either None or has a date (in format "YYYY-MM-DD") that is before or equal to the current date
-
-        return any(file["accepted"] and (file["visible_after"] is None or datetime.strptime(file["visible_after"], "%Y-%m-%d") <= datetime.now()) for file in files)
-
-    def get_type_of_resource(self, mods):
-        publication_type_code = self.publication_json["publication_type_code"]
+    def get_type_of_resource(self, mods, record):
         type_of_resource = ET.SubElement(mods, "typeOfResource")
-        type_of_resource.text = self.get_type_of_resource_code(publication_type_code)
+        type_of_resource.text = record.type_of_resource
 
     def get_type_of_resource_code(self, publication_type_code):
         type_of_resource_mapping = {
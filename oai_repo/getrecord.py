@@ -4,7 +4,7 @@ Implementation of GetRecord verb
 from datetime import datetime
 from lxml import etree
 from .request import OAIRequest
-from .response import OAIResponse
+from .response import OAIResponse, FRAGMENT_PI
 from .exceptions import OAIErrorIdDoesNotExist, OAIErrorCannotDisseminateFormat
 from .helpers import granularity_format
 
@@ -90,7 +90,7 @@ class GetRecordResponse(OAIResponse):
 
         granularity = self.repository.data.get_identify().granularity
         xmlb = etree.Element("GetRecord")
-        record(self.repository, identifier, metadataprefix, xmlb)
+        record(self.repository, identifier, metadataprefix, xmlb, self.fragments if self.compact else None)
         return xmlb
 
 def header(repository: "OAIRepository", identifier: str, xmlb: etree._Element):
@@ -122,13 +122,16 @@ def header(repository: "OAIRepository", identifier: str, xmlb: etree._Element):
             xset.text = setspec
     return deleted
 
-def record(repository: "OAIRepository", identifier: str, metadataprefix: str, xmlb: etree._Element):
+def record(repository: "OAIRepository", identifier: str, metadataprefix: str, xmlb: etree._Element,
+           fragments: list = None):
     """
     Generate and append a <record> OAI element to and XML doc.
     Args:
         repository (OAIRepository): An instantiated repository class
         identifier (str): A valid identifier string
         xmlb (lxml.etree._Element): The element to add the header to
+        fragments (list): If given, the serialized metadata is added to it and a placeholder to
+                          the record, for OAIResponse.splice
     Returns:
         A lxml.etree._Element for the root of the header
     """
@@ -138,9 +141,13 @@ def record(repository: "OAIRepository", identifier: str, metadataprefix: str, xm
     # Metadata
     if not deleted:
         xmeta = etree.SubElement(xrec, "metadata")
-        xmeta.append(
-           repository.data.get_record_metadata(identifier, metadataprefix)
-        )
+        if fragments is not None:
+            fragments.append(repository.data.get_record_fragment(identifier, metadataprefix))
+            xmeta.append(etree.PI(FRAGMENT_PI))
+        else:
+            xmeta.append(
+               repository.data.get_record_metadata(identifier, metadataprefix)
+            )
         # About
         abouts = repository.data.get_record_abouts(identifier)
         for about in abouts:
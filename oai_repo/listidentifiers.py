@@ -6,8 +6,9 @@ from .request import OAIRequest
 from .response import OAIResponse
 from .getrecord import header
 from .resumption import ResumptionToken
+from .helpers import until_date
 from .exceptions import (
-    OAIErrorNoRecordsMatch, OAIErrorBadResumptionToken,
+    OAIErrorNoRecordsMatch,
     OAIErrorCannotDisseminateFormat
 )
 
@@ -31,22 +32,21 @@ class ListIdentifiersRequest(OAIRequest):
 
     def post_parse(self):
         """Runs after args are parsed"""
-        def first_match(key, *args):
-            """Return first value from args with key, else None"""
-            for arg in args:
-                if arg and key in arg:
-                    return arg[key]
-            return None
-
+        # A token carries the whole state of the list, checked here before any work is done
         if "resumptionToken" in self.args:
-            self.token.parse(self.args["resumptionToken"])
+            self.token.parse(self.args["resumptionToken"], self.verb)
+            args = self.token.args
+        else:
+            args = self.args
 
-        self.filter_from = first_match("from", self.token.args, self.args)
-        self.filter_until = first_match("until", self.token.args, self.args)
-        self.filter_set = first_match("set", self.token.args, self.args)
-        self.metadata_prefix = first_match("metadataPrefix", self.token.args, self.args)
-        if "resumptionToken" in self.args and not self.metadata_prefix:
-            raise OAIErrorBadResumptionToken("The resumption token is not valid for given verb.")
+        self.filter_from = args.get("from")
+        self.filter_until = args.get("until")
+        self.filter_set = args.get("set")
+        self.metadata_prefix = args.get("metadataPrefix")
+        # Sort values of the last record of the previous page, when harvesting in datestamp order
+        self.filter_after = args.get("after")
+        # Harvest session the token was issued in, when harvests are traced
+        self.session = args.get("sid")
 
 
 class ListIdentifiersResponse(OAIResponse):
@@ -67,32 +67,45 @@ class ListIdentifiersResponse(OAIResponse):
         identifiers, new_size, state = self.repository.data.list_identifiers(
             self.request.metadata_prefix,
             self.repository.valid_date(self.request.filter_from),
-            self.repository.valid_date(self.request.filter_until),
+            until_date(self.repository, self.request.filter_until),
             self.request.filter_set,
-            cursor
+            cursor,
+            after=self.request.filter_after
         )
+        # Pages after the first are not counted again, the list size is carried by the token
+        if new_size is None:
+            new_size = self.request.token.complete_list_size
 
-        if not identifiers:
-            raise OAIErrorNoRecordsMatch("No identifiers were found matching given parameters.")
+        try:
+            if not identifiers:
+                raise OAIErrorNoRecordsMatch("No identifiers were found matching given parameters.")
 
-        xmlb = etree.Element("ListIdentifiers")
-        # populate response body with record headers
-        for identifier in identifiers:
-            header(self.repository, identifier, xmlb)
+            xmlb = etree.Element("ListIdentifiers")
+            # populate response body with record headers
+            for identifier in identifiers:
+                header(self.repository, identifier, xmlb)
 
-        # append a resumptionToken if needed
-        if new_size > self.repository.data.limit:
-            token = ResumptionToken()
-            token.cursor = cursor
-            token.complete_list_size = new_size
-            token.set_state(state)
-            token.args = { "metadataPrefix": self.request.metadata_prefix }
-            if self.request.filter_from:
-                token.args['from'] = self.request.filter_from
-            if self.request.filter_until:
-                token.args['until'] = self.request.filter_until
-            if self.request.filter_set:
-                token.args['set'] = self.request.filter_set
-            if (token_xml := token.xml(self.repository.data.limit)) is not None:
-                xmlb.append(token_xml)
-        return xmlb
+            # append a resumptionToken if needed
+            if new_size > self.repository.data.limit:
+                token = ResumptionToken()
+                token.verb = self.request.verb
+                token.cursor = cursor
+                token.complete_list_size = new_size
+                token.set_state(state)
+                token.args = { "metadataPrefix": self.request.metadata_prefix }
+                if self.request.filter_from:
+                    token.args['from'] = self.request.filter_from
+                if self.request.filter_until:
+                    token.args['until'] = self.request.filter_until
+                if self.request.filter_set:
+                    token.args['set'] = self.request.filter_set
+                if (after := self.repository.data.get_search_after(identifiers[-1])) is not None:
+                    token.args['after'] = after
+                if (session := self.repository.data.harvest_session(self.request.session)) is not None:
+                    token.args['sid'] = session
+                if (token_xml := token.xml(self.repository.data.limit)) is not None:
+                    xmlb.append(token_xml)
+            return xmlb
+        finally:
+            # The publications fetched for this page are no longer needed
+            self.repository.data.release_page()
@@ -1,16 +1,19 @@
 """
 Implementation of ListRecords verb
 """
+import time
 from lxml import etree
 from .request import OAIRequest
 from .response import OAIResponse
 from .getrecord import record
 from .resumption import ResumptionToken
+from .helpers import until_date
 from .exceptions import (
-    OAIErrorNoRecordsMatch, OAIErrorBadResumptionToken,
+    OAIErrorNoRecordsMatch,
     OAIErrorCannotDisseminateFormat
 )
 
+
 class ListRecordsRequest(OAIRequest):
     """
     Parse a request for the ListRecords verb
@@ -30,28 +33,30 @@ class ListRecordsRequest(OAIRequest):
 
     def post_parse(self):
         """Runs after args are parsed"""
-        def first_match(key, *args):
-            """Return first value from args with key, else None"""
-            for arg in args:
-                if arg and key in arg:
-                    return arg[key]
-            return None
-
+        # A token carries the whole state of the list, checked here before any work is done
         if "resumptionToken" in self.args:
-            self.token.parse(self.args["resumptionToken"])
+            self.token.parse(self.args["resumptionToken"], self.verb)
+            args = self.token.args
+        else:
+            args = self.args
 
-        self.filter_from = first_match("from", self.token.args, self.args)
-        self.filter_until = first_match("until", self.token.args, self.args)
-        self.filter_set = first_match("set", self.token.args, self.args)
-        self.metadata_prefix = first_match("metadataPrefix", self.token.args, self.args)
-        if "resumptionToken" in self.args and not self.metadata_prefix:
-            raise OAIErrorBadResumptionToken("The resumption token is not valid for given verb.")
+        self.filter_from = args.get("from")
+        self.filter_until = args.get("until")
+        self.filter_set = args.get("set")
+        self.metadata_prefix = args.get("metadataPrefix")
+        # Sort values of the last record of the previous page, when harvesting in datestamp order
+        self.filter_after = args.get("after")
+        # Harvest session the token was issued in, when harvests are traced
+        self.session = args.get("sid")
+        # Number of records on the previous page, when it was closed before the limit
+        self.served = args.get("n")
 
 
 class ListRecordsResponse(OAIResponse):
     """Generate a resposne for the ListRecords verb"""
     def body(self) -> etree.Element:
         """Response body"""
+        started = time.monotonic()
         mdformats = self.repository.data.get_metadata_formats()
         if self.request.metadata_prefix not in [mdf.metadata_prefix for mdf in mdformats]:
             raise OAIErrorCannotDisseminateFormat(
@@ -59,39 +64,89 @@ class ListRecordsResponse(OAIResponse):
             )
 
         cursor = (
-            self.request.token.cursor + self.repository.data.limit
+            self.request.token.cursor + int(self.request.served or self.repository.data.limit)
             if self.request.token.cursor is not None else 0
         )
 
         identifiers, new_size, state = self.repository.data.list_identifiers(
             self.request.metadata_prefix,
             self.repository.valid_date(self.request.filter_from),
-            self.repository.valid_date(self.request.filter_until),
+            until_date(self.repository, self.request.filter_until),
             self.request.filter_set,
-            cursor
+            cursor,
+            after=self.request.filter_after
         )
+        # Pages after the first are not counted again, the list size is carried by the token
+        if new_size is None:
+            new_size = self.request.token.complete_list_size
+
+        try:
+            if not identifiers:
+                raise OAIErrorNoRecordsMatch("No identifiers were found matching given parameters.")
+
+            # Let the data provider prepare the metadata of the whole page at once
+            self.repository.data.prepare_records(identifiers, self.request.metadata_prefix)
 
-        if not identifiers:
-            raise OAIErrorNoRecordsMatch("No identifiers were found matching given parameters.")
+            xmlb = etree.Element("ListRecords")
+            # populate response body with records, until the time or size budget of a page is used up
+            time_budget, byte_budget = self.repository.data.get_page_budget()
+            served = size = 0
+            # Serialized sizes of the metadata of the records on the page, to estimate the rest by
+            metadata_sizes = []
+            fragments = self.fragments if self.compact else None
+            for identifier in identifiers:
+                spliced = len(self.fragments)
+                record(self.repository, identifier, self.request.metadata_prefix, xmlb, fragments)
+                served += 1
+                if byte_budget:
+                    size += len(etree.tostring(xmlb[-1][0])) + self.metadata_size(
+                        identifier, xmlb[-1], self.fragments[spliced:], metadata_sizes
+                    )
+                if (time_budget and time.monotonic() - started >= time_budget) or \
+                        (byte_budget and size >= byte_budget):
+                    break
 
-        xmlb = etree.Element("ListRecords")
-        # populate response body with record headers
-        for identifier in identifiers:
-            record(self.repository, identifier, self.request.metadata_prefix, xmlb)
+            # append a resumptionToken if needed
+            if new_size > self.repository.data.limit or served < len(identifiers):
+                token = ResumptionToken()
+                token.verb = self.request.verb
+                token.cursor = cursor
+                token.complete_list_size = new_size
+                token.set_state(state)
+                token.args = { "metadataPrefix": self.request.metadata_prefix }
+                if self.request.filter_from:
+                    token.args['from'] = self.request.filter_from
+                if self.request.filter_until:
+                    token.args['until'] = self.request.filter_until
+                if self.request.filter_set:
+                    token.args['set'] = self.request.filter_set
+                if (after := self.repository.data.get_search_after(identifiers[served - 1])) is not None:
+                    token.args['after'] = after
+                if served < len(identifiers):
+                    token.args['n'] = served
+                if (session := self.repository.data.harvest_session(self.request.session)) is not None:
+                    token.args['sid'] = session
+                if (token_xml := token.xml(served)) is not None:
+                    xmlb.append(token_xml)
+            return xmlb
+        finally:
+            # The publications fetched for this page are no longer needed
+            self.repository.data.release_page()
 
-        # append a resumptionToken if needed
-        if new_size > self.repository.data.limit:
-            token = ResumptionToken()
-            token.cursor = cursor
-            token.complete_list_size = new_size
-            token.set_state(state)
-            token.args = { "metadataPrefix": self.request.metadata_prefix }
-            if self.request.filter_from:
-                token.args['from'] = self.request.filter_from
-            if self.request.filter_until:
-                token.args['until'] = self.request.filter_until
-            if self.request.filter_set:
-                token.args['set'] = self.request.filter_set
-            if (token_xml := token.xml(self.repository.data.limit)) is not None:
-                xmlb.append(token_xml)
-        return xmlb
+    def metadata_size(self, identifier: str, xrec: etree._Element, spliced: list, sizes: list) -> int:
+        """
+        Bytes the metadata of a record adds to the page: its spliced fragments in a compact response,
+        otherwise the size of its serialized metadata, if the data provider knows it, or else the
+        average of the records before it. Only the first record of such a page is serialized again.
+        """
+        if spliced:
+            return sum(map(len, spliced))
+        if len(xrec) < 2:
+            return 0
+        size = self.repository.data.get_record_size(identifier, self.request.metadata_prefix)
+        if size is None:
+            if sizes:
+                return sum(sizes) // len(sizes)
+            size = len(etree.tostring(xrec[1]))
+        sizes.append(size)
+        return size
@@ -0,0 +1,195 @@
+"""
+Handling OAI-PMH responses
+"""
+from __future__ import annotations      # To use non-string type hinting; can remove in Python 3.11
+from itertools import chain
+from typing import TYPE_CHECKING, NamedTuple
+from datetime import datetime, timezone
+from lxml import etree
+from .helpers import datestamp_long
+if TYPE_CHECKING:                       # Prevent circular imports for type hinting
+    from .request import OAIRequest
+    from .repository import OAIRepository
+
+
+XML_HEADER = b'<?xml version="1.0" encoding="UTF-8" ?>\n'
+NSMAP_BASE = {
+    None: b"http://www.openarchives.org/OAI/2.0/",
+    "xsi": b"http://www.w3.org/2001/XMLSchema-instance",
+}
+NSMAP_SCHEMA = (
+    b"{" + NSMAP_BASE["xsi"] + b"}schemaLocation",
+    b"http://www.openarchives.org/OAI/2.0/ "
+    b"http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd"
+)
+OAIIDENTIFIER_SCHEMA = (
+    b"{" + NSMAP_BASE["xsi"] + b"}schemaLocation",
+    b"http://www.openarchives.org/OAI/2.0/oai-identifier "
+    b"http://www.openarchives.org/OAI/2.0/oai-identifier.xsd"
+)
+NSMAP_OAIDC = {
+    "xsi": b"http://www.w3.org/2001/XMLSchema-instance",
+    'dc' : b'http://purl.org/dc/elements/1.1/',
+    'oai_dc': b'http://www.openarchives.org/OAI/2.0/oai_dc/'
+}
+OAIDC_SCHEMA = (
+    b"{" + NSMAP_BASE["xsi"] + b"}schemaLocation",
+    b"http://www.openarchives.org/OAI/2.0/oai_dc/ "
+    b"http://www.openarchives.org/OAI/2.0/oai_dc.xsd"
+)
+
+# Placeholder of serialized metadata spliced into a compact document (see OAIResponse.document)
+FRAGMENT_PI = "oai-fragment"
+FRAGMENT_MARK = etree.tostring(etree.PI(FRAGMENT_PI))
+
+class Envelope(NamedTuple):
+    """Pre-encoded parts of the OAI-PMH envelope"""
+    # Declaration and root start tag, up to the responseDate value
+    start: bytes
+    # From the end of the responseDate value to the request element
+    after_response_date: bytes
+    # Start tag of the root without attributes, before the body when it is serialized in one
+    container_start: bytes
+
+def _envelope(pretty_print: bool = True) -> Envelope:
+    """Cut the envelope out of a serialized response with placeholders"""
+    root = etree.Element("OAI-PMH", nsmap=NSMAP_BASE)
+    root.set(*NSMAP_SCHEMA)
+    etree.SubElement(root, "responseDate").text = "DATE"
+    etree.SubElement(root, "request")
+    document = etree.tostring(
+        etree.ElementTree(root), xml_declaration=True, encoding="UTF-8", pretty_print=pretty_print
+    )
+    start, rest = document.split(b"DATE", 1)
+    container = etree.Element("OAI-PMH", nsmap=NSMAP_BASE)
+    etree.SubElement(container, "request")
+    container = etree.tostring(container, encoding="UTF-8", pretty_print=pretty_print)
+    return Envelope(
+        start=start,
+        after_response_date=rest.split(b"<request/>", 1)[0],
+        container_start=container[:container.index(b">") + 1],
+    )
+
+ENVELOPE = _envelope()
+COMPACT_ENVELOPE = _envelope(pretty_print=False)
+
+class OAIResponse:
+    """
+    Base class for OAI responses
+    """
+    def __init__(
+        self,
+        repository: OAIRepository,
+        request: OAIRequest = None,
+        response_date: datetime = None
+    ):
+        self.repository = repository
+        self.request = request
+        response_date = response_date if response_date else datetime.now(timezone.utc)
+        self.response_date = datestamp_long(response_date)
+        # Without pretty printing, records splice their serialized metadata into the document
+        self.compact = repository.data.get_compact_xml()
+        self.fragments = []
+        # Only the body is built as elements, the envelope around it is written from ENVELOPE
+        # by document(); the root element is built on demand by root()
+        self.xmlb = self.body()
+        self.xmlr = None
+
+    def __bool__(self):
+        """
+        Whether the OAIResponse represents a success or not.
+        Returns False if response is an OAIError.
+        Examples:
+        ```python
+        response = repo.process(args)
+        if not response:
+            print(f"The response is an OAIError.")
+        ```
+        """
+        return True
+
+    def body(self) -> etree.Element:
+        """
+        Abstract method to generate OAI response body.
+        Returns:
+            lxml.etree.Element:
+        """
+        raise NotImplementedError("OAIResponse must implement the body() method.")
+
+    def root(self) -> etree.Element:
+        """
+        Return the root lxml.etree.Element.
+        """
+        if self.xmlr is None:
+            self.xmlr = etree.Element("OAI-PMH", nsmap=NSMAP_BASE)
+            self.xmlr.set(*NSMAP_SCHEMA)
+            response_date_elem = etree.SubElement(self.xmlr, "responseDate")
+            response_date_elem.text = self.response_date
+            self.xmlr.append(self.request_element())
+            self.xmlr.append(self.xmlb)
+        return self.xmlr
+
+    def request_element(self) -> etree.Element:
+        """
+        Return the request element, echoing the arguments of a successful request.
+        """
+        request_elem = etree.Element("request")
+        request_elem.text = self.repository.data.get_identify().base_url
+        if self and self.request:
+            for argk, argv in self.request.args.items():
+                request_elem.set(argk, argv)
+        return request_elem
+
+    def xpath(self, query: str) -> etree.Element:
+        """
+        Return results of an xpath query from the root element.
+        """
+        return self.root().xpath(query)
+
+    def __bytes__(self):
+        """
+        Return the XML response as bytes, including an XML header line.
+        ```python
+        response = repo.process(args)
+        xml_bytes = bytes(response)
+        ```
+        """
+        return XML_HEADER + self.splice(etree.tostring(self.root(), pretty_print=not self.compact))
+
+    def document(self) -> bytes:
+        """
+        Return the XML response as UTF-8 bytes with an XML declaration, pretty printed unless the
+        repository asks for compact XML, exactly as lxml serializes the ElementTree of root(); only
+        the body is serialized by lxml.
+        ```python
+        response = repo.process(args)
+        xml_bytes = response.document()
+        ```
+        """
+        pretty_print = not self.compact
+        if self.xmlr is not None:
+            return self.splice(etree.tostring(
+                etree.ElementTree(self.xmlr), xml_declaration=True, encoding="UTF-8", pretty_print=pretty_print
+            ))
+        # Serialized in an element like the root, the body gets the indentation and namespace
+        # declarations it has in the whole document
+        envelope = ENVELOPE if pretty_print else COMPACT_ENVELOPE
+        container = etree.Element("OAI-PMH", nsmap=NSMAP_BASE)
+        container.append(self.xmlb)
+        body = etree.tostring(container, encoding="UTF-8", pretty_print=pretty_print)
+        return self.splice(b"".join((
+            envelope.start,
+            self.response_date.encode(),
+            envelope.after_response_date,
+            etree.tostring(self.request_element(), encoding="UTF-8"),
+            body[len(envelope.container_start):],
+        )))
+
+    def splice(self, document: bytes) -> bytes:
+        """
+        Replace the placeholders of a serialized document with the metadata fragments, in order.
+        """
+        if not self.fragments:
+            return document
+        parts = document.split(FRAGMENT_MARK)
+        return b"".join(chain.from_iterable(zip(parts, self.fragments))) + parts[-1]
@@ -0,0 +1,289 @@
+"""
+ResumptionToken functionality
+
+A token is URL-safe base64 (without padding) of a version byte, the packed state of the list and a
+truncated HMAC of both and the verb. The state is everything needed to serve the next page, so any
+worker or node configured with the same secret can resume a list. Tokens are checked before the
+request is answered: a token that was altered, issued for another verb or has expired is rejected
+with badResumptionToken.
+
+Packed state of version 1, integers as unsigned LEB128 varints and strings as a varint length and
+UTF-8 bytes:
+    flags               one byte, which of the optional fields below are present
+    cursor, size + 1    size 0 for a list of unknown size
+    expiry              seconds since the epoch, 0 for a token that does not expire
+    metadataPrefix
+    from, until         seconds since 0001-01-01 times two, plus one for a date without a time
+    set
+    after               the number of sort values and the values, or a string if any is not an integer
+    n                   records served on the page the token was issued for
+    sid                 session id of a traced harvest
+    h                   8 bytes of state hash
+"""
+import hmac
+import secrets
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from hashlib import blake2s, sha256
+from lxml import etree
+from . import helpers
+from .exceptions import OAIErrorBadResumptionToken
+
+VERSION = 1
+MAC_SIZE = 12
+
+FROM, UNTIL, SET, AFTER, AFTER_TEXT, SERVED, SESSION, STATE = (1 << bit for bit in range(8))
+DATE_FORMATS = ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d")
+# Dates are counted from the first one strptime can parse, so that none is negative
+DATE_EPOCH = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+
+def _put_int(buffer: bytearray, value: int):
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _put_str(buffer: bytearray, value: str):
+    data = value.encode('utf8')
+    _put_int(buffer, len(data))
+    buffer += data
+
+
+def _put_date(buffer: bytearray, value: str):
+    # Dates of an issued token have been validated by the repository
+    for day, datefmt in enumerate(DATE_FORMATS):
+        try:
+            date = datetime.strptime(value.strip(), datefmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        _put_int(buffer, int((date - DATE_EPOCH).total_seconds()) * 2 + day)
+        return
+    raise ValueError(f"Invalid date {value!r}")
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def int(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def bytes(self, size: int) -> bytes:
+        if self.offset + size > len(self.data):
+            raise ValueError("Truncated token")
+        self.offset += size
+        return self.data[self.offset - size:self.offset]
+
+    def str(self) -> str:
+        return self.bytes(self.int()).decode('utf8')
+
+    def date(self) -> str:
+        value = self.int()
+        date = DATE_EPOCH + timedelta(seconds=value // 2)
+        return date.strftime(DATE_FORMATS[value % 2])
+
+
+class ResumptionToken:
+    """
+    A compact, signed resumption token
+    """
+    # Key of the MACs, shared by every worker and node serving the repository (see configure).
+    # Until it is configured, tokens can only be resumed by the process that issued them.
+    key: bytes = secrets.token_bytes(32)
+    # Seconds a token stays valid, None for tokens that do not expire
+    ttl: float = None
+
+    def __init__(self):
+        # Original args to the request which originated this token
+        self.args: dict = None
+        # An optional unique state indicator which will invalidate the token if changed
+        self._state_hash: bin = None
+        self.cursor: int = None
+        self.complete_list_size: int = None
+        self.expiration_date: datetime = None
+        # The verb of the list, part of what is signed
+        self.verb: str = None
+
+    @classmethod
+    def configure(cls, secret: str, ttl: float = None):
+        """
+        Set the secret the tokens of all lists are signed with, and how long they stay valid
+        """
+        cls.key = secret.encode('utf8')
+        cls.ttl = ttl or None
+
+    def __repr__(self):
+        return (
+            f"ResumptionToken(cursor={self.cursor}, size={self.complete_list_size}, "
+            f"expiration={self.expiration_date}, args={self.args})"
+        )
+
+    @property
+    def state_hash(self):
+        """
+        Get a hash of the state
+        Returns:
+            The hexhash as a string, or None if no state was set
+        """
+        return self._state_hash
+
+    def set_state(self, state: str):
+        """
+        Set the state hash from the provided state
+        Args:
+            state (str): The unqiue state, a string or an object that can be converted to a unique
+                         string using __str__
+        """
+        self._state_hash = None
+        if state:
+            self._state_hash = blake2s(str(state).encode('utf8'), digest_size=8).hexdigest()
+
+    def __bool__(self):
+        """
+        Return True if this ResumptionToken instance have data sufficient to generate
+        a valid resumptionToken.
+        """
+        return bool(self.args and self.create())
+
+    def xml(self, limit: int) -> etree._Element:
+        """
+        Return a formed xml element for the token
+        Args:
+            limit (int): The limit number of elements tha can be returned.
+                         Used to determine if the token string should be included.
+        Returns:
+            The formed XML for the token, or None if no token can be generated
+        """
+        if not self.args:
+            return None
+        if self.expiration_date is None and self.ttl:
+            self.expiration_date = datetime.fromtimestamp(int(datetime.now(timezone.utc).timestamp() + self.ttl),
+                                                          timezone.utc)
+        token = self.create()
+
+        cursor = self.cursor if self.cursor is not None else 0
+        xmlr = etree.Element("resumptionToken")
+        # Only add a token string if there are sufficient results to warrant it
+        if self.complete_list_size is not None and cursor + limit < self.complete_list_size:
+            xmlr.text = token
+
+        xmlr.set('cursor', str(cursor))
+        if self.complete_list_size:
+            xmlr.set('completeListSize', str(self.complete_list_size))
+        if self.expiration_date and xmlr.text:
+            xmlr.set('expirationDate', helpers.granularity_format("YYYY-MM-DDThh:mm:ssZ", self.expiration_date))
+        return xmlr
+
+    def sign(self, data: bytes, verb: str) -> bytes:
+        """
+        MAC of a packed token issued for verb
+        """
+        return hmac.new(self.key, (verb or '').encode('utf8') + data, sha256).digest()[:MAC_SIZE]
+
+    def parse(self, token: str, verb: str = None):
+        """
+        Parse token, and check that it was issued for verb by this repository and has not expired
+        """
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (binascii.Error, ValueError, TypeError) as exc:
+            raise OAIErrorBadResumptionToken("The provided resumptionToken is malformed.") from exc
+        if not data or data[0] != VERSION or len(data) <= MAC_SIZE + 1:
+            raise OAIErrorBadResumptionToken("The provided resumptionToken is malformed.")
+        if not hmac.compare_digest(data[-MAC_SIZE:], self.sign(data[:-MAC_SIZE], verb)):
+            raise OAIErrorBadResumptionToken("The resumption token was not issued by this repository for given verb.")
+        try:
+            self.unpack(data[1:-MAC_SIZE])
+        except (IndexError, ValueError, OverflowError) as exc:
+            raise OAIErrorBadResumptionToken("The provided resumptionToken is malformed.") from exc
+        self.verb = verb
+
+        if self.expiration_date and self.expiration_date < datetime.now(timezone.utc):
+            raise OAIErrorBadResumptionToken("The provided resumptionToken has expired.")
+        if self.complete_list_size is not None and self.cursor > self.complete_list_size:
+            raise OAIErrorBadResumptionToken("The provided resumptionToken is malformed.")
+
+    def unpack(self, data: bytes):
+        """
+        Read the state of a token from its packed form
+        """
+        reader = _Reader(data)
+        flags = reader.bytes(1)[0]
+        self.cursor = reader.int()
+        self.complete_list_size = reader.int() - 1
+        if self.complete_list_size < 0:
+            self.complete_list_size = None
+        expiry = reader.int()
+        self.expiration_date = datetime.fromtimestamp(expiry, timezone.utc) if expiry else None
+        self.args = {'metadataPrefix': reader.str()}
+        if flags & FROM:
+            self.args['from'] = reader.date()
+        if flags & UNTIL:
+            self.args['until'] = reader.date()
+        if flags & SET:
+            self.args['set'] = reader.str()
+        if flags & AFTER:
+            self.args['after'] = ','.join(str(reader.int()) for _ in range(reader.int()))
+        if flags & AFTER_TEXT:
+            self.args['after'] = reader.str()
+        if flags & SERVED:
+            self.args['n'] = reader.int()
+        if flags & SESSION:
+            self.args['sid'] = reader.str()
+        if flags & STATE:
+            self._state_hash = reader.bytes(8).hex()
+        if reader.offset != len(data):
+            raise ValueError("Trailing data in token")
+
+    def create(self):
+        """
+        Create a resumption token
+        """
+        args = self.args or {}
+        flags = 0
+        fields = bytearray()
+        _put_int(fields, self.cursor or 0)
+        _put_int(fields, self.complete_list_size + 1 if self.complete_list_size is not None else 0)
+        _put_int(fields, int(self.expiration_date.timestamp()) if self.expiration_date else 0)
+        _put_str(fields, args.get('metadataPrefix', ''))
+        if args.get('from'):
+            flags |= FROM
+            _put_date(fields, args['from'])
+        if args.get('until'):
+            flags |= UNTIL
+            _put_date(fields, args['until'])
+        if args.get('set'):
+            flags |= SET
+            _put_str(fields, args['set'])
+        if args.get('after') is not None:
+            values = str(args['after']).split(',')
+            if all(value.isascii() and value.isdigit() for value in values):
+                flags |= AFTER
+                _put_int(fields, len(values))
+                for value in values:
+                    _put_int(fields, int(value))
+            else:
+                flags |= AFTER_TEXT
+                _put_str(fields, str(args['after']))
+        if args.get('n'):
+            flags |= SERVED
+            _put_int(fields, int(args['n']))
+        if args.get('sid'):
+            flags |= SESSION
+            _put_str(fields, args['sid'])
+        if self.state_hash is not None:
+            flags |= STATE
+            fields += bytes.fromhex(self.state_hash)
+        data = bytes([VERSION, flags]) + fields
+        return base64.urlsafe_b64encode(data + self.sign(data, self.verb)).rstrip(b'=').decode('ascii')
@@ -0,0 +1,53 @@
+"""
+Dublin Core (oai_dc) metadata, emitted from a normalized publication (see normalized.py).
+"""
+import lxml.etree as ET
+
+OAI_DC_NAMESPACE = "http://www.openarchives.org/OAI/2.0/oai_dc/"
+DC_NAMESPACE = "http://purl.org/dc/elements/1.1/"
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+NSMAP = {
+    "oai_dc": OAI_DC_NAMESPACE,
+    "dc": DC_NAMESPACE,
+    "xsi": XSI_NAMESPACE,
+}
+
+
+def add(dc, name, text, lang=None):
+    if text:
+        element = ET.SubElement(dc, f"{{{DC_NAMESPACE}}}{name}")
+        element.text = text
+        if lang:
+            element.set(XML_LANG, lang)
+
+
+def dublin_core(record) -> ET._Element:
+    dc = ET.Element(f"{{{OAI_DC_NAMESPACE}}}dc", nsmap=NSMAP)
+    dc.set(f"{{{XSI_NAMESPACE}}}schemaLocation", f"{OAI_DC_NAMESPACE} http://www.openarchives.org/OAI/2.0/oai_dc.xsd")
+
+    add(dc, "title", f"{record.title} : {record.subtitle}" if record.subtitle else record.title)
+    for author in record.authors:
+        add(dc, "creator", ", ".join(part for part in (author.family, author.given) if part))
+    for keyword in record.keywords:
+        add(dc, "subject", keyword)
+    for svep_id, name_sv, name_en in record.categories:
+        add(dc, "subject", name_sv, "sv")
+        add(dc, "subject", name_en, "en")
+    add(dc, "description", record.abstract)
+    add(dc, "publisher", record.publisher)
+    add(dc, "date", record.pubyear)
+    add(dc, "type", record.output_type)
+    add(dc, "identifier", record.uri)
+    for identifier_type, value in record.identifiers:
+        add(dc, "identifier", f"{identifier_type}:{value}" if value else None)
+    add(dc, "language", record.language)
+    if record.host is not None:
+        for title in record.host.titles:
+            add(dc, "source", title)
+    for title, part, issn in record.series:
+        add(dc, "relation", f"{title} ; {part}" if part else title)
+    if record.open_access:
+        add(dc, "rights", "https://id.kb.se/policy/oa/gratis")
+    return dc
@@ -1,12 +1,37 @@
+import time
+# Imports of the modules below are part of the measured startup time
+_imported = time.perf_counter()
+import importlib
+import os
+import secrets
+from functools import partial
 import oai_repo
+from admission import BACKGROUND_CLIENT, BULK_VERBS, AdmissionController, Rejected
+from cache import Namespaced, response_key
+from coalesce import SingleFlight, request_key
+from config import repository_configs
 from gupprovider import GUPProvider
+from metrics import RepositoryMetrics
+from readiness import Readiness
+from resources import SharedResources
 from oai_repo.repository import OAIRepository
 from oai_repo.exceptions import OAIRepoInternalException, OAIRepoExternalException
 from oai_repo.response import OAIResponse
-from lxml.etree import ElementTree, _ElementTree
-from lxml import etree
+from oai_repo.resumption import ResumptionToken
 from http import HTTPStatus
-from flask import Flask, request, abort, redirect, url_for
+from flask import Flask, Response, request, abort, redirect, url_for, send_from_directory, jsonify
+from werkzeug.exceptions import HTTPException
+
+imported_in = time.perf_counter() - _imported
+
+def optional(module: str, name: str, switches: tuple, *args):
+    """
+    `name`.from_env(*args) of `module`, or None without importing the module when none of the
+    environment variables that turn the feature on is set.
+    """
+    if not any(os.environ.get(switch, '').lower() not in {'', '0', 'false'} for switch in switches):
+        return None
+    return getattr(importlib.import_module(module), name).from_env(*args)
 
 def status(response: OAIResponse) -> int:
     """Get the HTTP status code to return with the given OAI response."""
@@ -14,53 +39,242 @@ def status(response: OAIResponse) -> int:
     # the OAIResponse casts to boolean "False" on error
     if response:
         return HTTPStatus.OK
+    elif response.code in {'noRecordsMatch', 'idDoesNotExist'}:
+        return HTTPStatus.OK
     else:
-        error = response.xpath('/OAI-PMH/error')[0]
-        if error.get('code') in {'noRecordsMatch', 'idDoesNotExist'}:
-            return HTTPStatus.OK
-        else:
-            return HTTPStatus.BAD_REQUEST
+        return HTTPStatus.BAD_REQUEST
 
-def create_app(data_provider: GUPProvider) -> Flask:
+def create_app(data_provider: GUPProvider, repositories: dict = None) -> Flask:
+    """
+    The OAI-PMH endpoint of `data_provider` at /oai/api, and of each of `repositories` (name ->
+    GUPProvider, see config.repository_configs) at /oai/<name>/api.
+    """
     _app = Flask(
         import_name=__name__,
         static_url_path='/oai/static',
     )
-    _app.logger.debug(f'Initialized the data provider: {data_provider.get_identify()}')
+    # The modules of optional features are only imported when they are turned on
+    profiler = optional('profiling', 'RequestProfiler', ('PROFILE_ENABLED', 'PROFILE_SECRET'))
+    # Optional per-client limits, with a separate lane for lookups, in front of all repositories
+    admission = AdmissionController.from_env()
+    # Optional structured logs of harvest pages and sessions
+    tracer = optional('tracing', 'HarvestTracer', ('TRACE_HARVESTS',))
+    if tracer is not None:
+        from tracing import building
+    # Optional ceiling on the resident memory of the worker, checked between requests
+    guard = optional('memguard', 'MemoryGuard', ('MEMORY_LIMIT_MB',))
+    if guard is not None:
+        @_app.before_request
+        def request_started():
+            guard.started()
+
+        @_app.after_request
+        def request_finished(response: Response) -> Response:
+            # Checked once the body has been sent, when the memory of the request can be released
+            response.call_on_close(guard.finished)
+            return response
+
+    # Readiness and metrics of each mounted repository
+    mounted = {}
+
+    def mount(name: str, path: str, data_provider: GUPProvider):
+        # The repository holds no per-request state, one serves all requests of the worker
+        repo = OAIRepository(data_provider)
+        # Identical requests arriving while one is being answered share its response. Its responseDate
+        # is set before the data is read, so it is never later than what the shared response shows.
+        flights = SingleFlight() if os.environ.get('COALESCE_REQUESTS', '1') == '1' else None
+        metrics = RepositoryMetrics()
+
+        def handle(parameters: dict) -> tuple:
+            try:
+                response = repo.process(parameters)
+            except OAIRepoExternalException as e:
+                # An API call timed out or returned a non-200 HTTP code.
+                # Log the failure and abort with server HTTP 503.
+                _app.logger.error(f'Upstream error: {e}')
+                abort(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+            except OAIRepoInternalException as e:
+                # There is a fault in how the DataInterface was implemented.
+                # Log the failure and abort with server HTTP 500.
+                _app.logger.error(f'Internal error: {e}')
+                abort(HTTPStatus.INTERNAL_SERVER_ERROR)
+            else:
+                # The envelope is pre-encoded, only the body is serialized here (see oai_repo/response.py)
+                return (
+                    response.document(),
+                    status(response),
+                    {'Content-Type': 'application/xml'},
+                )
+
+        def shared(parameters: dict) -> tuple:
+            # Background requests join the flight of an identical request in progress and vice versa
+            if flights is not None:
+                return flights.do(request_key(parameters), handle, parameters)
+            return handle(parameters)
+
+        def background(parameters: dict) -> tuple:
+            # Pages built ahead of requests take their turn in the lanes, as one client of their own
+            if admission is None:
+                return shared(parameters)
+            try:
+                with admission.admit(BACKGROUND_CLIENT, parameters.get('verb')):
+                    return shared(parameters)
+            except Rejected as e:
+                return str(e).encode(), HTTPStatus.SERVICE_UNAVAILABLE, {}
+
+        # Responses kept in the cache tier of CACHE_URL (see cache.py): GetRecord responses for
+        # RESPONSE_CACHE_TTL seconds, the next page of harvests, and pages of the change warmer
+        responses = data_provider.shared.cache(
+            'responses', int(os.environ.get('RESPONSE_CACHE_SIZE', '1000')),
+            data_provider.namespace, data_provider.config.cache_quota
+        )
+        record_ttl = float(os.environ.get('RESPONSE_CACHE_TTL', '0'))
+        prefetch_workers = int(os.environ.get('PREFETCH_WORKERS', '0'))
+        prefetcher = None
+        if prefetch_workers > 0:
+            from prefetch import Prefetcher
+            prefetcher = Prefetcher(responses, background, prefetch_workers, float(os.environ.get('PREFETCH_TTL', '120')))
+        # Optional background warmer, pre-rendering changed publications and incremental first pages
+        warmer = optional('warmer', 'ChangeWarmer', ('WARM_INTERVAL',), data_provider, background, responses)
+        if warmer is not None:
+            warmer.start()
+        if not (record_ttl or prefetcher or warmer):
+            responses = None
 
-    @_app.route('/oai/api', methods=['GET', 'POST'])
-    def endpoint():
-        try:
-            repo = OAIRepository(data_provider)
+        def cached(run, parameters: dict) -> tuple:
+            key = response_key(parameters)
+            verb = parameters.get('verb')
+            document = responses.get(key)
+            if document is not None:
+                response = document, HTTPStatus.OK, {'Content-Type': 'application/xml'}
+            else:
+                response = run(parameters)
+                if verb == 'GetRecord' and record_ttl and response[1] == HTTPStatus.OK:
+                    responses.set(key, response[0], record_ttl)
+            return response
+
+        def admitted(run, parameters: dict) -> tuple:
+            # Each client is admitted on its own, also when it joins the flight of another one, so a
+            # rejection is never shared with the clients waiting for the same page
+            client = admission.client(request.headers, request.remote_addr)
+            try:
+                with admission.admit(client, parameters.get('verb')):
+                    return run(parameters)
+            except Rejected as e:
+                _app.logger.warning(f'Rejected {parameters.get("verb")} from {client}: {e}')
+                abort(Response(str(e), HTTPStatus.SERVICE_UNAVAILABLE, {'Retry-After': str(e.retry_after)}))
+
+        def answer(parameters: dict) -> tuple:
+            # The verb is popped from the parameters by OAIRepository, so take it up front
+            verb = parameters.get('verb')
+            run = handle
+            # Profiling is opt-in; without it the request goes straight to the handler
+            if profiler is not None:
+                forced = profiler.requested(request.headers)
+                if forced or profiler.sampled():
+                    return profiler.run(run if admission is None else partial(admitted, run), parameters, forced)
+            traced = tracer is not None and verb in BULK_VERBS
+            if traced:
+                # Only the request that runs the handler built the page, not those joining its flight
+                run = partial(building, run)
+            if flights is not None:
+                run = partial(flights.do, request_key(parameters), run)
+            if admission is not None:
+                run = partial(admitted, run)
+            if responses is not None:
+                run = partial(cached, run)
+            if traced:
+                client = admission.client(request.headers, request.remote_addr) if admission else request.remote_addr
+                response = tracer.trace(run, parameters, client)
+            else:
+                response = run(parameters)
+            # The next page is asked for with the token the client got, which tracing may have rewritten
+            if prefetcher is not None and verb in BULK_VERBS and response[1] == HTTPStatus.OK:
+                prefetcher.after(verb, response[0])
+            return response
+
+        def endpoint():
             # combine all possible parameters to the request
             parameters = {
                 **request.args,
                 **request.form,
             }
+            # The verb is popped from the parameters by OAIRepository, so take it up front
+            verb = parameters.get('verb')
+            started = time.perf_counter()
+            try:
+                response = answer(parameters)
+            except HTTPException as e:
+                metrics.record(verb, e.code, 0, time.perf_counter() - started)
+                raise
+            metrics.record(verb, response[1], len(response[0]), time.perf_counter() - started)
+            return response
+
+        _app.add_url_rule(f'{path}/api', f'{name}_api', endpoint, methods=['GET', 'POST'])
+        # The worker warms up in the background, and is ready once ES answers and records render
+        readiness = Readiness(data_provider, shared)
+        readiness.start()
+        mounted[name] = readiness, metrics, {'fragments': data_provider.fragments, 'responses': responses}
+
+    mount('default', '/oai', data_provider)
+    for name, provider in (repositories or {}).items():
+        mount(name, f'/oai/{name}', provider)
 
-            response = repo.process(parameters)
-        except OAIRepoExternalException as e:
-            # An API call timed out or returned a non-200 HTTP code.
-            # Log the failure and abort with server HTTP 503.
-            _app.logger.error(f'Upstream error: {e}')
-            abort(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
-        except OAIRepoInternalException as e:
-            # There is a fault in how the DataInterface was implemented.
-            # Log the failure and abort with server HTTP 500.
-            _app.logger.error(f'Internal error: {e}')
-            abort(HTTPStatus.INTERNAL_SERVER_ERROR)
+    @_app.route('/oai/health')
+    def health():
+        return jsonify(status='ok')
+
+    @_app.route('/oai/ready')
+    def ready():
+        statuses = {name: readiness.status() for name, (readiness, metrics, caches) in mounted.items()}
+        ready = all(status['ready'] for status in statuses.values())
+        if repositories:
+            body = {'ready': ready, 'repositories': statuses}
         else:
-            document: _ElementTree = ElementTree(response.root())
-            return (
-                etree.tostring(document, xml_declaration=True, encoding='UTF-8', pretty_print=True),
-                status(response),
-                {'Content-Type': 'application/xml'},
-            )
+            body = statuses['default']
+        return jsonify(body), HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE
+
+    @_app.route('/oai/metrics')
+    def repository_metrics():
+        # Requests per repository, and what each holds in the in-memory cache tiers it shares
+        return jsonify({
+            name: {
+                **metrics.snapshot(),
+                'cache': {tier: cache.usage() for tier, cache in caches.items() if isinstance(cache, Namespaced)},
+            }
+            for name, (readiness, metrics, caches) in mounted.items()
+        })
+
+    # Static files written by dump.py, if the dump directory is configured
+    dump_directory = os.environ.get('DUMP_DIR')
+    if dump_directory:
+        @_app.route('/oai/dump/', defaults={'filename': 'manifest.json'})
+        @_app.route('/oai/dump/<path:filename>')
+        def dump(filename):
+            return send_from_directory(dump_directory, filename)
 
     return _app
 
 def app():
-    return create_app(GUPProvider())
+    started = time.perf_counter()
+    configs = repository_configs()
+    # One set of ES clients, render workers and cache tiers for all repositories, which keep their
+    # cached values apart when there are several
+    shared = SharedResources()
+    # Without TOKEN_SECRET the tokens are signed with a random secret, and only this process
+    # accepts them: several workers or nodes behind one BASE_URL need a shared TOKEN_SECRET
+    default = configs['default']
+    ResumptionToken.configure(default.token_secret or secrets.token_hex(32), default.token_ttl)
+    providers = {
+        name: GUPProvider(config, shared, name if len(configs) > 1 else None) for name, config in configs.items()
+    }
+    _app = create_app(providers.pop('default'), providers)
+    if default.token_secret is None:
+        _app.logger.warning('TOKEN_SECRET is not set, resumptionTokens are only valid in this process '
+                            'until it is restarted')
+    _app.logger.info(f'Started in {(time.perf_counter() - started) * 1000:.0f} ms '
+                     f'after importing in {imported_in * 1000:.0f} ms')
+    return _app
 
 if __name__ == '__main__':
     app().run(debug=True, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,58 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import lxml.etree as ET
+
+from cache import response_key
+
+logger = logging.getLogger(__name__)
+
+
+def next_token(document: bytes) -> str:
+    # The resumptionToken closing a ListRecords or ListIdentifiers response, None on the last page.
+    # Metadata cannot contain the start of the element, since < is always escaped in text.
+    start = document.rfind(b'<resumptionToken')
+    if start < 0:
+        return None
+    end = document.find(b'>', start)
+    if document[end - 1:end] == b'/':
+        return None
+    close = document.find(b'</resumptionToken>', end)
+    return ET.fromstring(document[start:close + len(b'</resumptionToken>')]).text or None
+
+
+class Prefetcher:
+    """
+    Builds the next page of a harvest while the harvester is reading the current one, and keeps it
+    in the response cache for `ttl` seconds. Resumption tokens carry all their state, so with a
+    shared cache the next request is answered from it by whichever worker or node receives it.
+
+    At most `workers` pages are built at a time; pages after responses arriving while all workers
+    are busy are not prefetched.
+    """
+    def __init__(self, responses, render_page, workers: int, ttl: float):
+        self.responses = responses
+        self.render_page = render_page
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='prefetch')
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def after(self, verb: str, document: bytes):
+        token = next_token(document)
+        if token is None or not self.slots.acquire(blocking=False):
+            return
+        self.executor.submit(self.prefetch, {'verb': verb, 'resumptionToken': token})
+
+    def prefetch(self, parameters: dict):
+        try:
+            key = response_key(parameters)
+            if self.responses.get(key) is None:
+                document, status, headers = self.render_page(dict(parameters))
+                if status == HTTPStatus.OK:
+                    self.responses.set(key, document, self.ttl)
+        except Exception:
+            logger.exception('Prefetching %s failed', parameters)
+        finally:
+            self.slots.release()
@@ -0,0 +1,98 @@
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+# Header identifiers are the only <identifier> elements without attributes in a response
+HEADER_IDENTIFIER = re.compile(rb'<identifier>([^<]+)</identifier>')
+# The cursor attribute of the resumptionToken is the position of the current page
+RESUMPTION_CURSOR = re.compile(rb'<resumptionToken[^>]*\scursor="(\d+)"')
+
+
+class RequestProfiler:
+    """
+    Threshold-triggered cProfile hook for the OAI endpoint.
+
+    A request is profiled when profiling is enabled for all requests (PROFILE_ENABLED, optionally
+    sampled with PROFILE_SAMPLE_RATE) or when it carries the X-OAI-Profile header with the
+    shared PROFILE_SECRET. The profile is only written to disk when the request took at least
+    PROFILE_THRESHOLD_MS; requests triggered by the header are always written.
+    """
+    HEADER = 'X-OAI-Profile'
+
+    def __init__(self, directory: str, threshold_ms: float, enabled: bool = False,
+                 sample_rate: float = 1.0, secret: str = None):
+        self.directory = directory
+        self.threshold = threshold_ms / 1000
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.secret = secret
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        # Return None when profiling is not configured, so the endpoint can skip it entirely
+        enabled = os.environ.get('PROFILE_ENABLED', 'false').lower() == 'true'
+        secret = os.environ.get('PROFILE_SECRET') or None
+        if not enabled and not secret:
+            return None
+        return cls(
+            directory=os.environ.get('PROFILE_DIR', '/tmp/gup-oai-profiles'),
+            threshold_ms=float(os.environ.get('PROFILE_THRESHOLD_MS', '1000')),
+            enabled=enabled,
+            sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '1.0')),
+            secret=secret,
+        )
+
+    def requested(self, headers) -> bool:
+        # Profiling forced for a single request by a client knowing the shared secret
+        # Compared in constant time, since a forced profile is expensive
+        given = headers.get(self.HEADER)
+        return self.secret is not None and given is not None and \
+            hmac.compare_digest(given.encode('utf8'), self.secret.encode('utf8'))
+
+    def sampled(self) -> bool:
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def run(self, handler, parameters: dict, forced: bool = False):
+        # The verb is popped from the parameters by OAIRepository, so take the tags up front
+        tags = self.request_tags(parameters)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        result = profile.runcall(handler, parameters)
+        elapsed = time.perf_counter() - start
+        if forced or elapsed >= self.threshold:
+            self.dump(profile, tags, elapsed, result[0])
+        return result
+
+    def request_tags(self, parameters: dict) -> dict:
+        return {
+            'verb': parameters.get('verb'),
+            'arguments': {key: value for key, value in parameters.items() if key != 'verb'},
+        }
+
+    def dump(self, profile: cProfile.Profile, tags: dict, elapsed: float, body: bytes):
+        now = datetime.now(timezone.utc)
+        cursor = RESUMPTION_CURSOR.search(body)
+        tags['cursor'] = int(cursor.group(1)) if cursor else 0
+        name = '{}-{}-c{}-{}ms'.format(
+            now.strftime('%Y%m%dT%H%M%S.%f'),
+            re.sub(r'[^A-Za-z]', '', str(tags['verb'])) or 'none',
+            tags['cursor'],
+            int(elapsed * 1000),
+        )
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.pstats')
+        identifiers = [identifier.decode('utf-8') for identifier in HEADER_IDENTIFIER.findall(body)]
+        with open(path + '.json', 'w') as meta:
+            json.dump({
+                **tags,
+                'elapsed_ms': round(elapsed * 1000, 1),
+                'bytes': len(body),
+                'identifiers': identifiers,
+                'timestamp': now.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            }, meta, indent=2)
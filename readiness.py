@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+
+import harvestquery
+import rendering
+from records import PUBLICATION_FIELDS, compact_hit
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def stopwatch(timings: dict, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+class Readiness:
+    """
+    Warms a worker up in a background thread, and tells whether it is ready for traffic: once
+    Elasticsearch has answered, a publication from the index has been rendered in every metadata
+    format (unless the index is empty),
+    the sets and datestamps of the index are loaded and an Identify request has gone through the
+    repository. Until then /oai/ready answers 503, so that a rolling deploy keeps sending requests
+    to the old workers. A failing warm-up is tried again every `retry` seconds.
+    """
+    def __init__(self, provider, handle, retry: float = 5):
+        self.provider = provider
+        self.handle = handle
+        self.retry = retry
+        self.created_at = time.perf_counter()
+        self.ready = False
+        self.error = None
+        self.timings = {}
+
+    def start(self):
+        threading.Thread(target=self.run, name='readiness', daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                self.warm()
+                return
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+                logger.warning('Warming up failed, trying again in %gs: %s', self.retry, self.error)
+                time.sleep(self.retry)
+
+    def sample(self):
+        # A publication of the repository that is not deleted, as a record, or None if there is none
+        query = {
+            'size': 1,
+            'query': {'bool': {
+                'filter': harvestquery.source_filter(self.provider.config.source),
+                'must_not': [{'term': {'deleted': True}}],
+            }},
+            '_source': PUBLICATION_FIELDS,
+        }
+        hits = self.provider.es.search(index=self.provider.index, body=query)['hits']['hits']
+        return compact_hit(hits[0])['_source'] if hits else None
+
+    def warm(self):
+        timings = {}
+        with stopwatch(timings, 'es_ms'):
+            self.provider.es.info()
+            publication = self.sample()
+        with stopwatch(timings, 'render_ms'):
+            if publication is not None:
+                rendering.record_fragment(self.provider.provider, publication)
+                for metadata_format in self.provider.get_metadata_formats():
+                    rendering.metadata_fragment(self.provider.provider, publication, metadata_format.metadata_prefix)
+        # Requests do not wait for these, they are answered with less until they are loaded
+        with stopwatch(timings, 'snapshots_ms'):
+            self.provider.sets.warm()
+            self.provider.datestamps.warm()
+        with stopwatch(timings, 'identify_ms'):
+            document, status, headers = self.handle({'verb': 'Identify'})
+        if status != HTTPStatus.OK:
+            raise RuntimeError(f'Identify answered {status}')
+        timings['ready_ms'] = round((time.perf_counter() - self.created_at) * 1000, 1)
+        self.timings, self.error, self.ready = timings, None, True
+        logger.info('Ready in %.0f ms (es %.0f ms, render %.0f ms, snapshots %.0f ms, identify %.0f ms)',
+                    timings['ready_ms'], timings['es_ms'], timings['render_ms'], timings['snapshots_ms'],
+                    timings['identify_ms'])
+
+    def status(self) -> dict:
+        return {'ready': self.ready, **self.timings, **({'error': self.error} if self.error else {})}
@@ -0,0 +1,125 @@
+"""
+Compact publication records, holding only the fields that the record header and MODS builders in
+oai.py read (see PUBLICATION_FIELDS).
+
+Records are built from the _source of an ES hit and read like the dicts they replace:
+record["title"], record.get("files") and "publanguage" in record behave as on the _source, and a
+field missing from the _source raises KeyError. Each record is a slotted object instead of a dict,
+and everything else in the _source (and the ES response around it) is dropped at once.
+"""
+
+
+class Record:
+    __slots__ = ()
+    # Field name -> record class of a nested object or a list of nested objects, or None
+    FIELDS = {}
+
+    @classmethod
+    def from_source(cls, source: dict) -> 'Record':
+        record = cls.__new__(cls)
+        for name, nested in cls.FIELDS.items():
+            if name not in source:
+                continue
+            value = source[name]
+            if nested is not None and value is not None:
+                if isinstance(value, list):
+                    value = [nested.from_source(item) if isinstance(item, dict) else item for item in value]
+                elif isinstance(value, dict):
+                    value = nested.from_source(value)
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def __contains__(self, name: str) -> bool:
+        return hasattr(self, name)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={self[name]!r}' for name in self.FIELDS if name in self)
+        return f'{type(self).__name__}({fields})'
+
+
+class Position(Record):
+    __slots__ = ('position',)
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class PersonIdentifier(Record):
+    __slots__ = ('type', 'value')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class Person(Record):
+    __slots__ = ('first_name', 'last_name', 'year_of_birth', 'identifiers')
+    FIELDS = {**dict.fromkeys(__slots__), 'identifiers': PersonIdentifier}
+
+
+class Affiliation(Record):
+    __slots__ = ('department_id', 'name_sv', 'name_en')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class Author(Record):
+    __slots__ = ('position', 'person', 'affiliations')
+    FIELDS = {'position': Position, 'person': Person, 'affiliations': Affiliation}
+
+
+class Category(Record):
+    __slots__ = ('svep_id', 'name_sv', 'name_en')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class PublicationIdentifier(Record):
+    __slots__ = ('identifier_code', 'identifier_value')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class Series(Record):
+    __slots__ = ('title', 'part', 'issn')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class File(Record):
+    __slots__ = ('accepted', 'visible_after')
+    FIELDS = dict.fromkeys(__slots__)
+
+
+class Publication(Record):
+    __slots__ = (
+        'id', 'publication_id', 'source', 'deleted', 'affiliated', 'updated_at', 'created_at',
+        'publication_type_code', 'ref_value', 'artistic_basis', 'title', 'alt_title', 'abstract',
+        'keywords', 'publanguage', 'pubyear', 'epub_ahead_of_print', 'publisher', 'place',
+        'sourcetitle', 'made_public_in', 'sourcevolume', 'sourceissue', 'article_number',
+        'sourcepages', 'isbn', 'issn', 'eissn', 'is_open_access', 'authors', 'affiliations',
+        'categories', 'publication_identifiers', 'series', 'files',
+    )
+    FIELDS = {
+        **dict.fromkeys(__slots__),
+        'authors': Author,
+        'affiliations': Affiliation,
+        'categories': Category,
+        'publication_identifiers': PublicationIdentifier,
+        'series': Series,
+        'files': File,
+    }
+
+
+# The _source fields to request from ES. Whole top level fields are requested, since filtering
+# nested paths would drop fields that are null (e.g. "authors": null) instead of keeping them.
+PUBLICATION_FIELDS = list(Publication.FIELDS)
+
+
+def compact_hit(hit: dict) -> dict:
+    # An ES hit reduced to its record (and sort values, for search_after)
+    compact = {'_source': Publication.from_source(hit['_source'])}
+    if 'sort' in hit:
+        compact['sort'] = hit['sort']
+    return compact
+
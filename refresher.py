@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicRefresher:
+    """
+    A value loaded by a (slow) function and kept up to date by a background thread.
+
+    The first call to get() loads the value in the calling thread, after that the value is reloaded
+    every `interval` seconds in a daemon thread. peek() never waits, the first load then happens in
+    the background. A failing reload is logged and the previous value is kept, so requests are never
+    answered with a half-built snapshot. Without an interval the value is loaded once.
+    """
+    def __init__(self, name: str, load, interval: float):
+        self.name = name
+        self.load = load
+        self.interval = interval
+        self.value = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self):
+        if self.loaded_at is None:
+            with self.lock:
+                if self.loaded_at is None:
+                    self.refresh()
+                    self.start()
+        return self.value
+
+    def peek(self):
+        # The current value without waiting for it, None until a first load in the background is done
+        if self.thread is None and self.loaded_at is None:
+            with self.lock:
+                self.start(immediately=True)
+        return self.value
+
+    def refresh(self):
+        started_at = time.time()
+        value = self.load()
+        # Swap in the complete new value in one assignment
+        self.value, self.loaded_at = value, started_at
+        logger.debug('Refreshed %s in %.2fs', self.name, time.time() - started_at)
+
+    def start(self, immediately: bool = False):
+        if self.thread is None and (self.interval > 0 or immediately):
+            self.thread = threading.Thread(target=self.run, args=(immediately,), name=f'refresh-{self.name}',
+                                           daemon=True)
+            self.thread.start()
+
+    def run(self, immediately: bool = False):
+        while True:
+            if not immediately:
+                time.sleep(self.interval)
+            immediately = False
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Refreshing %s failed, keeping the previous value', self.name)
+            if self.interval <= 0:
+                # Loaded once, or tried again by the next peek() after a failure
+                self.thread = None
+                return
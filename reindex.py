@@ -0,0 +1,93 @@
+"""
+Copy the publications index into a new index sorted by (updated_at, publication_id).
+
+    python reindex.py --target publications_sorted
+    python reindex.py --target publications_sorted --alias publications --delete-source
+
+Index sorting can only be set when an index is created, so the publications are copied into a new
+index with the same mappings (and analysis settings) as the source. With the index sorted like the
+harvest order (HARVEST_ORDER=updated_at), ES stops reading a range filtered harvest page after
+`size` documents instead of collecting the whole from/until window.
+
+GUP keeps writing to the source while it is copied. Once the copy is done, the publications with
+an updated_at since it started (less --margin seconds, for GUP setting updated_at before saving)
+are copied again, right before the alias is switched, so only updates made during that last short
+copy can be missed. Stop GUP's indexing while reindexing to rule that out too.
+
+With --alias the source index is deleted (only with --delete-source, since the alias cannot have
+the name of an existing index) and its name is made an alias of the new index, so that the server
+and GUP keep using the name "publications".
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from elasticsearch import Elasticsearch
+
+SORT_SETTINGS = {
+    'sort.field': ['updated_at', 'publication_id'],
+    'sort.order': ['asc', 'asc'],
+}
+
+
+def index_settings(es: Elasticsearch, source: str) -> dict:
+    # The settings of the source that can be given when creating an index, plus the sort
+    settings = es.indices.get_settings(index=source)[source]['settings']['index']
+    copied = {key: settings[key] for key in ('number_of_shards', 'number_of_replicas', 'analysis') if key in settings}
+    return {'index': {**copied, **SORT_SETTINGS}}
+
+
+def reindex(es: Elasticsearch, source: str, target: str):
+    mappings = es.indices.get_mapping(index=source)[source]['mappings']
+    es.indices.create(index=target, mappings=mappings, settings=index_settings(es, source))
+    result = es.reindex(source={'index': source}, dest={'index': target}, wait_for_completion=True,
+                        request_timeout=3600)
+    if result.get('failures'):
+        raise RuntimeError(f"Reindexing failed: {result['failures'][:3]}")
+    es.indices.refresh(index=target)
+    return result['total']
+
+
+def catch_up(es: Elasticsearch, source: str, target: str, since: datetime) -> int:
+    # Copy the publications updated in the source since `since` again
+    es.indices.refresh(index=source)
+    query = {'range': {'updated_at': {'gte': since.strftime('%Y-%m-%dT%H:%M:%S')}}}
+    result = es.reindex(source={'index': source, 'query': query}, dest={'index': target},
+                        wait_for_completion=True, request_timeout=3600)
+    if result.get('failures'):
+        raise RuntimeError(f"Catching up failed: {result['failures'][:3]}")
+    es.indices.refresh(index=target)
+    return result['total']
+
+
+def replace_with_alias(es: Elasticsearch, source: str, target: str, alias: str):
+    # Remove the source index and add the alias in one atomic step
+    actions = [{'add': {'index': target, 'alias': alias}}]
+    if source == alias:
+        actions.insert(0, {'remove_index': {'index': source}})
+    es.indices.update_aliases(actions=actions)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copy the publications index into an index sorted by updated_at.')
+    parser.add_argument('--source', default='publications')
+    parser.add_argument('--target', required=True)
+    parser.add_argument('--alias', default=None, help='make this name an alias of the new index')
+    parser.add_argument('--delete-source', action='store_true',
+                        help='delete the source index when it has the name of the alias')
+    parser.add_argument('--margin', type=float, default=300,
+                        help='seconds before the start of the copy to copy updates again from')
+    args = parser.parse_args()
+    if args.alias == args.source and not args.delete_source:
+        parser.error('--alias with the name of the source index requires --delete-source')
+
+    es = Elasticsearch(hosts=[{'host': os.environ['ES_HOST_NAME'], 'port': 9200, 'scheme': 'http'}])
+    started = datetime.now(timezone.utc) - timedelta(seconds=args.margin)
+    total = reindex(es, args.source, args.target)
+    print(f'{total} publications copied to {args.target}', file=sys.stderr)
+    # Updates made while copying, copied again right before the switch
+    updated = catch_up(es, args.source, args.target, started)
+    print(f'{updated} publications updated while copying copied again', file=sys.stderr)
+    if args.alias:
+        replace_with_alias(es, args.source, args.target, args.alias)
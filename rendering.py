@@ -0,0 +1,143 @@
+import re
+import threading
+from datetime import datetime
+import lxml.etree as ET
+
+import oai
+
+OAI_NAMESPACE = "http://www.openarchives.org/OAI/2.0/"
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+OAI_NSMAP = {None: OAI_NAMESPACE, "xsi": XSI_NAMESPACE}
+OAI_SCHEMA_LOCATION = "http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd"
+
+# Records are serialized as children of an OAI-PMH element, so that the MODS part gets exactly the
+# namespace declarations it has in a live response (see the Primo note in OAIProvider.set_mods).
+# lxml then repeats the namespaces of the parent on the fragment root, which we strip again.
+INHERITED_NAMESPACES = b' xmlns="' + OAI_NAMESPACE.encode() + b'" xmlns:xsi="' + XSI_NAMESPACE.encode() + b'"'
+XSI_DECLARATION = re.compile(rb' xmlns:([\w.-]+)="' + re.escape(XSI_NAMESPACE.encode()) + rb'"')
+
+
+def record_element(provider: oai.OAIProvider, publication: dict, parent=None,
+                   metadata_prefix: str = "mods") -> ET._Element:
+    # Build a complete <record> element (header and metadata) for a publication (_source) dict
+    # in the same way as oai_repo.getrecord.record does for a live response
+    header = provider.build_recordheader(publication)
+    record = ET.SubElement(parent, "record") if parent is not None else ET.Element("record")
+    xheader = ET.SubElement(record, "header")
+    deleted = header.status == "deleted"
+    if deleted:
+        xheader.set("status", "deleted")
+    ET.SubElement(xheader, "identifier").text = header.identifier
+    ET.SubElement(xheader, "datestamp").text = header.datestamp
+    if not deleted:
+        for setspec in header.setspecs:
+            ET.SubElement(xheader, "setSpec").text = setspec
+        metadata = ET.SubElement(record, "metadata")
+        metadata.append(provider.get_oai_data({"_source": publication}, metadata_prefix))
+    return record
+
+
+def record_fragment(provider: oai.OAIProvider, publication: dict, metadata_prefix: str = "mods") -> bytes:
+    # Serialized <record> element, ready to be spliced into a ListRecords body
+    root = ET.Element("OAI-PMH", nsmap=OAI_NSMAP)
+    fragment = ET.tostring(record_element(provider, publication, root, metadata_prefix), encoding="UTF-8")
+    return fragment.replace(INHERITED_NAMESPACES, b"", 1)
+
+
+def metadata_fragment(provider: oai.OAIProvider, publication: dict, metadata_prefix: str = "mods") -> bytes:
+    # Serialized metadata (MODS or oai_dc) element, parsed back with ET.fromstring it serializes exactly like
+    # the element built in place would in a live response
+    root = ET.Element("OAI-PMH", nsmap=OAI_NSMAP)
+    metadata = ET.SubElement(root, "metadata")
+    metadata.append(provider.get_oai_data({"_source": publication}, metadata_prefix))
+    return ET.tostring(metadata[0], encoding="UTF-8")
+
+
+def inline_fragment(fragment: bytes) -> bytes:
+    # A metadata fragment as it is serialized in place, under an OAI-PMH element: without the namespace
+    # declarations it inherits from there, and with xsi attributes under the prefix xsi. MODS declares the
+    # prefix xsi itself (see the Primo note in OAIProvider.set_mods), so on its own lxml renames ours to xsi1.
+    end = fragment.index(b">")
+    start_tag = fragment[:end].replace(b' xmlns="' + OAI_NAMESPACE.encode() + b'"', b"", 1)
+    prefix = b" xsi:"
+    if declaration := XSI_DECLARATION.search(start_tag):
+        prefix = b" " + declaration.group(1) + b":"
+        start_tag = start_tag[:declaration.start()] + start_tag[declaration.end():]
+    fragment = start_tag + fragment[end:]
+    if prefix != b" xsi:" and prefix in fragment:
+        fragment = re.sub(rb"<[^>]*>", lambda tag: tag.group().replace(prefix, b" xsi:"), fragment)
+    return fragment
+
+
+def envelope(base_url: str, response_date: datetime, arguments: dict) -> tuple:
+    # Return the bytes before and after the verb element of an OAI-PMH response
+    root = ET.Element("OAI-PMH", nsmap=OAI_NSMAP)
+    root.set("{%s}schemaLocation" % XSI_NAMESPACE, OAI_SCHEMA_LOCATION)
+    ET.SubElement(root, "responseDate").text = response_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+    request = ET.SubElement(root, "request")
+    request.text = base_url
+    for key, value in arguments.items():
+        request.set(key, value)
+    ET.SubElement(root, "body")
+    document = ET.tostring(ET.ElementTree(root), xml_declaration=True, encoding="UTF-8")
+    prefix, suffix = document.rsplit(b"<body/>", 1)
+    return prefix, suffix
+
+
+# Rendering in worker processes (see GUPProvider.prepare_records and dump.py).
+# Each worker process has its own OAIProvider, created by the pool initializer from the config it is
+# given (or the environment), and one for the config of each repository it has rendered metadata for.
+_provider = None
+_providers = {}
+
+
+def init_worker(config=None):
+    global _provider
+    _provider = oai.OAIProvider(config)
+
+
+def worker_provider(config=None) -> oai.OAIProvider:
+    if config is None:
+        return _provider
+    if config not in _providers:
+        _providers[config] = oai.OAIProvider(config)
+    return _providers[config]
+
+
+def render_record(publication: dict, metadata_prefix: str = "mods") -> bytes:
+    return record_fragment(_provider, publication, metadata_prefix)
+
+
+def render_metadata(publication: dict, metadata_prefix: str = "mods", config=None) -> bytes:
+    return metadata_fragment(worker_provider(config), publication, metadata_prefix)
+
+
+def render_mods(publication: dict) -> bytes:
+    # Standalone MODS document, or None for a deleted publication since it has no metadata
+    if _provider.get_deleted_status(publication):
+        return None
+    return ET.tostring(_provider.get_oai_data({"_source": publication}), encoding="UTF-8")
+
+
+class RenderPool:
+    """
+    Worker processes rendering metadata for the repositories of a process, started on first use.
+    They are spawned rather than forked, since the server process is multi-threaded.
+    """
+    def __init__(self, workers: int = 0):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def map(self, function, *iterables, chunksize: int = 1):
+        with self.lock:
+            if self.executor is None:
+                # Imported here, most workers never render in a pool
+                from concurrent.futures import ProcessPoolExecutor
+                import multiprocessing
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker,
+                )
+        return self.executor.map(function, *iterables, chunksize=chunksize)
@@ -0,0 +1,313 @@
+"""
+Record OAI-PMH request sequences with the Elasticsearch responses they need, replay them against
+the recording, and compare the responses and latencies of two replays (of the old and new code).
+
+    python replay.py record requests.txt fixtures/harvest.json.gz --follow 50 --anonymize
+    python replay.py run fixtures/harvest.json.gz old.json.gz --repeat 5      # on the old code
+    python replay.py run fixtures/harvest.json.gz new.json.gz --repeat 5      # on the new code
+    python replay.py compare old.json.gz new.json.gz
+
+record reads one request per line, as a query string or a URL with one (such as the paths of an
+access log), and sends each through the application with the configuration of the environment.
+Requests with a resumptionToken are left out, since the tokens of a replay are signed with another
+key. --follow follows the resumptionTokens of each list for up to that many pages instead. Every
+call to the Elasticsearch client is kept with its response in the fixture, with the names, birth
+years and identifiers of persons scrambled with --anonymize.
+
+run replays the requests of a fixture through a new application whose client answers from the
+fixture, --repeat times, and keeps the response of each page and its time in every repeat. Calls
+that were not recorded fail, and are counted as misses. The response cache, prefetching and the
+warmer are turned off, so every page is built by the code under test.
+
+compare fails unless the responses of both replays are the same bytes, apart from responseDate,
+and prints the median time of the pages of each verb and the throughput of both replays.
+"""
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+from prefetch import next_token
+
+FORMAT = 1
+RESPONSE_DATE = re.compile(rb'<responseDate>[^<]*</responseDate>')
+# Fields of persons scrambled by --anonymize, and the list of their identifiers
+PERSON_FIELDS = {'first_name', 'last_name', 'year_of_birth', 'email'}
+
+
+def call_key(method: str, args: tuple, kwargs: dict) -> str:
+    return json.dumps([method, args, kwargs], sort_keys=True, default=str)
+
+
+class RecordingES:
+    """
+    An Elasticsearch client that keeps the response of the first call with each set of arguments,
+    encoded before the caller can change it.
+    """
+    def __init__(self, client, exchanges: dict, lock: threading.Lock = None):
+        self.client = client
+        self.exchanges = exchanges
+        self.lock = lock or threading.Lock()
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            response = attribute(*args, **kwargs)
+            if name == 'options':
+                return RecordingES(response, self.exchanges, self.lock)
+            with self.lock:
+                key = call_key(name, args, kwargs)
+                if key not in self.exchanges:
+                    self.exchanges[key] = json.dumps(getattr(response, 'body', response))
+            return response
+        return call
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+class ReplayES:
+    """
+    An Elasticsearch client answering from the exchanges of a fixture. Responses are decoded anew
+    for every call, like the real client does.
+    """
+    def __init__(self, exchanges: dict):
+        self.exchanges = {call: json.dumps(response) for call, response in exchanges.items()}
+        self.misses = 0
+
+    def options(self, **kwargs):
+        return self
+
+    def __getattr__(self, name: str):
+        def call(*args, **kwargs):
+            response = self.exchanges.get(call_key(name, args, kwargs))
+            if response is None:
+                self.misses += 1
+                raise ReplayMiss(f'{name} was not recorded with {kwargs}')
+            return json.loads(response)
+        return call
+
+
+def scramble(value, key: bytes):
+    # The same value for the same input and key, with the digits and letters of the input replaced
+    text = str(value)
+    stream = hmac.new(key, text.encode('utf8'), hashlib.sha256).digest()
+    while len(stream) < len(text):
+        stream += hashlib.sha256(stream).digest()
+    characters = []
+    for character, byte in zip(text, stream):
+        if character.isdigit():
+            character = str(byte % 10)
+        elif character.isalpha():
+            character = chr((ord('A') if character.isupper() else ord('a')) + byte % 26)
+        characters.append(character)
+    if isinstance(value, int):
+        # Numbers keep their first digit, and so their number of digits
+        return int(text[0] + ''.join(characters[1:]))
+    return ''.join(characters)
+
+
+def anonymize(value, key: bytes):
+    if isinstance(value, list):
+        return [anonymize(item, key) for item in value]
+    if not isinstance(value, dict):
+        return value
+    person = 'first_name' in value or 'last_name' in value
+    anonymized = {}
+    for name, item in value.items():
+        if person and name in PERSON_FIELDS and item is not None:
+            anonymized[name] = scramble(item, key)
+        elif person and name == 'identifiers' and isinstance(item, list):
+            anonymized[name] = [
+                {**identifier, 'value': scramble(identifier.get('value'), key)} for identifier in item
+            ]
+        else:
+            anonymized[name] = anonymize(item, key)
+    return anonymized
+
+
+def read_requests(path: str) -> list:
+    requests = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parameters = dict(parse_qsl(line.split('?', 1)[-1].split()[0]))
+            if 'verb' in parameters and 'resumptionToken' not in parameters:
+                requests.append(parameters)
+    return requests
+
+
+def serve(client, parameters: dict, pages: int):
+    # The pages of a list, following its resumptionTokens: (parameters, status, document, seconds)
+    for _ in range(pages):
+        started = time.perf_counter()
+        response = client.get('/oai/api', query_string=parameters)
+        document = response.get_data()
+        yield parameters, response.status_code, document, time.perf_counter() - started
+        token = next_token(document)
+        if token is None:
+            break
+        parameters = {'verb': parameters['verb'], 'resumptionToken': token}
+
+
+def open_app(config, es, timeout: float = 30):
+    # An application of one repository whose ES client is `es`, once it is warmed up (see
+    # readiness.py), so that warming up neither runs along with the pages nor is left unrecorded
+    from gupprovider import GUPProvider
+    from oaiserver import create_app
+    from resources import SharedResources
+
+    shared = SharedResources()
+    shared.clients[config.es_host] = es
+    client = create_app(GUPProvider(config, shared)).test_client()
+    deadline = time.monotonic() + timeout
+    while client.get('/oai/ready').status_code != 200 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return client
+
+
+def record(args):
+    from config import Config
+    from resources import SharedResources
+
+    config = Config.from_env()
+    exchanges = {}
+    es = RecordingES(SharedResources().es(config.es_host), exchanges)
+    client = open_app(config, es)
+    chains = []
+    for parameters in read_requests(args.requests):
+        pages = sum(1 for _ in serve(client, parameters, args.follow))
+        chains.append({'parameters': parameters, 'pages': pages})
+        print(f'{parameters}: {pages} pages', file=sys.stderr)
+    # Background refreshes started with the application (such as the identifier set) are recorded
+    # too, when they are done by then
+    time.sleep(args.settle)
+    exchanges = {call: json.loads(response) for call, response in exchanges.items()}
+    if args.anonymize:
+        key = secrets.token_bytes(32)
+        exchanges = {call: anonymize(response, key) for call, response in exchanges.items()}
+    fields = {name: value for name, value in config._asdict().items() if name != 'token_secret'}
+    fixture = {
+        'format': FORMAT,
+        'recorded_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'anonymized': args.anonymize,
+        'config': fields,
+        'chains': chains,
+        'exchanges': exchanges,
+    }
+    with gzip.open(args.fixture, 'wt', encoding='utf8') as file:
+        json.dump(fixture, file)
+    print(f'{len(chains)} requests, {sum(chain["pages"] for chain in chains)} pages and '
+          f'{len(exchanges)} ES calls recorded', file=sys.stderr)
+
+
+def replay(args):
+    # Only the code under test builds the pages
+    os.environ.update(RESPONSE_CACHE_TTL='0', PREFETCH_WORKERS='0', WARM_INTERVAL='0', CACHE_URL='memory:')
+    from config import Config
+    from oai_repo.resumption import ResumptionToken
+
+    with gzip.open(args.fixture, 'rt', encoding='utf8') as file:
+        fixture = json.load(file)
+    if fixture.get('format') != FORMAT:
+        raise SystemExit(f'{args.fixture} is not a fixture of format {FORMAT}')
+    # Fields of the fixture unknown to this version of the code are left out
+    config = Config(**{name: value for name, value in fixture['config'].items() if name in Config._fields})
+    # The same tokens in every replay
+    ResumptionToken.configure('replay')
+    pages = []
+    misses = 0
+    for repeat in range(args.repeat):
+        # A new worker for every repeat, with caches as cold as the first time
+        es = ReplayES(fixture['exchanges'])
+        client = open_app(config, es)
+        served = [page for chain in fixture['chains'] for page in serve(client, chain['parameters'], chain['pages'])]
+        for number, (parameters, status, document, seconds) in enumerate(served):
+            if repeat == 0:
+                pages.append({'parameters': parameters, 'status': status,
+                              'body': document.decode('utf8'), 'seconds': [seconds]})
+            elif number < len(pages):
+                pages[number]['seconds'].append(seconds)
+        misses += es.misses
+        print(f'Repeat {repeat + 1}: {len(served)} pages in {sum(page[3] for page in served):.2f} s', file=sys.stderr)
+    with gzip.open(args.output, 'wt', encoding='utf8') as file:
+        json.dump({'fixture': args.fixture, 'repeat': args.repeat, 'misses': misses, 'pages': pages}, file)
+    if misses:
+        print(f'{misses} ES calls were not recorded, record the fixture again', file=sys.stderr)
+
+
+def load_replay(path: str) -> dict:
+    with gzip.open(path, 'rt', encoding='utf8') as file:
+        return json.load(file)
+
+
+def compare(args):
+    old, new = load_replay(args.old), load_replay(args.new)
+    differences = 0
+    if len(old['pages']) != len(new['pages']):
+        print(f'{len(old["pages"])} pages against {len(new["pages"])}')
+        differences += 1
+    verbs = {}
+    for before, after in zip(old['pages'], new['pages']):
+        first = RESPONSE_DATE.sub(b'', before['body'].encode('utf8'))
+        second = RESPONSE_DATE.sub(b'', after['body'].encode('utf8'))
+        if before['status'] != after['status'] or first != second:
+            differences += 1
+            offset = next((i for i, (a, b) in enumerate(zip(first, second)) if a != b), min(len(first), len(second)))
+            print(f'{before["parameters"]} differs at byte {offset} (HTTP {before["status"]}/{after["status"]}):')
+            print(f'  - {first[max(0, offset - 40):offset + 80]!r}')
+            print(f'  + {second[max(0, offset - 40):offset + 80]!r}')
+        entry = verbs.setdefault(before['parameters']['verb'], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += statistics.median(before['seconds'])
+        entry[2] += statistics.median(after['seconds'])
+
+    print(f'{"verb":<20} {"pages":>6} {"old ms":>10} {"new ms":>10} {"change":>8}')
+    for verb, (count, before, after) in sorted(verbs.items()):
+        print(f'{verb:<20} {count:>6} {before / count * 1000:>10.2f} {after / count * 1000:>10.2f} '
+              f'{(after / before - 1) * 100 if before else 0:>+7.1f}%')
+    for label, replayed in (('old', old), ('new', new)):
+        seconds = sum(statistics.median(page['seconds']) for page in replayed['pages'])
+        size = sum(len(page['body'].encode('utf8')) for page in replayed['pages'])
+        print(f'{label}: {len(replayed["pages"]) / seconds:.1f} pages/s, {size / seconds / 1024 / 1024:.2f} MB/s '
+              f'({replayed["misses"]} misses)' if seconds else f'{label}: no pages')
+    if differences:
+        raise SystemExit(f'{differences} responses differ')
+    print(f'All {len(new["pages"])} responses are the same')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record, replay and compare OAI-PMH traffic.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    recording = commands.add_parser('record', help='record requests and the ES responses they need')
+    recording.add_argument('requests', help='file with one request (query string or URL) per line')
+    recording.add_argument('fixture', help='fixture file to write (gzipped JSON)')
+    recording.add_argument('--follow', type=int, default=1, help='pages to follow each list for')
+    recording.add_argument('--anonymize', action='store_true', help='scramble the personal data of persons')
+    recording.add_argument('--settle', type=float, default=5,
+                           help='seconds to wait for background refreshes after the last request')
+    running = commands.add_parser('run', help='replay a fixture through the current code')
+    running.add_argument('fixture')
+    running.add_argument('output', help='file to write the responses and times to (gzipped JSON)')
+    running.add_argument('--repeat', type=int, default=3, help='times to replay the fixture')
+    comparing = commands.add_parser('compare', help='compare the responses and times of two replays')
+    comparing.add_argument('old')
+    comparing.add_argument('new')
+    args = parser.parse_args()
+    {'record': record, 'run': replay, 'compare': compare}[args.command](args)
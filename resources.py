@@ -0,0 +1,56 @@
+import threading
+
+from elasticsearch import Elasticsearch
+try:
+    # orjson is optional, it decodes the large search responses faster
+    from elasticsearch.serializer import OrjsonSerializer
+except ImportError:
+    OrjsonSerializer = None
+
+from cache import MemoryCache, Namespaced, open_cache
+from rendering import RenderPool
+
+
+class SharedResources:
+    """
+    What the repositories served by one process share: an Elasticsearch client (with its pool of
+    connections) per host, the render process pool and the cache tiers of CACHE_URL.
+
+    Each repository gets its own namespace in a cache tier. An in-memory tier grows by the entries
+    of each repository using it, and holds each to the quota of bytes in its config.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.tiers = {}
+        self.render_pool = RenderPool()
+        self.lock = threading.Lock()
+
+    def es(self, host: str) -> Elasticsearch:
+        with self.lock:
+            if host not in self.clients:
+                self.clients[host] = Elasticsearch(
+                    hosts=[{'host': host, 'port': 9200, 'scheme': 'http'}],
+                    **({'serializer': OrjsonSerializer()} if OrjsonSerializer else {})
+                )
+            return self.clients[host]
+
+    def renderer(self, workers: int) -> RenderPool:
+        # The pool has as many workers as the repository asking for the most, until it is started
+        with self.lock:
+            if self.render_pool.executor is None:
+                self.render_pool.workers = max(self.render_pool.workers, workers)
+            return self.render_pool
+
+    def cache(self, name: str, max_entries: int, namespace: str = None, quota: int = None):
+        # The tier `name` as seen by a repository, or the whole tier for a process serving one
+        with self.lock:
+            tier = self.tiers.get(name)
+            if tier is None:
+                tier = self.tiers[name] = open_cache(name, max_entries)
+            elif isinstance(tier, MemoryCache):
+                tier.max_entries += max_entries
+        if namespace is None:
+            return tier
+        if isinstance(tier, MemoryCache):
+            tier.add_namespace(namespace, quota)
+        return Namespaced(tier, namespace)
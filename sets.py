@@ -0,0 +1,119 @@
+from records import Record
+from refresher import PeriodicRefresher
+
+# Set hierarchies: the top level setSpec, and the indexed field the setSpecs below it are taken from.
+# A publication is in the set "department:1304" if 1304 is one of its affiliations.department_id.
+SET_FIELDS = {
+    'department': 'affiliations.department_id',
+    'category': 'categories.svep_id',
+    'publication_type': 'publication_type_code',
+}
+
+# Names and descriptions of the top level sets, for the institution of the root set
+SET_NAMES = {
+    'department': ('Institutioner', 'Publications by department at {institution}'),
+    'category': ('Forskningsämnen', 'Publications by research subject (SSIF)'),
+    'publication_type': ('Publikationstyper', 'Publications by publication type'),
+}
+
+def field_values(source: dict, path: str) -> list:
+    # All values at a dotted path in a _source dict (or record), descending into lists like ES does
+    values = [source]
+    for key in path.split('.'):
+        found = []
+        for value in values:
+            for item in (value if isinstance(value, list) else [value]):
+                if isinstance(item, (dict, Record)) and item.get(key) is not None:
+                    found.append(item[key])
+        values = [item for value in found for item in (value if isinstance(value, list) else [value])]
+    return values
+
+
+def record_set_specs(publication: dict) -> list:
+    # The setSpecs below the top level sets for a publication, in the order of SET_FIELDS
+    set_specs = []
+    for top, path in SET_FIELDS.items():
+        for value in field_values(publication, path):
+            set_spec = f'{top}:{value}'
+            if set_spec not in set_specs:
+                set_specs.append(set_spec)
+    return set_specs
+
+
+def split_set_spec(set_spec: str) -> tuple:
+    # "department:1304" -> ("department", "1304"), "department" -> ("department", None)
+    top, _, value = set_spec.partition(':')
+    return top, value or None
+
+
+class SetHierarchy:
+    """
+    The department, category and publication type sets, enumerated with a terms aggregation over
+    the index. The aggregation is cached and refreshed in the background every `interval` seconds.
+    `search` runs a query against the publications index. Publication types have no name in the
+    index, `type_name` maps a publication_type_code to one. `institution` is the name of the root
+    set, used in the descriptions of the top level sets.
+
+    Lookups never wait for the aggregation. Until it is first loaded (see warm), only the top level
+    sets are listed, and any setSpec below them is taken to exist, named by its value.
+    """
+    def __init__(self, search, interval: float, type_name, source: str = 'gup',
+                 institution: str = 'Göteborgs universitet'):
+        self.search = search
+        self.type_name = type_name
+        self.source = source
+        self.names = {
+            top: (name, description.format(institution=institution)) for top, (name, description) in SET_NAMES.items()
+        }
+        self.refresher = PeriodicRefresher('sets', self.load, interval)
+
+    def load(self) -> dict:
+        aggregations = {}
+        for top, path in SET_FIELDS.items():
+            aggregations[top] = {
+                'terms': {'field': path, 'size': 10000, 'order': {'_key': 'asc'}},
+            }
+            if '.' in path:
+                # Take the names of departments and categories from one of their publications
+                parent = path.rsplit('.', 1)[0]
+                aggregations[top]['aggs'] = {
+                    'example': {'top_hits': {'size': 1, '_source': {'includes': [parent]}}}
+                }
+        query = {
+            'size': 0,
+            'query': {'bool': {'filter': [{'term': {'source': self.source}}]}},
+            'aggs': aggregations,
+        }
+        results = self.search(query)['aggregations']
+
+        sets = {}
+        for top, path in SET_FIELDS.items():
+            sets[top] = self.names[top]
+            parent, key = path.rsplit('.', 1) if '.' in path else (None, path)
+            for bucket in results[top]['buckets']:
+                value = bucket['key']
+                if parent is None:
+                    sets[f'{top}:{value}'] = (self.type_name(value), value)
+                    continue
+                example = bucket['example']['hits']['hits'][0]['_source']
+                entry = next((item for item in field_values(example, parent) if item.get(key) == value), {})
+                sets[f'{top}:{value}'] = (entry.get('name_sv') or str(value), entry.get('name_en') or str(value))
+        return sets
+
+    def warm(self):
+        # Load the aggregation in the calling thread, unless it is loaded
+        self.refresher.get()
+
+    def specs(self) -> list:
+        sets = self.refresher.peek()
+        return list(self.names if sets is None else sets)
+
+    def get(self, set_spec: str) -> tuple:
+        # (name, description) of a set, or None if the set does not exist
+        sets = self.refresher.peek()
+        if sets is not None:
+            return sets.get(set_spec)
+        top, value = split_set_spec(set_spec)
+        if top not in self.names:
+            return None
+        return self.names[top] if value is None else (value, value)
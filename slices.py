@@ -0,0 +1,117 @@
+"""
+Fetching large result sets from Elasticsearch in concurrent slices.
+
+A large harvest page is searched for without the sources of its hits, which keeps the sorting pass
+light, and the sources are then fetched by id in `slices` searches at once. A scan reads `slices`
+slices of one point in time at once, each in harvest order, and merges them back into that order.
+Either way the hits come out as from one search, while ES spreads the fetching over its shards.
+"""
+import heapq
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SlicedFetch:
+    def __init__(self, slices: int, min_size: int):
+        self.slices = slices
+        # Pages with fewer hits are searched for at once
+        self.min_size = min_size
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.slices, thread_name_prefix='slice')
+            return self.executor
+
+    def search(self, es, index: str, query: dict, **params) -> dict:
+        # The response to a sorted query, with the sources of its hits fetched in slices. Hits
+        # removed from the index in between are left out.
+        results = es.search(index=index, body={**query, '_source': False}, **params)
+        hits = results['hits']['hits']
+        if not hits:
+            return results
+        size = -(-len(hits) // self.slices)
+        sources = {}
+        chunks = [hits[start:start + size] for start in range(0, len(hits), size)]
+        for fetched in self.pool().map(lambda chunk: self.fetch(es, index, query, chunk), chunks):
+            sources.update(fetched)
+        results['hits']['hits'] = [
+            {**hit, '_source': sources[key]} for hit in hits if (key := (hit['_index'], hit['_id'])) in sources
+        ]
+        return results
+
+    def fetch(self, es, index: str, query: dict, hits: list) -> dict:
+        # The sources of the hits by (index, id). An id can be found in each of the indices searched.
+        body = {
+            'query': {'ids': {'values': [hit['_id'] for hit in hits]}},
+            '_source': query.get('_source', True),
+            'size': len(hits) * len(index.split(',')),
+        }
+        results = es.search(index=index, body=body)
+        return {(hit['_index'], hit['_id']): hit['_source'] for hit in results['hits']['hits']}
+
+    def scan(self, es, index: str, query: dict, batch_size: int, keep_alive: str):
+        # Iterate over all hits of a sorted query in batches, like GUPProvider.scan, reading the
+        # slices of a point in time in threads of their own. ES can return a new id for the point in
+        # time with each search, so the latest id of each slice is kept to close it with.
+        pit_ids = [es.open_point_in_time(index=index, keep_alive=keep_alive)['id']] * self.slices
+        stop = threading.Event()
+        batches = [queue.Queue(maxsize=2) for _ in range(self.slices)]
+        threads = [
+            threading.Thread(
+                target=self.read_slice, name=f'slice-{number}', daemon=True,
+                args=(es, number, pit_ids, query, batch_size, keep_alive, batches[number], stop)
+            )
+            for number in range(self.slices)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            hits = heapq.merge(*(self.drain(batch) for batch in batches), key=lambda hit: hit['sort'])
+            while batch := list(itertools.islice(hits, batch_size)):
+                yield batch
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for pit_id in dict.fromkeys(pit_ids):
+                es.close_point_in_time(id=pit_id)
+
+    def read_slice(self, es, number: int, pit_ids: list, query: dict, batch_size: int, keep_alive: str,
+                   batches: queue.Queue, stop: threading.Event):
+        body = {**query, 'size': batch_size, 'slice': {'id': number, 'max': self.slices}}
+        try:
+            while not stop.is_set():
+                body['pit'] = {'id': pit_ids[number], 'keep_alive': keep_alive}
+                results = es.search(body=body)
+                pit_ids[number] = results.get('pit_id', pit_ids[number])
+                hits = results['hits']['hits']
+                if not hits:
+                    break
+                self.put(batches, hits, stop)
+                body['search_after'] = hits[-1]['sort']
+            self.put(batches, None, stop)
+        except Exception as e:
+            self.put(batches, e, stop)
+
+    @staticmethod
+    def put(batches: queue.Queue, item, stop: threading.Event):
+        # Wait for the merge to take the batches read before, unless the scan was abandoned
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    @staticmethod
+    def drain(batches: queue.Queue):
+        # The hits of one slice, in order, until it is read to the end
+        while (batch := batches.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
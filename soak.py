@@ -0,0 +1,124 @@
+"""
+Replay complete harvests through the OAI-PMH application against an in-memory stand-in for
+Elasticsearch (see standin.py), and fail when memory keeps growing after the first harvests.
+
+    python soak.py                                      # 3 ListRecords harvests of 20000 records
+    python soak.py --records 100000 --rounds 10 --samples soak.csv
+    python soak.py --verb ListIdentifiers --max-growth-mb 5
+
+The first --warmup harvests fill the bounded caches (normalized publications, rendered fragments,
+sets and datestamps). The resident memory and the memory traced by tracemalloc are sampled after
+every page (less the memory of tracemalloc itself); after the warm-up, neither may grow by more
+than --max-growth-mb until the last harvest has been served. The allocations that grew the most
+between the snapshots taken then are printed either way. Tracing makes harvests several times
+slower, and more so with more --frames per allocation.
+"""
+import argparse
+import csv
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('ES_HOST_NAME', 'localhost')
+os.environ.setdefault('COUNT', '100')
+os.environ.setdefault('REPOSITORY_NAME', 'GUP')
+os.environ.setdefault('BASE_URL', 'https://example.org/oai/api')
+os.environ.setdefault('ADMIN_EMAIL', 'admin@example.org')
+os.environ.setdefault('IDENTIFIER_PREFIX', 'oai:gup.ub.gu.se')
+os.environ.setdefault('URI_PREFIX', 'https://gup.ub.gu.se/publication')
+
+from gupprovider import GUPProvider
+from memguard import resident_bytes
+from oaiserver import create_app
+from prefetch import next_token
+from standin import StandInES, synthetic_publications
+
+MB = 1024 * 1024
+
+
+def harvest(client, verb: str, metadata_prefix: str, sample):
+    parameters = {'verb': verb, 'metadataPrefix': metadata_prefix}
+    pages = 0
+    while parameters is not None:
+        response = client.get('/oai/api', query_string=parameters)
+        if response.status_code != 200:
+            raise SystemExit(f'{verb} page {pages + 1} failed with HTTP {response.status_code}')
+        document = response.get_data()
+        pages += 1
+        sample(pages, len(document))
+        token = next_token(document)
+        parameters = {'verb': verb, 'resumptionToken': token} if token else None
+    return pages
+
+
+def resident() -> int:
+    # The traces kept by tracemalloc are not part of what is being measured
+    return resident_bytes() - tracemalloc.get_tracemalloc_memory()
+
+
+def measure() -> tuple:
+    gc.collect()
+    return resident(), tracemalloc.get_traced_memory()[0]
+
+
+def main(args):
+    tracemalloc.start(args.frames)
+    provider = GUPProvider()
+    provider.es = StandInES(synthetic_publications(args.records))
+    client = create_app(provider).test_client()
+
+    samples = open(args.samples, 'w', newline='') if args.samples else None
+    writer = csv.writer(samples) if samples else None
+    if writer:
+        writer.writerow(['round', 'page', 'bytes', 'rss_mb', 'traced_mb', 'seconds'])
+    started = time.monotonic()
+    baseline = snapshot = None
+    for round_number in range(1, args.rounds + 1):
+        def sample(page: int, size: int):
+            if writer and page % args.sample_every == 0:
+                writer.writerow([
+                    round_number, page, size, round(resident() / MB, 2),
+                    round(tracemalloc.get_traced_memory()[0] / MB, 2), round(time.monotonic() - started, 2),
+                ])
+        round_started = time.monotonic()
+        pages = harvest(client, args.verb, args.format, sample)
+        if round_number == args.warmup:
+            # Both measurements include the first snapshot, the second is taken after the last one
+            snapshot = tracemalloc.take_snapshot()
+            baseline = measure()
+        rss, traced = measure()
+        print(f'Harvest {round_number}: {pages} pages in {time.monotonic() - round_started:.1f} s, '
+              f'resident {rss / MB:.1f} MB, traced {traced / MB:.1f} MB', file=sys.stderr)
+    if samples:
+        samples.close()
+
+    if baseline is None:
+        raise SystemExit('--rounds must be greater than --warmup')
+    rss_growth, traced_growth = (rss - baseline[0]) / MB, (traced - baseline[1]) / MB
+    print(f'Growth after warm-up: resident {rss_growth:+.1f} MB, traced {traced_growth:+.1f} MB', file=sys.stderr)
+    for statistic in tracemalloc.take_snapshot().compare_to(snapshot, 'traceback')[:args.top]:
+        if statistic.size_diff <= 0:
+            break
+        print(f'{statistic.size_diff / 1024:+.1f} KiB in {statistic.count_diff:+d} blocks', file=sys.stderr)
+        for line in statistic.traceback.format():
+            print(f'    {line}', file=sys.stderr)
+    if max(rss_growth, traced_growth) > args.max_growth_mb:
+        raise SystemExit(f'Memory grew by more than {args.max_growth_mb} MB after the warm-up')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Soak the OAI-PMH application with full harvests.')
+    parser.add_argument('--records', type=int, default=20000, help='synthetic publications to harvest')
+    parser.add_argument('--rounds', type=int, default=3, help='full harvests, including the warm-up')
+    parser.add_argument('--warmup', type=int, default=1, help='harvests before the baseline is taken')
+    parser.add_argument('--verb', choices=['ListRecords', 'ListIdentifiers'], default='ListRecords')
+    parser.add_argument('--format', default='mods', help='metadataPrefix to harvest')
+    parser.add_argument('--max-growth-mb', type=float, default=10,
+                        help='growth of resident or traced memory after the warm-up that fails the run')
+    parser.add_argument('--samples', default=None, help='CSV file to write the samples to')
+    parser.add_argument('--sample-every', type=int, default=1, help='pages between samples')
+    parser.add_argument('--frames', type=int, default=1, help='frames of each traced allocation')
+    parser.add_argument('--top', type=int, default=10, help='largest growths to print')
+    main(parser.parse_args())
@@ -0,0 +1,296 @@
+"""
+An in-memory stand-in for the Elasticsearch client, answering the requests GUPProvider makes
+(search with filters, ids, sorting, search_after, sliced points in time and the aggregations of
+sets.py and datestamps.py; count, exists, get, index and info), and a generator of synthetic publications to fill it with.
+
+Documents are kept as JSON and decoded for every hit returned, like the real client does, so that
+a harvest against the stand-in allocates about as much as one against ES. The hits of each query
+are sorted once and kept until a document is indexed.
+"""
+import json
+import random
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+
+def field_values(document: dict, path: str) -> list:
+    values = [document]
+    for key in path.split('.'):
+        found = []
+        for value in values:
+            for item in (value if isinstance(value, list) else [value]):
+                if isinstance(item, dict) and item.get(key) is not None:
+                    found.append(item[key])
+        values = [item for value in found for item in (value if isinstance(value, list) else [value])]
+    return values
+
+
+def term(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def datestamp(value: str) -> str:
+    # Dates are compared to the second, as YYYY-MM-DDThh:mm:ss
+    return value[:19]
+
+
+class StandInES:
+    def __init__(self, documents: list, index: str = 'publications'):
+        # Documents by (index, id), and parsed to match queries against
+        self.documents = {}
+        self.parsed = {}
+        self.by_id = {}
+        self.results = {}
+        self.pits = {}
+        for document in documents:
+            self.put(index, document['id'], document)
+
+    def put(self, index: str, id: str, document: dict):
+        self.documents[index, id] = json.dumps(document)
+        hit = self.parsed[index, id] = {'_index': index, '_id': id, '_source': json.loads(self.documents[index, id])}
+        self.by_id.setdefault(id, {})[index] = hit
+        # The sorted hits of each query
+        self.results = {}
+
+    def load(self, index: str) -> list:
+        indices = index.split(',') if index else []
+        return [hit for hit in self.parsed.values() if hit['_index'] in indices]
+
+    def hit(self, parsed: dict, sort: list = None, source: bool = True) -> dict:
+        # A newly decoded hit, as the client returns it
+        hit = {'_index': parsed['_index'], '_id': parsed['_id']}
+        if source is not False:
+            hit['_source'] = json.loads(self.documents[parsed['_index'], parsed['_id']])
+        if sort is not None:
+            hit['sort'] = sort
+        return hit
+
+    def matches(self, hit: dict, query: dict) -> bool:
+        if not query:
+            return True
+        if 'bool' in query:
+            clauses = query['bool']
+            return all(self.matches(hit, clause) for clause in clauses.get('filter', []) + clauses.get('must', [])) \
+                and not any(self.matches(hit, clause) for clause in clauses.get('must_not', []))
+        if 'term' in query:
+            (field, value), = query['term'].items()
+            if field == '_index':
+                return hit['_index'] == value
+            return term(value) in [term(found) for found in field_values(hit['_source'], field)]
+        if 'exists' in query:
+            return bool(field_values(hit['_source'], query['exists']['field']))
+        if 'range' in query:
+            (field, bounds), = query['range'].items()
+            values = [datestamp(value) for value in field_values(hit['_source'], field)]
+            return any(
+                ('gte' not in bounds or value >= datestamp(bounds['gte'])) and
+                ('lte' not in bounds or value <= datestamp(bounds['lte']))
+                for value in values
+            )
+        if 'match_all' in query:
+            return True
+        raise NotImplementedError(f'Query not supported by the stand-in: {query}')
+
+    def sort_values(self, hit: dict, sort: list) -> list:
+        values = []
+        for clause in sort:
+            (field, _), = clause.items()
+            value = hit['_source'].get(field)
+            if field == 'updated_at':
+                value = int((datetime.fromisoformat(datestamp(value)) - datetime(1970, 1, 1)).total_seconds() * 1000)
+            values.append(value)
+        return values
+
+    def search(self, index: str = None, body: dict = None, **kwargs) -> dict:
+        body = body or {}
+        if 'pit' in body:
+            index = self.pits[body['pit']['id']]
+        sort = body.get('sort') or []
+        key = json.dumps([index, body.get('query'), sort], sort_keys=True)
+        if 'ids' in (body.get('query') or {}):
+            # Lookups by id are not kept
+            indices = index.split(',') if index else []
+            results = [
+                ([], hit) for id in body['query']['ids']['values']
+                for name, hit in self.by_id.get(id, {}).items() if name in indices
+            ]
+        else:
+            if key not in self.results:
+                hits = [hit for hit in self.load(index) if self.matches(hit, body.get('query'))]
+                self.results[key] = sorted(((self.sort_values(hit, sort), hit) for hit in hits), key=lambda item: item[0])
+            results = self.results[key]
+        if 'slice' in body:
+            results = [
+                (values, hit) for values, hit in results
+                if zlib.crc32(hit['_id'].encode()) % body['slice']['max'] == body['slice']['id']
+            ]
+        response = {'hits': {'hits': []}}
+        if body.get('track_total_hits', True) is not False:
+            response['hits']['total'] = {'value': len(results), 'relation': 'eq'}
+        if 'aggs' in body:
+            response['aggregations'] = self.aggregate([hit for values, hit in results], body['aggs'])
+        if 'search_after' in body:
+            after = list(body['search_after'])
+            results = [(values, hit) for values, hit in results if values > after]
+        start = body.get('from', 0)
+        response['hits']['hits'] = [
+            self.hit(hit, values if sort else None, body.get('_source'))
+            for values, hit in results[start:start + body.get('size', 10)]
+        ]
+        if 'pit' in body:
+            response['pit_id'] = body['pit']['id']
+        return response
+
+    def aggregate(self, hits: list, aggregations: dict) -> dict:
+        results = {}
+        for name, aggregation in aggregations.items():
+            sub = aggregation.get('aggs', {})
+            if 'min' in aggregation or 'max' in aggregation:
+                field = (aggregation.get('min') or aggregation.get('max'))['field']
+                values = [datestamp(value) for hit in hits for value in field_values(hit['_source'], field)]
+                value = (min if 'min' in aggregation else max)(values) if values else None
+                results[name] = {'value': 1 if value else None, 'value_as_string': value and value + '.000Z'}
+            elif 'date_histogram' in aggregation:
+                field = aggregation['date_histogram']['field']
+                days = sorted({value[:10] for hit in hits for value in field_values(hit['_source'], field)})
+                results[name] = {'buckets': [{'key_as_string': day, 'doc_count': 1} for day in days]}
+            elif 'filters' in aggregation:
+                results[name] = {'buckets': {
+                    key: {'doc_count': len(matching), **self.aggregate(matching, sub)}
+                    for key, query in aggregation['filters']['filters'].items()
+                    for matching in [[hit for hit in hits if self.matches(hit, query)]]
+                }}
+            elif 'terms' in aggregation:
+                field = aggregation['terms']['field']
+                groups = {}
+                for hit in hits:
+                    for value in set(field_values(hit['_source'], field)):
+                        groups.setdefault(value, []).append(hit)
+                results[name] = {'buckets': [
+                    {'key': key, 'doc_count': len(group), **self.aggregate(group, sub)}
+                    for key, group in sorted(groups.items(), key=lambda item: str(item[0]))
+                ]}
+            elif 'top_hits' in aggregation:
+                results[name] = {'hits': {'hits': [self.hit(hit) for hit in hits[:aggregation['top_hits'].get('size', 3)]]}}
+            else:
+                raise NotImplementedError(f'Aggregation not supported by the stand-in: {aggregation}')
+        return results
+
+    def info(self, **kwargs) -> dict:
+        return {'name': 'stand-in', 'version': {'number': '8.13.0'}}
+
+    def count(self, index: str = None, body: dict = None, **kwargs) -> dict:
+        return {'count': sum(1 for hit in self.load(index) if self.matches(hit, (body or {}).get('query')))}
+
+    def exists(self, index: str = None, id: str = None, **kwargs) -> bool:
+        return (index, id) in self.documents
+
+    def get(self, index: str = None, id: str = None, **kwargs) -> dict:
+        return {**self.hit({'_index': index, '_id': id}), 'found': True}
+
+    def mget(self, index: str = None, ids: list = None, **kwargs) -> dict:
+        return {'docs': [
+            {**self.hit({'_index': index, '_id': id}), 'found': True} if (index, id) in self.documents
+            else {'_index': index, '_id': id, 'found': False}
+            for id in ids
+        ]}
+
+    def index(self, index: str = None, id: str = None, document: dict = None, **kwargs) -> dict:
+        self.put(index, id, document)
+        return {'_index': index, '_id': id, 'result': 'updated'}
+
+    def delete(self, index: str = None, id: str = None, **kwargs) -> dict:
+        del self.documents[index, id], self.parsed[index, id], self.by_id[id][index]
+        self.results = {}
+        return {'_index': index, '_id': id, 'result': 'deleted'}
+
+    def open_point_in_time(self, index: str = None, **kwargs) -> dict:
+        pit_id = uuid.uuid4().hex
+        self.pits[pit_id] = index
+        return {'id': pit_id}
+
+    def close_point_in_time(self, id: str = None, **kwargs) -> dict:
+        self.pits.pop(id, None)
+        return {'succeeded': True}
+
+
+PUBLICATION_TYPES = [
+    'publication_journal-article', 'publication_book', 'publication_book-chapter', 'conference_paper',
+    'publication_doctoral-thesis', 'publication_report', 'artistic-work_original-creative-work',
+]
+
+
+def synthetic_publications(count: int, seed: int = 1) -> list:
+    """
+    `count` publications with the fields and about the sizes of GUP publications: up to 30
+    authors with affiliations, categories, identifiers, an abstract and files.
+    """
+    generator = random.Random(seed)
+    started = datetime(2015, 1, 1)
+    publications = []
+    for number in range(1, count + 1):
+        publication_id = 100000 + number
+        authors = []
+        for position in range(1, generator.choice([1, 2, 3, 5, 8, 30]) + 1):
+            authors.append({
+                'position': [{'position': position}],
+                'person': [{
+                    'first_name': f'Förnamn{position}',
+                    'last_name': f'Efternamn{generator.randint(1, 5000)}',
+                    'year_of_birth': generator.choice([None, 1960 + position]),
+                    'identifiers': [{'type': 'xkonto', 'value': f'x{generator.randint(1, 9999)}'}] +
+                                   ([{'type': 'orcid', 'value': '0000-0002-1825-0097'}] if generator.random() < 0.4 else []),
+                }],
+                'affiliations': [
+                    {'department_id': department, 'name_sv': f'Institutionen {department}', 'name_en': f'Department {department}'}
+                    for department in generator.sample([1304, 1323, 2000, 2011, 666], generator.choice([0, 1, 1, 2]))
+                ],
+            })
+        updated_at = started + timedelta(seconds=generator.randint(0, 10 * 365 * 86400))
+        publications.append({
+            'id': f'gup_{publication_id}',
+            'publication_id': publication_id,
+            'source': 'gup',
+            'deleted': generator.random() < 0.02,
+            'affiliated': generator.random() < 0.8,
+            'updated_at': updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3],
+            'created_at': (updated_at - timedelta(days=generator.randint(0, 400))).strftime('%Y-%m-%dT%H:%M:%S'),
+            'publication_type_code': generator.choice(PUBLICATION_TYPES),
+            'ref_value': generator.choice(['ISREF', 'NOTREF']),
+            'artistic_basis': False,
+            'title': f'Title of publication {publication_id} ' + 'word ' * generator.randint(3, 20),
+            'alt_title': generator.choice([None, 'A subtitle']),
+            'abstract': 'Abstract sentence with some words in it. ' * generator.randint(0, 40) or None,
+            'keywords': generator.choice([None, 'one, two, three']),
+            'publanguage': generator.choice(['eng', 'swe']),
+            'pubyear': updated_at.year,
+            'epub_ahead_of_print': None,
+            'publisher': generator.choice([None, 'Publisher']),
+            'place': generator.choice([None, 'Göteborg']),
+            'sourcetitle': generator.choice([None, 'Journal of Things']),
+            'made_public_in': None,
+            'sourcevolume': generator.choice([None, '12']),
+            'sourceissue': generator.choice([None, '3']),
+            'article_number': None,
+            'sourcepages': generator.choice([None, '101-115', 'e1234']),
+            'isbn': generator.choice([None, '978-91-7346-000-0']),
+            'issn': generator.choice([None, '1234-5678']),
+            'eissn': None,
+            'is_open_access': generator.random() < 0.3,
+            'authors': authors,
+            'affiliations': [affiliation for author in authors for affiliation in author['affiliations']],
+            'categories': [
+                {'svep_id': svep_id, 'name_sv': f'Ämne {svep_id}', 'name_en': f'Subject {svep_id}'}
+                for svep_id in generator.sample([10101, 10201, 20202, 30101, 50101], generator.choice([0, 1, 2]))
+            ],
+            'publication_identifiers': [
+                {'identifier_code': code, 'identifier_value': f'10.1000/{publication_id}'}
+                for code in generator.sample(['doi', 'isi-id', 'pubmed', 'scopus-id', 'handle'], generator.choice([0, 1, 3]))
+            ],
+            'series': [{'title': 'Series', 'part': '4', 'issn': None}] if generator.random() < 0.1 else [],
+            'files': [{'accepted': True, 'visible_after': None}] if generator.random() < 0.2 else [],
+        })
+    return publications
@@ -0,0 +1,45 @@
+"""
+The tests run against oai_repo with the modules of ../oai_repo copied over it, as they are in the
+image (see Dockerfile), and with the modules of the server importable.
+"""
+import atexit
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def overlay_oai_repo() -> str:
+    installed = os.path.dirname(importlib.util.find_spec('oai_repo').origin)
+    directory = tempfile.mkdtemp(prefix='oai_repo-')
+    atexit.register(shutil.rmtree, directory, True)
+    shutil.copytree(installed, os.path.join(directory, 'oai_repo'), ignore=shutil.ignore_patterns('__pycache__'))
+    overlay = os.path.join(ROOT, 'oai_repo')
+    for name in os.listdir(overlay):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(overlay, name), os.path.join(directory, 'oai_repo', name))
+    return directory
+
+
+sys.path[:0] = [overlay_oai_repo(), ROOT]
+
+# Configuration of a repository, as read by Config.from_env (see config.py)
+ENVIRON = {
+    'ES_HOST_NAME': 'localhost',
+    'COUNT': '10',
+    'REPOSITORY_NAME': 'GUP',
+    'BASE_URL': 'https://example.org/oai/api',
+    'ADMIN_EMAIL': 'admin@example.org',
+    'IDENTIFIER_PREFIX': 'oai:gup.ub.gu.se',
+    'URI_PREFIX': 'https://gup.ub.gu.se/publication',
+}
+
+
+@pytest.fixture
+def environ() -> dict:
+    return dict(ENVIRON)
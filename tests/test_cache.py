@@ -0,0 +1,11 @@
+from cache import fragment_key
+
+
+def test_fragment_key_changes_when_an_embargo_ends():
+    publication = {'id': 'gup_1', 'updated_at': '2020-01-01T00:00:00', 'files': [
+        {'accepted': True, 'visible_after': '2999-01-01'},
+    ]}
+    embargoed = fragment_key(publication, 'mods')
+    publication['files'][0]['visible_after'] = '2020-01-02'
+    assert fragment_key(publication, 'mods') != embargoed
+    assert fragment_key({**publication, 'files': None}, 'mods') != fragment_key(publication, 'mods')
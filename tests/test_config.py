@@ -0,0 +1,24 @@
+import pytest
+
+from config import ConfigError, repository_configs
+
+
+def test_named_repository_does_not_inherit_what_it_serves(environ):
+    configs = repository_configs({
+        **environ, 'ES_INDEX': 'publications_v2', 'DELETION_INDEX': 'publications_deletions',
+        'DELETED_RECORD': 'persistent', 'HARVEST_ORDER': 'updated_at', 'TOKEN_SECRET': 'secret',
+        'FRAGMENT_CACHE_SIZE': '500',
+        'REPOSITORIES': 'test', 'TEST_ES_INDEX': 'publications_test',
+        'TEST_BASE_URL': 'https://example.org/oai/test/api',
+    })
+    test = configs['test']
+    assert test.index == 'publications_test'
+    assert test.deletion_index is None and test.deleted_record == 'transient'
+    assert test.harvest_order == 'publication_id' and test.token_secret is None
+    # Settings that do not choose what is served fall back to those of the default repository
+    assert test.fragment_cache_size == 500 and test.repository_name == environ['REPOSITORY_NAME']
+
+
+def test_named_repository_needs_a_base_url_of_its_own(environ):
+    with pytest.raises(ConfigError, match='TEST_'):
+        repository_configs({**environ, 'REPOSITORIES': 'test', 'TEST_ES_INDEX': 'publications_test'})
@@ -0,0 +1,81 @@
+import re
+import types
+from datetime import datetime, timezone
+
+import pytest
+
+import deletions
+from config import Config, ConfigError
+from gupprovider import GUPProvider
+from oai_repo.repository import OAIRepository
+from resources import SharedResources
+from standin import StandInES, synthetic_publications
+
+RESPONSE_DATE = re.compile(rb'<responseDate>([^<]+)</responseDate>')
+
+
+def scan(es, index: str, query: dict):
+    return es.search(index=index, body={**query, 'size': 1000000})['hits']['hits']
+
+
+def bulk(es, actions, raise_on_error: bool = True) -> tuple:
+    created, errors = 0, []
+    for action in actions:
+        if es.exists(index=action['_index'], id=action['_id']):
+            errors.append({'create': {'_id': action['_id'], 'status': 409}})
+        else:
+            es.index(index=action['_index'], id=action['_id'], document=action['_source'])
+            created += 1
+    return created, errors
+
+
+@pytest.fixture
+def repository(environ, monkeypatch):
+    # The bulk and scroll helpers of the client, over the stand-in
+    monkeypatch.setattr(deletions, 'helpers', types.SimpleNamespace(scan=scan, bulk=bulk))
+    config = Config.from_env({
+        **environ, 'DELETION_INDEX': 'publications_deletions', 'DELETED_RECORD': 'persistent',
+        'DELETION_SYNC_INTERVAL': '3600', 'IDENTIFIER_REFRESH_INTERVAL': '0',
+    })
+    publications = [publication for publication in synthetic_publications(20) if not publication['deleted']]
+    shared = SharedResources()
+    shared.clients[config.es_host] = StandInES(publications)
+    provider = GUPProvider(config, shared)
+    return provider, OAIRepository(provider), publications
+
+
+def harvest(repo, **arguments) -> bytes:
+    return repo.process({'verb': 'ListIdentifiers', 'metadataPrefix': 'mods', **arguments}).document()
+
+
+def test_deletion_logged_after_a_harvest_is_in_the_next_one(repository):
+    provider, repo, publications = repository
+    harvested_at = RESPONSE_DATE.search(harvest(repo)).group(1).decode()
+    # Deleted since the harvest, with the updated_at it had before
+    publication = {**publications[0], 'deleted': True}
+    provider.es.index(index='publications', id=publication['id'], document=publication)
+    identifier = f"<identifier>oai:gup.ub.gu.se/{publication['publication_id']}</identifier>".encode()
+    assert identifier not in harvest(repo, **{'from': harvested_at})
+
+    assert provider.deletions.sync() == 1
+    document = harvest(repo, **{'from': harvested_at})
+    assert re.search(rb'<header status="deleted">\s*' + re.escape(identifier), document)
+
+
+def test_deletion_log_needs_a_sync_interval(environ):
+    with pytest.raises(ConfigError):
+        Config.from_env({**environ, 'DELETION_INDEX': 'publications_deletions', 'DELETION_SYNC_INTERVAL': '0'})
+
+
+def test_later_syncs_follow_updated_publications(repository):
+    provider, repo, publications = repository
+    assert provider.deletions.sync() == 0
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    deleted, restored = ({**publication, 'updated_at': now} for publication in publications[:2])
+    provider.deletions.record(restored)
+    provider.es.index(index='publications', id=deleted['id'], document={**deleted, 'deleted': True})
+    provider.es.index(index='publications', id=restored['id'], document=restored)
+
+    assert provider.deletions.sync() == 1
+    assert provider.deletions.exists(deleted['id'])
+    assert not provider.deletions.exists(restored['id'])
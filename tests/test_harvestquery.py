@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from harvestquery import harvest_query, normalize_date
+from oai_repo.exceptions import OAIErrorNoRecordsMatch
+
+SOURCE = {'term': {'source': 'gup'}}
+FROM = datetime(2021, 1, 1, tzinfo=timezone.utc)
+UNTIL = datetime(2021, 6, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize('set, from_date, until_date, filters', [
+    (None, None, None, [SOURCE]),
+    (None, FROM, None, [SOURCE, {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z'}}}]),
+    (None, None, UNTIL, [SOURCE, {'range': {'updated_at': {'lte': '2021-06-01T12:30:15Z'}}}]),
+    (None, FROM, UNTIL, [
+        SOURCE, {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z', 'lte': '2021-06-01T12:30:15Z'}}}
+    ]),
+    # A day as until date includes the whole day
+    (None, None, '2021-06-01', [SOURCE, {'range': {'updated_at': {'lte': '2021-06-01T23:59:59Z'}}}]),
+    (None, '2021-01-01', '2021-06-01', [
+        SOURCE, {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z', 'lte': '2021-06-01T23:59:59Z'}}}
+    ]),
+    ('gu', None, None, [SOURCE, {'term': {'affiliated': True}}]),
+    ('department', None, None, [SOURCE, {'exists': {'field': 'affiliations.department_id'}}]),
+    ('department:1304', FROM, None, [
+        SOURCE, {'term': {'affiliations.department_id': '1304'}},
+        {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z'}}}
+    ]),
+    ('category:10101', None, UNTIL, [
+        SOURCE, {'term': {'categories.svep_id': '10101'}},
+        {'range': {'updated_at': {'lte': '2021-06-01T12:30:15Z'}}}
+    ]),
+    ('publication_type:publication_book', FROM, '2021-06-01', [
+        SOURCE, {'term': {'publication_type_code': 'publication_book'}},
+        {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z', 'lte': '2021-06-01T23:59:59Z'}}}
+    ]),
+])
+def test_filters(set, from_date, until_date, filters):
+    assert harvest_query(set, from_date, until_date) == {'bool': {'filter': filters}}
+
+
+def test_unknown_set():
+    with pytest.raises(OAIErrorNoRecordsMatch):
+        harvest_query('unknown:1')
+
+
+def test_deletion_log():
+    # Publications marked as deleted in the index are left to the log
+    assert harvest_query(
+        'gu', FROM, None, index='publications', deletion_index='publications_deletions'
+    ) == {'bool': {
+        'filter': [SOURCE, {'term': {'affiliated': True}}, {'range': {'updated_at': {'gte': '2021-01-01T00:00:00Z'}}}],
+        'must_not': [{'bool': {'filter': [{'term': {'_index': 'publications'}}, {'term': {'deleted': True}}]}}],
+    }}
+
+
+def test_source_and_root_set():
+    assert harvest_query('chalmers', source='cpl', root_set='chalmers') == {'bool': {'filter': [
+        {'term': {'source': 'cpl'}}, {'term': {'affiliated': True}}
+    ]}}
+
+
+@pytest.mark.parametrize('date, until, normalized', [
+    (datetime(2021, 6, 1, 12, 30, 15, 999999), False, '2021-06-01T12:30:15Z'),
+    (datetime(2021, 6, 1, 14, 30, tzinfo=timezone(timedelta(hours=2))), False, '2021-06-01T12:30:00Z'),
+    ('2021-06-01T12:30:15Z', True, '2021-06-01T12:30:15Z'),
+    ('2021-06-01', False, '2021-06-01T00:00:00Z'),
+    ('2021-06-01', True, '2021-06-01T23:59:59Z'),
+])
+def test_normalize_date(date, until, normalized):
+    assert normalize_date(date, until) == normalized
@@ -0,0 +1,31 @@
+from idset import IdentifierSet
+
+
+def test_misses_are_answered_and_updates_added():
+    published = {100001: '2020-01-01', 100003: '2020-01-01'}
+    scans = []
+
+    def scan(since):
+        scans.append(since)
+        yield [publication_id for publication_id, updated_at in published.items()
+               if since is None or updated_at >= since.strftime('%Y-%m-%d')]
+
+    ids = IdentifierSet(scan, 60, margin=300)
+    ids.refresher.get()
+    assert ids.contains('gup_100001') is True
+    assert ids.contains('gup_100002') is False
+    assert ids.contains('gup_x') is False
+
+    published[100002] = '2999-01-01'
+    ids.refresher.refresh()
+    assert scans[0] is None and scans[1] is not None
+    assert ids.contains('gup_100002') is True
+    assert list(ids.refresher.value) == [100001, 100002, 100003]
+
+
+def test_stale_array_asks_es():
+    ids = IdentifierSet(lambda since: iter([[100001]]), 60)
+    ids.refresher.get()
+    ids.refresher.loaded_at -= 600
+    assert ids.contains('gup_100001') is True
+    assert ids.contains('gup_100002') is None
@@ -0,0 +1,25 @@
+import re
+
+import pytest
+
+from config import Config
+from gupprovider import GUPProvider
+from oai_repo.repository import OAIRepository
+from resources import SharedResources
+from standin import StandInES, synthetic_publications
+
+
+@pytest.mark.parametrize('compact', ['false', 'true'])
+def test_byte_budget_closes_a_page_early(environ, compact):
+    config = Config.from_env({
+        **environ, 'COUNT': '50', 'PAGE_BYTE_BUDGET': '40000', 'COMPACT_XML': compact,
+        'IDENTIFIER_REFRESH_INTERVAL': '0',
+    })
+    shared = SharedResources()
+    shared.clients[config.es_host] = StandInES(synthetic_publications(60))
+    repo = OAIRepository(GUPProvider(config, shared))
+    document = repo.process({'verb': 'ListRecords', 'metadataPrefix': 'mods'}).document()
+    records = document.count(b'<record>')
+    assert 0 < records < 50 and re.search(rb'<resumptionToken[^>]*>[^<]+</resumptionToken>', document)
+    # The page is closed once it holds the budget, a record after it went over
+    assert len(document) >= 40000
@@ -0,0 +1,18 @@
+import sys
+import types
+
+from memguard import MemoryGuard
+
+
+def test_guard_is_off_without_a_worker_manager(monkeypatch):
+    monkeypatch.setenv('MEMORY_LIMIT_MB', '512')
+    monkeypatch.delitem(sys.modules, 'gunicorn.arbiter', raising=False)
+    monkeypatch.delitem(sys.modules, 'uwsgi', raising=False)
+    assert MemoryGuard.from_env() is None
+
+
+def test_guard_is_on_in_a_gunicorn_worker(monkeypatch):
+    monkeypatch.setenv('MEMORY_LIMIT_MB', '512')
+    monkeypatch.setitem(sys.modules, 'gunicorn.arbiter', types.ModuleType('gunicorn.arbiter'))
+    guard = MemoryGuard.from_env()
+    assert guard is not None and guard.limit == 512 * 2 ** 20
@@ -0,0 +1,34 @@
+from http import HTTPStatus
+
+import pytest
+
+from config import Config
+from gupprovider import GUPProvider
+from oai_repo.repository import OAIRepository
+from readiness import Readiness
+from resources import SharedResources
+from standin import StandInES, synthetic_publications
+
+
+def provider(environ, publications: list) -> GUPProvider:
+    config = Config.from_env({**environ, 'IDENTIFIER_REFRESH_INTERVAL': '0'})
+    shared = SharedResources()
+    shared.clients[config.es_host] = StandInES(publications)
+    return GUPProvider(config, shared)
+
+
+def identify(data_provider: GUPProvider):
+    repo = OAIRepository(data_provider)
+    return lambda parameters: (repo.process(parameters).document(), HTTPStatus.OK, {})
+
+
+@pytest.mark.parametrize('count', [5, 0])
+def test_warm_renders_a_publication_of_the_index(environ, count):
+    data_provider = provider(environ, synthetic_publications(count))
+    readiness = Readiness(data_provider, identify(data_provider))
+    readiness.warm()
+    assert readiness.ready and readiness.error is None
+    sample = readiness.sample()
+    assert (sample is None) == (count == 0)
+    if sample is not None:
+        assert not sample['deleted']
@@ -0,0 +1,43 @@
+import json
+import tracemalloc
+
+from records import Publication, compact_hit
+from standin import synthetic_publications
+
+
+def search_response(publications: list) -> bytes:
+    return json.dumps({'hits': {'hits': [
+        {'_index': 'publications', '_id': publication['id'], '_score': None, '_source': publication,
+         'sort': [publication['publication_id']]}
+        for publication in publications
+    ]}}).encode()
+
+
+def traced(build) -> tuple:
+    # (memory kept, peak memory) of building and keeping what build() returns
+    tracemalloc.start()
+    try:
+        kept = build()
+        return tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+
+def test_records_read_like_source():
+    source = synthetic_publications(1)[0]
+    record = compact_hit({'_source': source, 'sort': [1]})['_source']
+    assert isinstance(record, Publication)
+    assert record['title'] == source['title']
+    assert record.get('no_such_field') is None
+    assert ('authors' in record) == ('authors' in source)
+
+
+def test_pages_of_records_take_less_memory_than_dicts():
+    raw = search_response(synthetic_publications(100))
+    # Five pages held at once, like the pages of a harvest that are prefetched and rendered
+    dict_kept, dict_peak = traced(lambda: [json.loads(raw)['hits']['hits'] for page in range(5)])
+    record_kept, record_peak = traced(
+        lambda: [[compact_hit(hit) for hit in json.loads(raw)['hits']['hits']] for page in range(5)]
+    )
+    assert record_kept < dict_kept * 0.8
+    assert record_peak < dict_peak * 0.9
@@ -0,0 +1,8 @@
+from sets import SetHierarchy
+
+
+def test_top_level_sets_name_the_configured_institution():
+    sets = SetHierarchy(None, 3600, str, institution='Chalmers')
+    assert sets.get('department') == ('Institutioner', 'Publications by department at Chalmers')
+    assert sets.get('department:1304') == ('1304', '1304')
+    assert sets.get('unknown') is None
@@ -0,0 +1,32 @@
+from slices import SlicedFetch
+from standin import StandInES, synthetic_publications
+
+QUERY = {'query': {'match_all': {}}, 'sort': [{'publication_id': {'order': 'asc'}}]}
+
+
+class RenewingES(StandInES):
+    # Returns a new id for the point in time with every search, as ES may
+    def __init__(self, documents: list):
+        super().__init__(documents)
+        self.closed = []
+
+    def search(self, index: str = None, body: dict = None, **kwargs) -> dict:
+        results = super().search(index, body, **kwargs)
+        if body and 'pit' in body:
+            results['pit_id'] = renewed = body['pit']['id'] + '+'
+            self.pits[renewed] = self.pits[body['pit']['id']]
+        return results
+
+    def close_point_in_time(self, id: str = None, **kwargs) -> dict:
+        self.closed.append(id)
+        return super().close_point_in_time(id, **kwargs)
+
+
+def test_scan_closes_the_latest_point_in_time_ids():
+    es = RenewingES(synthetic_publications(50))
+    batches = list(SlicedFetch(3, 10).scan(es, 'publications', QUERY, 10, '1m'))
+    ids = [hit['_source']['publication_id'] for batch in batches for hit in batch]
+    assert ids == sorted(ids) and len(ids) == 50
+    assert es.closed and all(pit_id.endswith('+') for pit_id in es.closed)
+    # Every slice was read to the end, so the ids it last got were never used again
+    assert all(pit_id + '+' not in es.closed for pit_id in es.closed)
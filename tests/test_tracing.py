@@ -0,0 +1,66 @@
+import json
+import logging
+import threading
+import time
+from functools import partial
+from http import HTTPStatus
+
+from oai_repo.resumption import ResumptionToken
+
+from cache import MemoryCache
+from coalesce import SingleFlight
+from tracing import RESUMPTION_TOKEN, HarvestTracer, building, timed, token_session
+
+
+def first_page() -> bytes:
+    token = ResumptionToken()
+    token.verb, token.cursor, token.complete_list_size = 'ListRecords', 0, 200
+    token.args = {'metadataPrefix': 'mods'}
+    return (b'<OAI-PMH><ListRecords><header/><header/><resumptionToken cursor="0" completeListSize="200">'
+            + token.create().encode() + b'</resumptionToken></ListRecords></OAI-PMH>')
+
+
+PAGE = first_page()
+
+
+def test_joining_a_flight_is_traced_as_shared(caplog):
+    tracer = HarvestTracer(MemoryCache(100), 60)
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def handle(parameters: dict) -> tuple:
+        with timed('es'):
+            started.set()
+            release.wait(5)
+        return PAGE, HTTPStatus.OK, {}
+
+    documents = []
+
+    def answer(parameters: dict) -> tuple:
+        run = partial(flights.do, 'page', partial(building, handle))
+        documents.append(tracer.trace(run, parameters, 'client')[0])
+
+    with caplog.at_level(logging.INFO, logger='harvest'):
+        leader = threading.Thread(target=answer, args=({'verb': 'ListRecords'},))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=answer, args=({'verb': 'ListRecords'},))
+        follower.start()
+        # The follower has joined the flight once it waits on it
+        for attempt in range(500):
+            if any(flight.done._cond._waiters for flight in list(flights.flights.values())):
+                break
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+    entries = [json.loads(record.message) for record in caplog.records]
+    pages = [entry for entry in entries if entry['event'] == 'page']
+    assert sorted(page['shared'] for page in pages) == [False, True]
+    shared = next(page for page in pages if page['shared'])
+    assert shared['es_ms'] == 0 and shared['records'] == 2
+    # Each harvester has a session of its own, carried in the token it got
+    assert pages[0]['session'] != pages[1]['session']
+    tokens = [RESUMPTION_TOKEN.search(document).group(1).decode() for document in documents]
+    assert {token_session(token, 'ListRecords') for token in tokens} == {page['session'] for page in pages}
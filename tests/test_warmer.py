@@ -0,0 +1,36 @@
+from datetime import date
+from http import HTTPStatus
+
+from oai_repo.resumption import ResumptionToken
+
+from warmer import ChangeWarmer
+
+
+class Responses:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ttl):
+        self.values[key] = (value, ttl)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def warmer(responses) -> ChangeWarmer:
+    return ChangeWarmer(None, lambda parameters: (b'<page/>', HTTPStatus.OK, {}), responses,
+                        interval=60, lookback=3600, margin=60, from_days=[0, 1], formats=['mods'])
+
+
+def test_warmed_pages_expire_before_their_tokens(monkeypatch):
+    monkeypatch.setattr(ResumptionToken, 'ttl', 3600)
+    responses = Responses()
+    warmer(responses).warm_pages(date(2024, 5, 2))
+    assert [ttl for value, ttl in responses.values.values()] == [3240, 3240]
+
+
+def test_pages_are_not_kept_past_short_tokens(monkeypatch):
+    monkeypatch.setattr(ResumptionToken, 'ttl', 60)
+    responses = Responses()
+    warmer(responses).warm_pages(date(2024, 5, 2))
+    assert responses.values == {}
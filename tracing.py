@@ -0,0 +1,193 @@
+"""
+Tracing of harvests across their resumptionToken chains.
+
+A harvest session starts with the first ListRecords or ListIdentifiers request without a token.
+Its id is carried in the resumptionTokens of the following pages (the "sid" argument). Every page
+is logged as one JSON line on the "harvest" logger, and the totals of the session are kept in the
+"sessions" cache tier (see cache.py) and logged when its last page has been served. With a
+shared CACHE_URL the totals include pages served by other workers and nodes.
+
+    {"event": "page", "session": "...", "verb": "ListRecords", "cursor": 2000, "records": 100, ...}
+    {"event": "session", "session": "...", "pages": 41, "records": 4012, "wall_ms": 61250.3, ...}
+
+A first page can be shared by several harvesters (it joined the flight of a concurrent request or
+came from the response cache), so its session is not chosen while it is built: each request for a
+first page starts a session of its own, and the token of the response it gets is signed again with
+that session. The pages after it carry the session of the token they were asked for.
+
+Times spent waiting for ES and rendering metadata are added to the page being traced by the
+current thread with timed('es') and timed('render'). A page that was not built by the traced
+request itself, because it joined the flight of a concurrent request for the same page (see
+coalesce.py) or was answered from the response cache, is logged with "shared": true, and its ES
+and render times are those of the request that built it, not counted again.
+
+The pages of a session follow each other, each asked for with the token of the one before, and
+the totals are updated under a lock, so they are not updated concurrently.
+"""
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+from oai_repo.exceptions import OAIErrorBadResumptionToken
+from oai_repo.resumption import ResumptionToken
+
+from cache import open_cache
+from prefetch import next_token
+
+logger = logging.getLogger('harvest')
+
+RESUMPTION_CURSOR = re.compile(rb'<resumptionToken[^>]*\scursor="(\d+)"')
+RESUMPTION_TOKEN = re.compile(rb'<resumptionToken[^>]*>([^<]+)</resumptionToken>')
+
+_local = threading.local()
+
+
+class PageTrace:
+    def __init__(self):
+        self.built = False
+        self.es = 0.0
+        self.render = 0.0
+
+
+@contextmanager
+def timed(kind: str):
+    # Add the time of the block to the page traced by this thread, if any
+    page = getattr(_local, 'page', None)
+    if page is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(page, kind, getattr(page, kind) + time.perf_counter() - started)
+
+
+def building(handler, parameters: dict) -> tuple:
+    # Run handler as the request that builds the page traced by this thread
+    page = getattr(_local, 'page', None)
+    if page is not None:
+        page.built = True
+    return handler(parameters)
+
+
+def new_session() -> str:
+    return secrets.token_hex(6)
+
+
+def token_session(token: str, verb: str) -> str:
+    # The session id in a resumptionToken, if it is a valid token of the verb
+    try:
+        resumption = ResumptionToken()
+        resumption.parse(token, verb)
+        return resumption.args.get('sid')
+    except OAIErrorBadResumptionToken:
+        return None
+
+
+def with_session(document: bytes, verb: str, session: str) -> bytes:
+    # The document with its resumptionToken signed again to carry the session
+    match = RESUMPTION_TOKEN.search(document)
+    if match is None:
+        return document
+    resumption = ResumptionToken()
+    resumption.parse(match.group(1).decode('ascii'), verb)
+    resumption.args['sid'] = session
+    return document[:match.start(1)] + resumption.create().encode('ascii') + document[match.end(1):]
+
+
+def milliseconds(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class HarvestTracer:
+    def __init__(self, sessions, session_ttl: float):
+        self.sessions = sessions
+        self.session_ttl = session_ttl
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        # Tracing is off unless TRACE_HARVESTS is true
+        if os.environ.get('TRACE_HARVESTS', 'false').lower() != 'true':
+            return None
+        return cls(
+            open_cache('sessions', int(os.environ.get('TRACE_SESSIONS', '10000'))),
+            float(os.environ.get('TRACE_SESSION_TTL', '86400')),
+        )
+
+    def trace(self, handler, parameters: dict, client: str = None):
+        # The verb is popped from the parameters by OAIRepository, so take it up front
+        verb = parameters.get('verb')
+        token = parameters.get('resumptionToken')
+        _local.page = page = PageTrace()
+        started = time.perf_counter()
+        try:
+            response = handler(parameters)
+        finally:
+            _local.page = None
+        session = token_session(token, verb) if token else None
+        if session is None:
+            # A first page, which this request starts a session with
+            session = new_session()
+            if response[1] == HTTPStatus.OK:
+                response = (with_session(response[0], verb, session), *response[1:])
+        self.finish(page, session, verb, client, response, time.perf_counter() - started)
+        return response
+
+    def finish(self, page: PageTrace, session: str, verb: str, client: str, response: tuple, wall: float):
+        document, status = response[0], response[1]
+        cursor = RESUMPTION_CURSOR.search(document)
+        last = status != HTTPStatus.OK or next_token(document) is None
+        entry = {
+            'event': 'page',
+            'session': session,
+            'verb': verb,
+            'client': client,
+            'status': int(status),
+            'cursor': int(cursor.group(1)) if cursor else 0,
+            'records': document.count(b'<header'),
+            'bytes': len(document),
+            'wall_ms': milliseconds(wall),
+            'es_ms': milliseconds(page.es),
+            'render_ms': milliseconds(page.render),
+            'shared': not page.built,
+            'last': last,
+        }
+        logger.info(json.dumps(entry))
+
+        with self.lock:
+            self.add(session, verb, client, entry, last)
+
+    def add(self, session: str, verb: str, client: str, entry: dict, last: bool):
+        totals = self.sessions.get(session)
+        totals = json.loads(totals) if totals is not None else {
+            'event': 'session',
+            'session': session,
+            'verb': verb,
+            'client': client,
+            'started': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'started_at': time.time(),
+            'pages': 0, 'records': 0, 'bytes': 0, 'wall_ms': 0, 'es_ms': 0, 'render_ms': 0,
+            'shared_pages': 0, 'slowest_ms': 0, 'slowest_cursor': None,
+        }
+        totals['pages'] += 1
+        totals['shared_pages'] = totals.get('shared_pages', 0) + entry['shared']
+        for key in ('records', 'bytes', 'wall_ms', 'es_ms', 'render_ms'):
+            totals[key] = round(totals[key] + entry[key], 1)
+        if entry['wall_ms'] >= totals['slowest_ms']:
+            totals['slowest_ms'], totals['slowest_cursor'] = entry['wall_ms'], entry['cursor']
+        if last:
+            totals['status'] = entry['status']
+            totals['elapsed_s'] = round(time.time() - totals.pop('started_at'), 1)
+            logger.info(json.dumps(totals))
+            self.sessions.delete(session)
+        else:
+            self.sessions.set(session, json.dumps(totals).encode(), self.session_ttl)
@@ -0,0 +1,127 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+
+from oai_repo.resumption import ResumptionToken
+
+from cache import response_key
+from refresher import PeriodicRefresher
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeWarmer:
+    """
+    Renders publications soon after GUP has changed them, before harvesters come asking.
+
+    Every `interval` seconds the index is searched for publications updated since the previous
+    poll, less `margin` seconds for updates that became searchable late (the first poll looks
+    `lookback` seconds back). Their metadata is rendered in each of `formats` into the fragment
+    cache of the provider. When anything has changed, or a new day has begun, the first
+    ListRecords page of each incremental window (from = today less each of `from_days`) is built
+    again with `render_page` and kept in the response cache. Cached GetRecord responses of changed
+    publications are dropped.
+
+    A kept page was read after its responseDate was set, like any other response, so a harvester
+    continuing from that responseDate still gets every later update. A page is kept no longer than
+    its resumptionToken stays valid, less a margin for the harvester to follow it (see page_ttl),
+    and is built again once it has expired.
+    """
+    # Warmed pages are built again every day, and dropped when they are no longer warmed
+    PAGE_TTL = 86400
+
+    def __init__(self, provider, render_page, responses, interval: float, lookback: float,
+                 margin: float, from_days: list, formats: list):
+        self.provider = provider
+        self.render_page = render_page
+        self.responses = responses
+        self.interval = interval
+        self.margin = timedelta(seconds=margin)
+        self.from_days = from_days
+        self.formats = formats
+        self.page_keys = set()
+        self.pages_date = None
+        self.pages_expire_at = None
+        self.seen = set()
+        self.checkpoint = datetime.now(timezone.utc) - timedelta(seconds=lookback)
+
+    @classmethod
+    def from_env(cls, provider, render_page, responses):
+        # The warmer is off unless WARM_INTERVAL is set
+        interval = float(os.environ.get('WARM_INTERVAL', '0'))
+        if interval <= 0:
+            return None
+        return cls(
+            provider,
+            render_page,
+            responses,
+            interval=interval,
+            lookback=float(os.environ.get('WARM_LOOKBACK', '3600')),
+            margin=float(os.environ.get('WARM_MARGIN', '60')),
+            from_days=[int(days) for days in os.environ.get('WARM_FROM_DAYS', '0,1').split(',') if days],
+            formats=[format for format in os.environ.get('WARM_FORMATS', 'mods').split(',') if format],
+        )
+
+    def start(self):
+        PeriodicRefresher('warmer', self.poll, self.interval).start(immediately=True)
+
+    def poll(self) -> int:
+        started_at = datetime.now(timezone.utc)
+        # Versions of publications seen by this poll, those in the margin are seen again next time
+        seen = set()
+        for batch in self.provider.scan_publications(from_date=self.checkpoint):
+            for publication in batch:
+                seen.add((publication['id'], publication['updated_at']))
+                for metadata_prefix in self.formats:
+                    self.provider.cache_metadata(publication, metadata_prefix)
+        changed = seen - self.seen
+        for internal_identifier, updated_at in changed:
+            self.forget_records(internal_identifier)
+        self.seen = seen
+        self.checkpoint = started_at - self.margin
+        if changed or self.pages_date != started_at.date() or \
+                (self.pages_expire_at is not None and started_at.timestamp() >= self.pages_expire_at):
+            self.warm_pages(started_at.date())
+        logger.debug('Warmed %d publications updated since %s', len(changed), self.checkpoint)
+        return len(changed)
+
+    def forget_records(self, internal_identifier: str):
+        identifier = self.provider.get_oai_identifier(internal_identifier)
+        for metadata_format in self.provider.get_metadata_formats():
+            self.responses.delete(response_key({
+                'verb': 'GetRecord', 'identifier': identifier, 'metadataPrefix': metadata_format.metadata_prefix
+            }))
+
+    def page_ttl(self) -> float:
+        # Seconds to keep a page: not past the expiry of its resumptionToken (TOKEN_TTL), less a poll
+        # interval or a tenth of the token lifetime, whichever is longer, for the harvester to use it
+        ttl = ResumptionToken.ttl
+        if not ttl:
+            return self.PAGE_TTL
+        return min(self.PAGE_TTL, ttl - max(self.interval, ttl / 10))
+
+    def warm_pages(self, today):
+        ttl = self.page_ttl()
+        keys = set()
+        # Pages whose tokens would expire before harvesters get to them are not kept at all
+        for days in (self.from_days if ttl > 0 else []):
+            for metadata_prefix in self.formats:
+                parameters = {
+                    'verb': 'ListRecords',
+                    'metadataPrefix': metadata_prefix,
+                    'from': (today - timedelta(days=days)).isoformat(),
+                }
+                key = response_key(parameters)
+                document, status, headers = self.render_page(parameters)
+                if status == HTTPStatus.OK:
+                    self.responses.set(key, document, ttl)
+                    keys.add(key)
+        # Pages of windows that are no longer warmed would only get older
+        for key in self.page_keys - keys:
+            self.responses.delete(key)
+        self.page_keys = keys
+        self.pages_date = today
+        self.pages_expire_at = time.time() + ttl if keys else None
+